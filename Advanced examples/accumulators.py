@@ -0,0 +1,220 @@
+#Streaming, mergeable summaries of bootstrap replications
+#Instead of collecting every replication in a list, each worker reduces its
+#chunk into a small state object that is sent back and merged. Moments
+#(mean, variance, skewness, kurtosis) are exact and need O(1) memory, quantiles
+#come from a KLL sketch with a guaranteed rank error.
+
+import math
+import numpy as np
+import morestatistics
+
+
+class Moments:
+	"""Count, mean and central moment sums M2, M3, M4 of a stream of values.
+	Blocks are merged with the pairwise formulas of Chan et al. and Pebay
+	(2008), which are numerically stable and give the same result in any
+	order (up to rounding)"""
+
+	def __init__(self):
+		self.count = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+		self.m3 = 0.0
+		self.m4 = 0.0
+
+	def add(self, values):
+		"""Adds a block of values"""
+		values = np.asarray(values, dtype=np.float64)
+		if len(values) == 0:
+			return
+		block = Moments()
+		block.count = len(values)
+		block.mean = float(values.mean())
+		centered = values - block.mean
+		squares = centered ** 2
+		block.m2 = float(squares.sum())
+		block.m3 = float((squares * centered).sum())
+		block.m4 = float((squares ** 2).sum())
+		self.merge(block)
+
+	def merge(self, other):
+		"""Combines the moments of two disjoint streams"""
+		na, nb = self.count, other.count
+		if nb == 0:
+			return
+		if na == 0:
+			self.count, self.mean, self.m2, self.m3, self.m4 = nb, other.mean, other.m2, other.m3, other.m4
+			return
+		n = na + nb
+		delta = other.mean - self.mean
+		m2 = self.m2 + other.m2 + delta ** 2 * na * nb / n
+		m3 = (self.m3 + other.m3 + delta ** 3 * na * nb * (na - nb) / n ** 2
+			+ 3 * delta * (na * other.m2 - nb * self.m2) / n)
+		m4 = (self.m4 + other.m4 + delta ** 4 * na * nb * (na ** 2 - na * nb + nb ** 2) / n ** 3
+			+ 6 * delta ** 2 * (na ** 2 * other.m2 + nb ** 2 * self.m2) / n ** 2
+			+ 4 * delta * (na * other.m3 - nb * self.m3) / n)
+		self.count, self.mean, self.m2, self.m3, self.m4 = n, self.mean + delta * nb / n, m2, m3, m4
+
+	def variance(self):
+		"""Sample variance (like statistics.variance)"""
+		return self.m2 / (self.count - 1)
+
+	def stdev(self):
+		"""Sample standard deviation (like statistics.stdev)"""
+		return math.sqrt(self.variance())
+
+	def skewness(self):
+		if self.m2 == 0:
+			return math.nan
+		return math.sqrt(self.count) * self.m3 / self.m2 ** 1.5
+
+	def kurtosis(self):
+		"""Kurtosis (not excess kurtosis) like morestatistics.kurtosis"""
+		if self.m2 == 0:
+			return math.nan
+		return self.count * self.m4 / self.m2 ** 2
+
+
+class QuantileSketch:
+	"""Mergeable quantile sketch (KLL, Karnin, Lang and Liberty 2016). Values
+	are kept in compactors, an item on level h stands for 2 ** h values. The
+	top level holds up to k items, every level below 2/3 as many (at least
+	2). When a level is full, it is sorted and every second item moves up one
+	level. As long as no compaction happened, all values are stored and the
+	results are identical to morestatistics.percentiles"""
+
+	SHRINK = 2 / 3		#capacity factor per level below the top
+
+	def __init__(self, k=4096):
+		"""
+		Args:
+			k (int): Capacity of the top level, about 3 * k items are stored.
+				The rank error is about 1 / k, error_bound() gives the
+				guaranteed maximum of the current sketch (default is 4096)
+		"""
+		self.k = k
+		self.levels = [np.empty(0)]
+		self.parity = [0]		#alternates which half is promoted, avoids a bias
+		self.count = 0
+		self.rank_error = 0		#worst case error of any rank, in values
+
+	def add(self, values):
+		"""Adds a block of values"""
+		values = np.asarray(values, dtype=np.float64)
+		self.levels[0] = np.concatenate([self.levels[0], values])
+		self.count += len(values)
+		self._compress()
+
+	def merge(self, other):
+		"""Adds all values summarized by another sketch"""
+		for h, items in enumerate(other.levels):
+			if h == len(self.levels):
+				self.levels.append(np.empty(0))
+				self.parity.append(0)
+			self.levels[h] = np.concatenate([self.levels[h], items])
+		self.count += other.count
+		self.rank_error += other.rank_error
+		self._compress()
+
+	def capacity(self, h):
+		"""Number of items level h may hold, shrinks geometrically downwards"""
+		return max(2, math.ceil(self.k * self.SHRINK ** (len(self.levels) - 1 - h)))
+
+	def _compress(self):
+		#Compacts the lowest full level until all levels fit. A new top level
+		#lowers the capacities below it
+		h = 0
+		while h < len(self.levels):
+			if len(self.levels[h]) <= self.capacity(h):
+				h += 1
+				continue
+			items = np.sort(self.levels[h])
+			keep = items[len(items) - len(items) % 2:]		#odd item stays on this level
+			items = items[:len(items) - len(items) % 2]
+			if h + 1 == len(self.levels):
+				self.levels.append(np.empty(0))
+				self.parity.append(0)
+			self.levels[h + 1] = np.concatenate([self.levels[h + 1], items[self.parity[h]::2]])
+			self.parity[h] = 1 - self.parity[h]
+			self.levels[h] = keep
+			self.rank_error += 2 ** h
+			h = 0
+
+	def __len__(self):
+		return self.count
+
+	def error_bound(self):
+		"""Maximum error of share_below and of the rank of any percentile,
+		as a fraction of count"""
+		return self.rank_error / max(1, self.count)
+
+	def _weighted(self):
+		values = np.concatenate(self.levels)
+		weights = np.concatenate([np.full(len(items), 2.0 ** h) for h, items in enumerate(self.levels)])
+		order = np.argsort(values, kind="stable")
+		return values[order], np.cumsum(weights[order])
+
+	def percentiles(self, percents):
+		"""Several percentiles at once, exact until the first compaction"""
+		if len(self.levels) == 1:
+			return morestatistics.percentiles(self.levels[0], percents)
+		values, cumulative = self._weighted()
+		targets = np.asarray(percents) / 100 * cumulative[-1]
+		positions = np.minimum(np.searchsorted(cumulative, targets), len(values) - 1)
+		return values[positions].tolist()
+
+	def share_below(self, x):
+		"""Share of values smaller than x"""
+		total = sum(2.0 ** h * len(items) for h, items in enumerate(self.levels))
+		below = sum(2.0 ** h * (items < x).sum() for h, items in enumerate(self.levels))
+		return below / total
+
+
+class StreamSummary:
+	"""Moments plus quantile sketch of bootstrap replications. Works in
+	place of the list of replications in bootstrap_ci: len, percentiles,
+	mean, stdev and kurtosis are available, += merges another summary.
+	NaN values (failed evaluations) are skipped"""
+
+	def __init__(self, k=4096):
+		self.moments = Moments()
+		self.sketch = QuantileSketch(k)
+
+	def add(self, values):
+		values = np.asarray(values, dtype=np.float64)
+		values = values[~np.isnan(values)]
+		self.moments.add(values)
+		self.sketch.add(values)
+
+	def merge(self, other):
+		self.moments.merge(other.moments)
+		self.sketch.merge(other.sketch)
+
+	def __iadd__(self, other):
+		self.merge(other)
+		return self
+
+	def __len__(self):
+		return self.moments.count
+
+	def mean(self):
+		return self.moments.mean
+
+	def stdev(self):
+		return self.moments.stdev()
+
+	def kurtosis(self):
+		return self.moments.kurtosis()
+
+	def percentiles(self, percents):
+		return self.sketch.percentiles(percents)
+
+	def share_below(self, x):
+		return self.sketch.share_below(x)
+
+
+def summarize(values, k=4096):
+	"""Returns a StreamSummary of a block of values"""
+	summary = StreamSummary(k)
+	summary.add(values)
+	return summary
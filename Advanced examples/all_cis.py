@@ -2,73 +2,495 @@
 #Felix Bittmann, 2020
 #Requires Python 3.6 because of random.choices
 
+import math
 import time
 import random
 from statistics import mean, stdev
-from multiprocessing import Queue, Process
 from morestatistics import *
+import numpy as np
+import vectorboot
+from kernels import get_function, get_kernel
+from designs import Design, get_design, _codes
+import doubleboot
+from accumulators import summarize
+from replicatestore import ARRAYS, statistic_identity
+from calibration import Progress, timed, roundtrip, process_startup, usable_cores, predict, report
+import instrumentation
+from engine import ResamplingEngine, SharedArray, publish, attach, chunk_rng, run_serial, DEFAULT_CHUNKS
 
 
-def run_benchmark(data, res):
-	"""Computing a runtime estimate"""
-	t_start = time.monotonic()
-	ntotal = res["reps1"] * max(1, res["reps2"])
-	testsize = 1000
-	trash = [res["func"](random.choices(data, k=res["n"])) for i in range(testsize)]
-	t_end = time.monotonic()
-	time1 = t_end - t_start
-	t_start = time.monotonic()
-	trash = acceleration_coefficient(res["func"], data)
-	t_end = time.monotonic()
-	time2 = t_end - t_start
-	estimated_runtime = ((ntotal / testsize) * time1) / res["threads"] + time2
-	estimated_runtime = estimated_runtime + (estimated_runtime * 0.20)		#Add buffer
-	
-	if 0 <= estimated_runtime < 5:
-		print("Estimated runtime below 5 seconds")
-	elif 5 <= estimated_runtime < 60:
-		print(f"Estimated runtime about {estimated_runtime:.0f} seconds")
-	elif 60 <= estimated_runtime < 3600:
-		print(f"Estimated runtime about {estimated_runtime / 60:.1f} minutes")
+def run_benchmark(data, res, engine=None):
+	"""Predicts runtime and peak memory. Every phase (draw, gather, statistic,
+	transport, reduce, jackknife) is timed separately on the given data and
+	combined with the process startup and the usable cores (see
+	calibration.py). Prints the estimate and returns the prediction"""
+	n, reps1, reps2 = res["n"], res["reps1"], res["reps2"]
+	parallel = engine is not None or res["backend"] != "numpy"
+	chunks = DEFAULT_CHUNKS if engine is None else engine.chunks
+	values = np.asarray(data, dtype=np.float64)
+	design = get_design(res["design"])
+	phases = {}
+	if res["backend"] == "numpy":
+		rows = min(256, res["batch_size"] or vectorboot.default_batch_size(values.size))
+		rng = np.random.default_rng()
+		if res["resampling"] == "weights" or (design is not None and design.clustered):
+			if design is None:
+				draw = lambda: next(vectorboot.count_batches(n, rows, rows, rng))
+			else:
+				draw = lambda: next(design.count_batches(rows, rows, rng))
+			counts = draw()
+			phases["draw"] = timed(draw) / rows
+			phases["gather"] = 0.0		#no resample is built
+			phases["statistic"] = timed(vectorboot.apply_weighted_statistic, res["func"], values, counts) / rows
+		else:
+			if design is None:
+				draw = lambda: rng.integers(0, n, size=(rows, n))
+			else:
+				draw = lambda: next(design.index_batches(rows, rows, rng))
+			indices = draw()
+			block = values[indices]
+			phases["draw"] = timed(draw) / rows
+			phases["gather"] = timed(values.__getitem__, indices) / rows
+			phases["statistic"] = timed(vectorboot.apply_statistic, res["func"], block) / rows
+			se_function = doubleboot.get_inner_se(res["func"]) if res["inner_se"] == "auto" else None
+			if reps2 > 0 and se_function is not None and not res["calibrate"]:
+				phases["statistic"] += timed(se_function, block) / rows
+				reps2 = 0		#no inner loop
+		#Blocks of indices, gathered values and kernel temporaries per worker
+		block_bytes = 3 * 8 * (res["batch_size"] or vectorboot.default_batch_size(values.size)) * values.size
+		worker_bytes = min(block_bytes, 3 * 8 * reps1 * values.size)
 	else:
-		print(f"Estimated runtime about {estimated_runtime / 3600:.1f} hours")
+		testsize = 200
+		indices = [random.choices(range(n), k=n) for i in range(testsize)]
+		samples = [[data[i] for i in positions] for positions in indices]
+		phases["draw"] = timed(lambda: [random.choices(range(n), k=n) for i in range(testsize)]) / testsize
+		phases["gather"] = timed(lambda: [[data[i] for i in positions] for positions in indices]) / testsize
+		if design is None and reps2 == 0 and get_kernel(res["func"]) is not None:
+			block = np.asarray(samples, dtype=np.float64)
+			phases["statistic"] = timed(vectorboot.apply_statistic, res["func"], block) / testsize
+		else:
+			phases["statistic"] = timed(lambda: [res["func"](sample) for sample in samples]) / testsize
+		worker_bytes = values.nbytes + 32 * values.size		#list copy of the data per worker
+	for name in ("draw", "gather", "statistic"):
+		phases[name] *= 1 + reps2		#every outer resample has reps2 inner ones
+	
+	if engine is None and res["backend"] != "numpy":
+		phases["startup"] = process_startup() * res["threads"]
+	if parallel:
+		#Every chunk sends its task and returns a small result
+		phases["transport"] = min(chunks, reps1) * (roundtrip(res) + roundtrip((0, 0)))
+		if res["backend"] != "numpy":
+			phases["transport"] += min(chunks, reps1) * timed(values.tolist)		#workers convert to lists
+	sample_size = min(reps1, 20_000)
+	replicates = np.random.default_rng().normal(size=sample_size).tolist()
+	reduction = {"theta_hat": 0.0, "se_boot": 1.0, "alpha": res["alpha"]}
+	phases["reduce"] = (timed(lambda: (stdev(replicates), compute_intervals(reduction, replicates, [], 0.0)))
+		* (1 + (reps2 > 0)) * reps1 / sample_size)
+	def jackknife():
+		try:
+			if design is not None and design.clustered:
+				acceleration(design.jackknife(res["func"], data))
+			else:
+				acceleration_coefficient(res["func"], data)
+		except:
+			pass		#failures are reported by bootstrap_ci
+	phases["jackknife"] = timed(jackknife, min_time=0)
 	
+	outputs = 1 + (res["reps2"] > 0) + res["calibrate"]
+	if res["streaming"]:
+		result_bytes = outputs * 8 * res["sketch_size"] * 3		#merged sketches, about 3 * k items
+	else:
+		result_bytes = outputs * reps1 * (8 + 32)		#shared arrays and lists of floats
+	workers = usable_cores(res["threads"]) if parallel else 1
+	memory = values.nbytes + workers * worker_bytes + result_bytes
+	prediction = predict(phases, reps1, res["threads"], chunks, parallel, memory)
+	report(prediction)
+	return prediction
+
 
-def multifunc(data, res, queue):
-	"""Multihreading working function to generate bootstrap resamples"""
+def multifunc(data, res, reps1):
+	"""Multihreading working function to generate reps1 bootstrap resamples"""
 	theta_stars = []
 	tvalues = []		#only needed for double bootstrap
+	uvalues = []		#only needed for the calibrated interval
 	failed = 0			#bookkeeping
 	failed_inner = 0	#bookkeeping
-	reps1 = (res["reps1"] // res["threads"]) + 1
 
+	design = get_design(res["design"])
+	rng = None if design is None else chunk_rng()
+	timers = instrumentation.timers()		#does nothing unless the run is profiled
+	clock = timers.start()
+	if design is None and res["reps2"] == 0 and get_kernel(res["func"]) is not None:
+		#Resamples are drawn as usual, but evaluated with the kernel in blocks
+		rows = vectorboot.default_batch_size(res["n"] * len(data[0]) if isinstance(data[0], (list, tuple)) else res["n"])
+		for done in range(0, reps1, rows):
+			block = [random.choices(data, k=res["n"]) for t1 in range(min(rows, reps1 - done))]
+			clock = timers.lap("resample", clock)
+			values, failed_block = vectorboot.apply_statistic(res["func"], np.asarray(block, dtype=np.float64))
+			theta_stars.extend(values.tolist())
+			failed += failed_block
+			clock = timers.lap("statistic", clock)
+		return [theta_stars, tvalues, uvalues, failed, failed_inner]
 	for t1 in range(reps1):
-		bootsample1 = random.choices(data, k=res["n"])
+		if design is None:
+			bootsample1 = random.choices(data, k=res["n"])
+		else:
+			bootsample1 = design.resample(data, rng)
+		clock = timers.lap("resample", clock)
 		try:
 			theta_star = res["func"](bootsample1)
 		except:
+			theta_star = math.nan		#like the numpy backend, skipped in the results
+		if math.isnan(theta_star):
 			failed += 1
 		theta_stars.append(theta_star)
+		clock = timers.lap("statistic", clock)
 		
 		if res["reps2"] > 0:
 			innervalues = []
 			for t2 in range(res["reps2"]):
 				try:
-					innervalues.append(res["func"](random.choices(bootsample1, k=len(bootsample1))))
+					value = res["func"](random.choices(bootsample1, k=len(bootsample1)))
 				except:
+					value = math.nan
+				if math.isnan(value):
 					failed_inner += 1
-			tvalues.append((theta_star - res["theta_hat"]) / stdev(innervalues))
-	queue.put([theta_stars, tvalues, failed, failed_inner])
+				else:
+					innervalues.append(value)
+			se_inner = stdev(innervalues) if len(innervalues) > 1 else 0.0
+			if se_inner > 0:
+				tvalues.append((theta_star - res["theta_hat"]) / se_inner)
+			else:
+				tvalues.append(math.nan)		#like the numpy backend, skipped in the quantiles
+				failed_inner += 1
+			if res["calibrate"]:
+				below = sum(1 for value in innervalues if value <= res["theta_hat"])
+				uvalues.append(below / len(innervalues) if innervalues else math.nan)
+			clock = timers.lap("inner", clock)
+	return [theta_stars, tvalues, uvalues, failed, failed_inner]
+
+
+def vector_chunk(data, res, reps1):
+	"""Computes reps1 replications with the numpy backend and the random
+	stream of the chunk, the double bootstrap with the nested engine.
+	Returns the same as multifunc"""
+	rng = chunk_rng()
+	if res["reps2"] > 0:
+		return doubleboot.nested_bootstrap(res["func"], data, reps1, res["reps2"], res["theta_hat"],
+			res["batch_size"], rng, res["inner_se"], res["calibrate"], res["resampling"])
+	theta_stars, failed = vectorboot.bootstrap_replicates(res["func"], data, reps1,
+		res["batch_size"], rng, res["resampling"], get_design(res["design"]))
+	return theta_stars, [], None, failed, 0
+
+
+def write_outputs(outputs, start, reps1, results):
+	"""Writes the replications start ... start + reps1 of a chunk into the
+	shared output arrays (theta_stars, tvalues, uvalues)"""
+	for handle, values in zip(outputs, results):
+		if handle is not None:
+			attach(handle)[start:start + reps1] = values
+
+
+def multifunc_shared(data, res, outputs, start, reps1):
+	"""Runs multifunc on shared data and writes the results into the shared
+	output arrays"""
+	if not isinstance(data, list):
+		data = attach(data, as_list=True)
+	theta_stars, tvalues, uvalues, failed, failed_inner = multifunc(data, res, reps1)
+	write_outputs(outputs, start, reps1, (theta_stars, tvalues, uvalues))
+	return failed, failed_inner
+
+
+def vectorfunc(data, res, outputs, start, reps1):
+	"""Working function of the numpy backend, computes the replications
+	start ... start + reps1 with the random stream of the chunk"""
+	theta_stars, tvalues, uvalues, failed, failed_inner = vector_chunk(attach(data), res, reps1)
+	write_outputs(outputs, start, reps1, (theta_stars, tvalues, uvalues))
+	return failed, failed_inner
+
+
+def streamfunc(data, res, start, reps1):
+	"""Working function of the streaming mode for both backends. The chunk
+	is reduced to summaries (moments and quantile sketch), only these are
+	sent back instead of the replications"""
+	if res["backend"] == "numpy":
+		theta_stars, tvalues, uvalues, failed, failed_inner = vector_chunk(attach(data), res, reps1)
+	else:
+		if not isinstance(data, list):
+			data = attach(data, as_list=True)
+		theta_stars, tvalues, uvalues, failed, failed_inner = multifunc(data, res, reps1)
+	tsummary = summarize(tvalues, res["sketch_size"]) if res["reps2"] > 0 else None
+	usummary = summarize(uvalues, res["sketch_size"]) if res["calibrate"] else None
+	return start, summarize(theta_stars, res["sketch_size"]), tsummary, usummary, failed, failed_inner
 		
 		
-def bootstrap_ci(func, data, reps1, reps2=0, alpha=0.05, prec=3, threads=2, quiet=False, benchmark=False, seed=None):
+def _finite(values):
+	"""Replications without failed evaluations (NaN) and infinite values"""
+	return [value for value in values if math.isfinite(value)]
+
+
+def _select(select, values, percents):
+	"""select(values, percents) (percentiles or percentile_errors) for
+	levels given as fractions. Levels that are not finite, e.g. BCa with an
+	infinite bias correction when no replication is below theta_hat, give nan"""
+	finite = [math.isfinite(perc) for perc in percents]
+	results = select(values, [perc * 100 if ok else 50.0 for perc, ok in zip(percents, finite)])
+	return [result if ok else math.nan for result, ok in zip(results, finite)]
+
+
+def _by_level(values, alphas, single):
+	"""Interval of the only level or a dict {alpha: interval} of all levels"""
+	return values[0] if single else dict(zip(alphas, values))
+
+
+def compute_intervals(res, theta_stars, tvalues, a, uvalues=()):
+	"""Computes all confidence intervals from the replications and stores
+	them in res. All needed percentiles of the replications are selected in
+	a single pass, the lists are neither sorted nor modified
+	
+	Args:
+		res (dict): Needs theta_hat, se_boot and alpha. alpha can also be a
+			list of levels, e.g. [0.2, 0.1, 0.05, 0.01, 0.001]. Then every
+			interval is a dict {alpha: (lower, upper)}, z0 and the selection
+			are computed only once for all levels
+		theta_stars (list): Bootstrap replications or their StreamSummary
+		tvalues (list): t-values of the double bootstrap, may be empty or a
+			StreamSummary
+		a (float): Acceleration coefficient, if None BCa is not computed
+		uvalues (list): Shares of inner replicates at most theta_hat for the
+			calibrated interval, may be empty or a StreamSummary
+	
+	Returns:
+		percents: levels (as fractions) of the percentile, BC and BCa bounds,
+			one group of 4 (6 with BCa) per alpha
+	"""
+	alphas, single = alpha_levels(res["alpha"])
+	tcrits = [abs(inverse_normal_CDF(1 - (alpha / 2))) for alpha in alphas]
+	tails = [perc * 100 for alpha in alphas for perc in (alpha / 2, 1 - (alpha / 2))]
+	
+	### Normal Based ###
+	res["normal"] = _by_level([(res["theta_hat"] - tcrit * res["se_boot"], res["theta_hat"] + tcrit * res["se_boot"])
+		for tcrit in tcrits], alphas, single)
+	
+	### BC ###
+	if hasattr(theta_stars, "share_below"):
+		share_smaller = theta_stars.share_below(res["theta_hat"])
+	else:
+		n_smaller = sum([1 for theta in theta_stars if theta < res["theta_hat"] ])
+		share_smaller = n_smaller / len(theta_stars)
+	z = inverse_normal_CDF(share_smaller)
+	
+	### Percentile, BC and BCa ###
+	percents = []
+	for alpha, tcrit in zip(alphas, tcrits):
+		percents += [alpha / 2, 1 - (alpha / 2), normal_CDF(2 * z - tcrit), normal_CDF(2 * z + tcrit)]
+		if a is not None:
+			percents += [normal_CDF(z + ((z - tcrit) / (1 - a * (z - tcrit)))),
+				normal_CDF(z + ((z + tcrit) / (1 - a * (z + tcrit))))]
+	bounds = _select(percentiles, theta_stars, percents)
+	width = len(percents) // len(alphas)
+	groups = [bounds[i:i + width] for i in range(0, len(bounds), width)]
+	res["percentile"] = _by_level([(group[0], group[1]) for group in groups], alphas, single)
+	res["bc"] = _by_level([(group[2], group[3]) for group in groups], alphas, single)
+	res["bca"] = _by_level([(group[4], group[5]) for group in groups], alphas, single) if a is not None else None
+	
+	### Double ###
+	if len(tvalues) > 0:
+		tbounds = percentiles(tvalues, tails)
+		res["double"] = _by_level([(res["theta_hat"] - res["se_boot"] * percupper,
+			res["theta_hat"] - res["se_boot"] * perclower)
+			for perclower, percupper in zip(tbounds[::2], tbounds[1::2])], alphas, single)
+	
+	### Calibrated Percentile ###
+	if len(uvalues) > 0:
+		#Levels at which the percentile interval covers theta_hat in the
+		#bootstrap world with probability alpha / 2 on each side
+		levels = percentiles(uvalues, tails)
+		calibrated = percentiles(theta_stars, [level * 100 for level in levels])
+		res["calibrated"] = _by_level(list(zip(calibrated[::2], calibrated[1::2])), alphas, single)
+	return percents
+	
+	
+def monte_carlo_errors(res, theta_stars, tvalues, percents):
+	"""Monte Carlo standard errors of se_boot and of all interval bounds, i.e.
+	how much they would vary between runs with different seeds. percents
+	are the levels returned by compute_intervals. The errors of the BC and
+	BCa bounds treat the bias correction z0 as fixed"""
+	alphas, single = alpha_levels(res["alpha"])
+	tcrits = [abs(inverse_normal_CDF(1 - (alpha / 2))) for alpha in alphas]
+	se_error = stdev_error(theta_stars)
+	errors = {"se_boot": se_error}
+	errors["normal"] = _by_level([(tcrit * se_error, tcrit * se_error) for tcrit in tcrits], alphas, single)
+	bounds = _select(percentile_errors, theta_stars, percents)
+	width = len(percents) // len(alphas)
+	groups = [bounds[i:i + width] for i in range(0, len(bounds), width)]
+	errors["percentile"] = _by_level([(group[0], group[1]) for group in groups], alphas, single)
+	errors["bc"] = _by_level([(group[2], group[3]) for group in groups], alphas, single)
+	errors["bca"] = _by_level([(group[4], group[5]) for group in groups], alphas, single) if width > 4 else None
+	if len(tvalues) > 0:
+		levels = [perc * 100 for alpha in alphas for perc in (alpha / 2, 1 - (alpha / 2))]
+		tbounds = percentiles(tvalues, levels)
+		terrors = percentile_errors(tvalues, levels)
+		#Bound = theta_hat - se_boot * t, both factors are estimated
+		errors["double"] = _by_level([(math.hypot(tupper * se_error, res["se_boot"] * errupper),
+			math.hypot(tlower * se_error, res["se_boot"] * errlower))
+			for tlower, tupper, errlower, errupper in zip(tbounds[::2], tbounds[1::2], terrors[::2], terrors[1::2])],
+			alphas, single)
+	return errors
+	
+	
+def required_reps(errors, target_se, reps):
+	"""Number of replications needed so that all targeted errors reach their
+	target, as Monte Carlo errors shrink with 1 / sqrt(reps)"""
+	if not isinstance(target_se, dict):
+		target_se = {key: target_se for key in errors}
+	needed = reps
+	for key, target in target_se.items():
+		error = errors.get(key)
+		if error is None:
+			continue
+		if isinstance(error, dict):		#several alpha levels
+			error = tuple(value for bounds in error.values() for value in bounds)
+		for value in (error if isinstance(error, tuple) else (error,)):
+			needed = max(needed, math.ceil(reps * (value / target) ** 2))
+	return needed
+	
+	
+def draw_replications(data, res, reps1, engine, seed, first_chunk=0, progress=None, profile=None):
+	"""Computes reps1 replications, in this process if engine is None
+	(numpy backend only) or in the worker processes of engine. Returns the
+	lists (theta_stars, tvalues, uvalues) and adds the failed evaluations to res. In
+	streaming mode, StreamSummary objects are returned instead of lists.
+	progress(size) is called after every finished chunk, the chunks are
+	recorded in profile (an instrumentation.Profile) if given"""
+	timers = instrumentation.NULL_TIMERS if profile is None else profile.timers
+	if res["streaming"]:
+		if engine is None:
+			args = (np.asarray(data, dtype=np.float64), res)
+			tempdata = run_serial(streamfunc, args, reps1, with_offsets=True, seed=seed, first_chunk=first_chunk,
+				progress=progress, profile=profile)
+		else:
+			clock = timers.start()
+			shared = publish(data)
+			timers.lap("ipc", clock)
+			try:
+				args = (data if shared is None else shared.handle, res)
+				tempdata = engine.run(streamfunc, args, reps1, with_offsets=True, seed=seed,
+					first_chunk=first_chunk, progress=progress, profile=profile)
+			finally:
+				if shared is not None:
+					shared.release()
+		theta_stars = summarize([], res["sketch_size"])
+		tvalues = summarize([], res["sketch_size"]) if res["reps2"] > 0 else []
+		uvalues = summarize([], res["sketch_size"]) if res["calibrate"] else []
+		#Merged in chunk order, so the sketch does not depend on the number of threads
+		for start, thetas, tsummary, usummary, failed, failed_inner in sorted(tempdata, key=lambda part: part[0]):
+			theta_stars += thetas
+			if tsummary is not None:
+				tvalues += tsummary
+			if usummary is not None:
+				uvalues += usummary
+			res["failed"] += failed
+			res["failed_inner"] += failed_inner
+		return theta_stars, tvalues, uvalues
+	
+	worker = vectorfunc if res["backend"] == "numpy" else multifunc_shared
+	needed = (True, res["reps2"] > 0, res["calibrate"])		#theta_stars, tvalues, uvalues
+	shared, arrays = None, ()
+	try:
+		if engine is None:
+			#Vectorized, so computed in this process. The chunks and random
+			#streams are the same as with an engine, so are the results
+			outputs = tuple(np.empty(reps1) if used else None for used in needed)
+			args = (np.asarray(data, dtype=np.float64), res, outputs)
+			tempdata = run_serial(worker, args, reps1, with_offsets=True, seed=seed, first_chunk=first_chunk,
+				progress=progress, profile=profile)
+		else:
+			#The data is published once in shared memory and the workers write
+			#their replications directly into shared arrays
+			clock = timers.start()
+			shared = publish(data)
+			arrays = tuple(SharedArray((reps1,)) if used else None for used in needed)
+			timers.lap("ipc", clock)
+			outputs = tuple(None if element is None else element.array for element in arrays)
+			args = (data if shared is None else shared.handle, res,
+				tuple(None if element is None else element.handle for element in arrays))
+			tempdata = engine.run(worker, args, reps1, with_offsets=True, seed=seed, first_chunk=first_chunk,
+				progress=progress, profile=profile)
+		
+		for failed, failed_inner in tempdata:
+			res["failed"] += failed
+			res["failed_inner"] += failed_inner
+		theta_stars, tvalues, uvalues = ([] if values is None else values.tolist() for values in outputs)
+	finally:
+		#Also if a worker raised, the shared blocks must not leak
+		for element in (shared,) + arrays:
+			if element is not None:
+				element.release()
+	return theta_stars, tvalues, uvalues
+	
+	
+def stored_intervals(store, key, alpha=0.05, prec=3, quiet=False):
+	"""Recomputes all intervals of bootstrap_ci from the replications in a
+	ReplicateStore, e.g. for another alpha or a list of levels, without
+	drawing any resamples
+
+	Args:
+		store (ReplicateStore): Store used by bootstrap_ci
+		key (str): Key of the entry, res["store_key"] of that run
+
+	Returns:
+		res: dict with the same intervals as bootstrap_ci
+	"""
+	loaded = store.load(key)
+	if loaded is None:
+		raise KeyError(f"No replications stored under {key!r}")
+	meta, arrays = loaded
+	arrays = {name: values[np.isfinite(values)] for name, values in arrays.items()}		#without failed ones
+	theta_stars = arrays["theta_stars"]
+	res = {"theta_hat": meta["theta_hat"], "alpha": alpha, "reps_used": meta["reps"]}
+	res["mean_boot"] = float(np.mean(theta_stars))
+	res["se_boot"] = float(np.std(theta_stars, ddof=1))
+	res["bias"] = res["mean_boot"] - res["theta_hat"]
+	for name in ("double", "calibrated"):
+		res[name] = None
+	compute_intervals(res, theta_stars, arrays.get("tvalues", []), meta["acceleration"], arrays.get("uvalues", []))
+	if not quiet:
+		for name, value in res.items():
+			print(name, _rounded(value, prec))
+	return res
+
+
+def _rounded(value, prec):
+	"""Rounds a number, a tuple of numbers or the values of a dict for display"""
+	if isinstance(value, float):
+		return round(value, prec)
+	if isinstance(value, tuple):
+		return tuple(round(number, prec) for number in value)
+	if isinstance(value, dict):
+		return {key: _rounded(number, prec) for key, number in value.items()}
+	return value
+		
+		
+def bootstrap_ci(func, data, reps1, reps2=0, alpha=0.05, prec=3, threads=2, quiet=False, benchmark=False, seed=None,
+	backend="python", batch_size=None, resampling="indices", engine=None, target_se=None, max_reps1=10 ** 6,
+	streaming=False, sketch_size=4096, inner_se="auto", calibrate=False, strata=None, clusters=None,
+	two_stage=False, store=None, progress=None, profile=None, mc_error=False):
 	"""Computes Bootstrap Confidence Intervals for given data and function
 	
 	Args:
 		func (func): Function to use to generate bootstrap results. This can be
 			any Python function that works with the data given, for example the
 			arithmetic mean, median, standard deviation, interquartile range, etc...
-		data (list): Given data to compute confidence intervals for
+			or the name of a statistic in the kernel registry, e.g. "mean" or
+			"trimmed_mean" (see kernels.NAMES)
+		data (list): Given data to compute confidence intervals for. Can also
+			be a list of records (tuples) or a 2-D array with one row per
+			observation, e.g. from columnar.records. Whole rows are resampled
+			and func gets a list of rows, the numpy backend evaluates the
+			kernels for correlation (morestatistics.pearson_r), regression
+			(vectorboot.ols_slope, make_coefficient) and ratios
+			(morestatistics.ratio_of_means) on (reps, n, k) blocks
 		reps1 (int): Number of bootstrap replication samples. The larger the more
 			precise the results. Must be greater than zero
 		reps2 (int): If the double (iterated) bootstrap should be computed,
@@ -77,25 +499,106 @@ def bootstrap_ci(func, data, reps1, reps2=0, alpha=0.05, prec=3, threads=2, quie
 			fasion as the total number of samples to take is reps1 * reps2
 			(default is 0)
 		alpha (float): Nominal coverage of the CI is 1 - alpha. Commonly used
-			are 0.05, 0.01 and 0.001. For a 95% CI, enter 0.05 (default is 0.05)
+			are 0.05, 0.01 and 0.001. For a 95% CI, enter 0.05. A list of
+			levels like [0.2, 0.1, 0.05, 0.01, 0.001] gives every interval as a
+			dict {alpha: (lower, upper)}, all from the same replications
+			(default is 0.05)
 		prec (int): Number of decimal places to display in the results
 			(default is 3)
 		threads (int): Number of processes to run to speed up computation.
-			Depends on your CPU (default is 2)
+			Depends on your CPU. Ignored if an engine is given (default is 2)
 		quiet (bool): Specifies whether to display results in a nice fasion.
 			If True, results are only returned as a dict (default is False)
 		benchmark (book): Specifies whether to run a quick benchmark before
-			the computation to give a coarse estimate of the expected runtime
-			(default is False)
-		seed (str): Input a seed for repeatable random draws (default is None)
+			the computation. Every phase is timed separately to predict the
+			runtime and peak memory, stored in res["prediction"] (default is False)
+		seed (str): Input a seed for repeatable random draws. Every chunk of
+			replications gets its own independent random stream, so the
+			results do not depend on the number of threads (default is None)
+		backend (str): "python" draws every resample with random.choices in
+			several processes, statistics with a kernel (see kernels.py) are
+			evaluated in blocks of resamples, others once per resample. "numpy" draws all resample indices as a
+			matrix and evaluates vectorized statistics (mean, median,
+			variance, kurtosis, ...) along the rows in a single process.
+			Other functions are called once per resample. Uses the worker
+			processes only if an engine is given (default is "python")
+		batch_size (int): Only for the numpy backend. Maximum number of
+			resamples drawn at once, limits the memory used. If None, a
+			size is chosen automatically (default is None)
+		resampling (str): "weights" is only available for the numpy backend,
+			other backends raise a ValueError. "indices" builds every
+			resample, "weights" only draws how often each observation is
+			selected (multinomial counts) and uses the weighted version of
+			func, e.g. for mean, variance, stdev, median and the quantiles
+			and regressions from vectorboot. In the double bootstrap, only
+			the outer level uses the counts, the inner level builds the
+			resamples (default is "indices")
+		engine (ResamplingEngine): A running engine whose worker processes are reused. This saves the startup
+			of new processes when bootstrap_ci is called many times. If None,
+			a temporary engine is created (default is None)
+		target_se (float): Enables the adaptive mode. reps1 replications are
+			computed first, then more are added until the Monte Carlo
+			standard error of se_boot and of every interval bound is at most
+			target_se (in units of the statistic). A dict sets targets for
+			single results only, e.g. {"se_boot": 0.01, "bca": 0.05}. If
+			None, exactly reps1 replications are used (default is None)
+		max_reps1 (int): Upper limit for reps1 in the adaptive mode
+			(default is 1,000,000)
+		streaming (bool): If True, the replications are not kept. Every
+			worker reduces its chunk to exact moments and a quantile sketch
+			and sends back only these, so the memory does not grow with
+			reps1. se_boot and the normal CI are exact, the other bounds
+			have a rank error of at most res["rank_error"] (default is False)
+		sketch_size (int): Capacity of the top level of the quantile sketch in
+			streaming mode. Up to this many replications, all bounds are
+			exact (default is 4096)
+		inner_se (str): Only for the numpy backend and reps2 > 0. "auto"
+			skips the inner loop if there is a formula for the inner
+			standard error (mean, proportions, sum, variance, stdev), see
+			doubleboot.ANALYTIC_SE. "bootstrap" always resamples (default is "auto")
+		calibrate (bool): Only if reps2 > 0. Also computes the calibrated
+			(prepivoted) percentile interval, whose levels are adjusted so
+			that it covers theta_hat in the inner bootstrap worlds with
+			probability 1 - alpha. Always runs the inner loop (default is False)
+		strata (list): Stratum label of every observation. If given, every
+			stratum is resampled separately, keeping its size (default is None)
+		clusters (list): Cluster label of every observation, e.g. the school
+			of every student. If given, whole clusters are resampled (within
+			strata). The acceleration of BCa uses the leave-one-cluster-out
+			jackknife. Not available for the double bootstrap (default is None)
+		two_stage (bool): Only with clusters. Also resamples the observations
+			within every drawn cluster (default is False)
+		store (ReplicateStore): The replications of seeded runs are saved
+			there. Later runs with the same data, statistic, seed and settings
+			(reps1 and target_se included) use them instead of drawing again
+			and give exactly the results of a fresh run. As the random stream
+			of every replication depends on reps1, a run with another reps1
+			draws and stores its own replications. See stored_intervals for
+			other alpha levels. Not used without a seed, in streaming mode or
+			for statistics without a stable identity (see
+			replicatestore.statistic_identity) (default is None)
+		progress (func): Called after every finished chunk with a dict of
+			done, total, elapsed, rate and eta (seconds left), e.g.
+			calibration.print_progress (default is None)
+		profile (Profile): An instrumentation.Profile. If given, every chunk
+			is timed per phase (rng, resample, statistic, inner loop) and the
+			bytes sent to and from the workers and their busy time are
+			recorded, as well as the jackknife, the quantiles and the store in
+			this process. The aggregates and the failed evaluations are stored
+			in res["profile"], the records per chunk stay in profile.records,
+			see Profile.export (default is None)
+		mc_error (bool): If True, the Monte Carlo errors of se_boot and of
+			all bounds are stored in res["mc_error"]. Always computed in the
+			adaptive mode (default is False)
 		
 	Returns:
 		res: a dict containing all relevant computed statistics and arguments
 	"""
 		
 	t_start = time.monotonic()	
+	func = get_function(func)		#registered names like "mean"
 	statistics = ("func","reps1", "reps2", "alpha", "prec", "theta_hat", "tvalues", "n", "se_boot", "mean_boot",
-		"bias", "normal", "percentile", "bc", "bca", "double")
+		"bias", "normal", "percentile", "bc", "bca", "double", "calibrated")
 	res = {name: None for name in statistics}
 	res["theta_hat"] = func(data)
 	res["n"] = len(data)
@@ -106,99 +609,150 @@ def bootstrap_ci(func, data, reps1, reps2=0, alpha=0.05, prec=3, threads=2, quie
 	res["func"] = func
 	res["failed"] = 0
 	res["failed_inner"] = 0
-	res["threads"] = threads
-
+	res["threads"] = threads if engine is None else engine.threads
+	res["backend"] = backend
+	res["batch_size"] = batch_size
+	res["resampling"] = resampling
+	res["streaming"] = streaming
+	res["sketch_size"] = sketch_size
+	res["inner_se"] = inner_se
+	res["calibrate"] = calibrate and reps2 > 0
+	design = None
+	if strata is not None or clusters is not None:
+		if reps2 > 0:
+			raise ValueError("The double bootstrap is not available for stratified or clustered data")
+		design = Design(len(data), strata, clusters, two_stage)
+	res["design"] = design
+	if resampling not in ("indices", "weights"):
+		raise ValueError(f"Unknown resampling {resampling!r}, use 'indices' or 'weights'")
+	if resampling == "weights" and backend != "numpy":
+		raise ValueError("Resampling with weights is only available for the numpy backend")
 	
 	if benchmark:
-		run_benchmark(data, res)
-	if seed:
-		random.seed(seed)
-	collection = Queue()	#collect all bootstrap results
-	threadlist = []
-	for i in range(threads):
-		process = Process(target=multifunc, args=(data, res, collection))
-		process.start()
-		threadlist.append(process)
-	
-	tempdata = []
-	while len(tempdata) < res["threads"]:
-		tempdata.append(collection.get(True))
-		time.sleep(0.5)
-	
-	theta_stars = []
-	tvalues = []
-	for element in tempdata:
-		theta_stars += element[0]
-		tvalues += element[1]
-		res["failed"] += element[2]
-		res["failed_inner"] += element[3]
-		
-	for thread in threadlist:				#Terminate all processes
-		thread.join()
-		
-			
-	res["mean_boot"] = mean(theta_stars)
-	res["se_boot"] = stdev(theta_stars, res["mean_boot"])
-	res["bias"] = res["mean_boot"] - res["theta_hat"]
-	theta_stars.sort()		#Sort only once for all following computations
-
-	
-	### Normal Based ###
-	tcrit = abs(inverse_normal_CDF(1 - (res["alpha"] / 2)))
-	lower = res["theta_hat"] - tcrit * res["se_boot"]
-	upper = res["theta_hat"] + tcrit * res["se_boot"]
-	res["normal"] = (lower, upper)
-	
-	
-	### Percentile ###
-	lower = percentile(theta_stars, (res["alpha"] / 2) * 100, is_sorted=True)
-	upper = percentile(theta_stars, (1 - (res["alpha"] / 2)) * 100, is_sorted=True)
-	res["percentile"] = (lower, upper)
-	
-	
-	### BC ###
-	n_smaller = sum([1 for theta in theta_stars if theta < res["theta_hat"] ])
-	share_smaller = n_smaller / len(theta_stars)
-	z = inverse_normal_CDF(share_smaller)
-	perclower = normal_CDF(2 * z - tcrit)
-	percupper = normal_CDF(2 * z + tcrit)
-	lower = percentile(theta_stars, perclower * 100, is_sorted=True)
-	upper = percentile(theta_stars, percupper * 100, is_sorted=True)
-	res["bc"] = (lower, upper)
-	
-	
-	### BCa ###
+		res["prediction"] = run_benchmark(data, res, engine)
+	chunks = DEFAULT_CHUNKS if engine is None else engine.chunks
+	timers = instrumentation.NULL_TIMERS if profile is None else profile.timers
+	clock = timers.start()
+	key, stored = None, None
+	if store is not None and seed is not None and not streaming:
+		scheme = {"reps2": reps2, "backend": backend, "resampling": resampling, "batch_size": batch_size,
+			"inner_se": inner_se, "calibrate": res["calibrate"], "chunks": chunks, "two_stage": two_stage,
+			"strata": None if strata is None else _codes(strata),
+			"clusters": None if clusters is None else _codes(clusters),
+			#The chunks and so the random stream of every replication depend on
+			#reps1, a stored run is only reused by an identical run
+			"reps1": reps1, "target_se": target_se, "max_reps1": None if target_se is None else max_reps1}
+		key = store.key(data, func, seed, scheme)
+		stored = None if key is None else store.load(key)
+		clock = timers.lap("store", clock)
+	tempengine = None
+	if engine is None and backend != "numpy" and stored is None:
+		engine = tempengine = ResamplingEngine(threads)
+	labels_shared = []
 	try:
-		a = acceleration_coefficient(func, data)
-		perclower = normal_CDF(z + ((z - tcrit) / (1 - a * (z - tcrit))))
-		percupper = normal_CDF(z + ((z + tcrit) / (1 - a * (z + tcrit))))
-		lower = percentile(theta_stars, perclower * 100, is_sorted=True)
-		upper = percentile(theta_stars, percupper * 100, is_sorted=True)
-		res["bca"] = (lower, upper)
-	except:
-		print("Computation of acceleration coefficient failed")
-		res["bca"] = None
-	
+		if design is not None and engine is not None:
+			#Workers build the design from the label codes in shared memory
+			labels_shared = [None if labels is None else SharedArray.from_array(_codes(labels))
+				for labels in (strata, clusters)]
+			res["design"] = (len(data),) + tuple(None if element is None else element.handle
+				for element in labels_shared) + (two_stage,)
+		tracker = None if progress is None else Progress(reps1, progress)
+		if stored is None:
+			theta_stars, tvalues, uvalues = draw_replications(data, res, reps1, engine, seed, progress=tracker,
+				profile=profile)
+			first_chunk = chunks
+		else:
+			#Exactly the replications of a fresh run, adaptive runs included
+			meta, arrays = stored
+			theta_stars, tvalues, uvalues = (arrays[name].tolist() if name in arrays else [] for name in ARRAYS)
+			first_chunk = meta["next_chunk"]
+			res["failed"] += meta["failed"]
+			res["failed_inner"] += meta["failed_inner"]
+			if tracker is not None:
+				tracker.done = tracker.total = len(theta_stars)
+		if stored is not None and "acceleration" in stored[0]:
+			a = stored[0]["acceleration"]
+		else:
+			clock = timers.start()
+			try:
+				if design is not None and design.clustered:
+					a = acceleration(design.jackknife(func, data))
+				else:
+					a = acceleration_coefficient(func, data)
+			except:
+				print("Computation of acceleration coefficient failed")
+				a = None
+			timers.lap("jackknife", clock)
 	
-	### Double ###
-	if reps2 > 0:
-		tvalues.sort()
-		perclower = percentile(tvalues, (res["alpha"] / 2) * 100, True)
-		percupper = percentile(tvalues, (1 - (res["alpha"] / 2)) * 100, True)
-		lower = res["theta_hat"] - res["se_boot"] * percupper
-		upper = res["theta_hat"] - res["se_boot"] * perclower
-		res["double"] = (lower, upper)
+		while True:
+			if streaming:
+				#Summaries skip failed evaluations already
+				valid_thetas, valid_tvalues, valid_uvalues = theta_stars, tvalues, uvalues
+				res["mean_boot"] = theta_stars.mean()
+				res["se_boot"] = theta_stars.stdev()
+			else:
+				#Failed evaluations of the numpy backend are NaN, they are counted in res["failed"]
+				valid_thetas, valid_tvalues, valid_uvalues = _finite(theta_stars), _finite(tvalues), _finite(uvalues)
+				res["mean_boot"] = mean(valid_thetas)
+				res["se_boot"] = stdev(valid_thetas, res["mean_boot"])
+			res["bias"] = res["mean_boot"] - res["theta_hat"]
+			clock = timers.start()
+			percents = compute_intervals(res, valid_thetas, valid_tvalues, a, valid_uvalues)
+			if mc_error or target_se is not None:
+				res["mc_error"] = monte_carlo_errors(res, valid_thetas, valid_tvalues, percents)
+			timers.lap("quantiles", clock)
+			if target_se is None or len(theta_stars) >= max_reps1:
+				break
+			needed = required_reps(res["mc_error"], target_se, len(theta_stars))
+			if needed <= len(theta_stars):
+				break
+			#Add at least reps1 replications, new chunk numbers give new random streams
+			more = min(max(reps1, needed - len(theta_stars)), max_reps1 - len(theta_stars))
+			if tracker is not None:
+				tracker.total = len(theta_stars) + more
+				tracker.done = len(theta_stars)
+			new_thetas, new_tvalues, new_uvalues = draw_replications(data, res, more, engine, seed, first_chunk, tracker,
+				profile)
+			theta_stars += new_thetas
+			tvalues += new_tvalues
+			uvalues += new_uvalues
+			first_chunk += chunks
+		res["reps_used"] = len(theta_stars)
+		if key is not None and stored is None:
+			clock = timers.start()
+			values = {"theta_stars": theta_stars, "tvalues": tvalues, "uvalues": uvalues}
+			store.save(key, {name: values[name] for name in ARRAYS if len(values[name]) > 0},
+				{"statistic": statistic_identity(func), "seed": seed, "theta_hat": res["theta_hat"], "acceleration": a,
+				"next_chunk": first_chunk, "failed": res["failed"], "failed_inner": res["failed_inner"]})
+			timers.lap("store", clock)
+		res["store_key"] = key
+		if streaming:
+			res["rank_error"] = theta_stars.sketch.error_bound()
+	except BaseException:
+		if tempengine is not None:
+			tempengine.terminate()		#do not wait for the remaining chunks
+			tempengine = None
+		raise
+	finally:
+		#Also if a worker raised, no blocks or processes of this call are left
+		for element in labels_shared:
+			if element is not None:
+				element.release()
+		res["design"] = design
+		if tempengine is not None:
+			tempengine.close()
 	
 	res["runtime"] = time.monotonic() - t_start
+	if profile is not None:
+		res["profile"] = dict(profile.summary(), failed=res["failed"], failed_inner=res["failed_inner"])
 	if not quiet:
 		###Display results###
 		for key, value in res.items():
-			if isinstance(value, float):
-				print(key, round(value, prec))
-			elif isinstance(value, tuple):
-				print(key, tuple((round(number, prec) for number in value)))
+			if isinstance(value, dict):
+				for name, number in value.items():
+					print(key, name, _rounded(number, prec))
 			else:
-				print(key, value)
+				print(key, _rounded(value, prec))
 	return res
 			
 
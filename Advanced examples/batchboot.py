@@ -0,0 +1,208 @@
+#Many statistics for many groups in a single resampling pass
+#Instead of one bootstrap_ci call per statistic and group, every resample is
+#drawn once as a matrix of indices, stratified by group so that every group
+#keeps its size. The columns of a group form a resample of that group and all
+#statistics are evaluated on them with their kernels. As all values of one
+#resample come from the same draw, differences between groups (contrasts)
+#have consistent joint replicates.
+
+import math
+import time
+import numpy as np
+from morestatistics import acceleration_coefficient, alpha_levels
+from kernels import get_function
+from vectorboot import apply_statistic, default_batch_size
+from designs import Design, get_design, _codes
+from engine import SharedArray, publish, attach, chunk_rng, run_serial
+from all_cis import compute_intervals, _by_level, _rounded
+
+
+def table_replicates(funcs, data, design, reps, batch_size, rng):
+	"""Computes reps replicates of every statistic in every stratum of design
+
+	Returns:
+		(values, failed): array of shape (reps, groups, statistics) and the
+			number of failed evaluations
+	"""
+	ranges = design.stratum_ranges()
+	values = np.empty((reps, len(ranges), len(funcs)))
+	failed = 0
+	pos = 0
+	for indices in design.index_batches(reps, batch_size, rng):
+		block = data[indices]
+		for g, (begin, end) in enumerate(ranges):
+			sample = block[:, begin:end]
+			for s, func in enumerate(funcs):
+				results, nfailed = apply_statistic(func, sample)
+				values[pos:pos + len(block), g, s] = results
+				failed += nfailed
+		pos += len(block)
+	return values, failed
+
+
+def tablefunc(data, res, output, start, reps1):
+	"""Working function, writes the replicates start ... start + reps1 into
+	the shared output array"""
+	values, failed = table_replicates(res["funcs"], attach(data), get_design(res["design"]), reps1,
+		res["batch_size"], chunk_rng())
+	attach(output)[start:start + reps1] = values
+	return failed
+
+
+def _name(func):
+	"""Display name of a statistic"""
+	if isinstance(func, str):
+		return func
+	return getattr(func, "__name__", repr(func))
+
+
+def _failed_row(theta_hat, alpha):
+	"""Results of a cell without valid replicates or theta_hat, all NaN"""
+	alphas, single = alpha_levels(alpha)
+	interval = _by_level([(math.nan, math.nan)] * len(alphas), alphas, single)
+	row = {"theta_hat": float(theta_hat), "mean_boot": math.nan, "se_boot": math.nan, "bias": math.nan}
+	row.update({key: interval for key in ("normal", "percentile", "bc", "bca")})
+	return row
+
+
+def _summarize(replicates, theta_hat, alpha, a=None):
+	"""Bootstrap results of one column of replicates as a dict"""
+	row = {"theta_hat": float(theta_hat), "alpha": alpha}
+	valid = replicates[~np.isnan(replicates)]
+	if valid.size < 2 or math.isnan(theta_hat):
+		return _failed_row(theta_hat, alpha)
+	row["mean_boot"] = float(valid.mean())
+	row["se_boot"] = float(valid.std(ddof=1))
+	row["bias"] = row["mean_boot"] - theta_hat
+	compute_intervals(row, valid, [], a)
+	del row["alpha"]
+	return row
+
+
+def bootstrap_table(funcs, data, reps1, groups=None, alpha=0.05, prec=3, quiet=False, seed=None,
+	batch_size=None, engine=None, contrasts=None, bca=True):
+	"""Computes bootstrap CIs for several statistics in several groups at once,
+	e.g. mean, median and sd of wage by grade. Each resample is drawn only
+	once and used for all statistics and groups (vectorized, see vectorboot)
+
+	Args:
+		funcs (list): Statistics, functions or registered names like
+			["mean", "median", "sd"]
+		data (list): Given data, one value (or record) per observation
+		reps1 (int): Number of bootstrap replications
+		groups (list): Group label of every observation. Groups are
+			resampled separately and keep their size. If None, the whole data
+			is one group (default is None)
+		alpha (float): Nominal coverage of all CIs is 1 - alpha. With a list
+			of levels, every CI is a dict {alpha: (lower, upper)} (default is 0.05)
+		prec (int): Number of digits displayed (default is 3)
+		quiet (bool): If True, nothing is printed (default is False)
+		seed (int): Seed for reproducible results, identical with and without
+			an engine (default is None)
+		batch_size (int): Resamples per vectorized block. If None, chosen
+			from the sample size (default is None)
+		engine (ResamplingEngine): Worker processes to use. If None, all
+			blocks are computed in this process (default is None)
+		contrasts (list): Pairs of group labels (a, b). For every statistic,
+			the CIs of the difference a - b are computed from the joint
+			replicates (default is None)
+		bca (bool): If True, also the BCa intervals, which need one jackknife
+			per group and statistic (default is True)
+
+	Returns:
+		res: dict with the settings, "table" (one dict per group and statistic
+			with theta_hat, mean_boot, se_boot, bias and the normal,
+			percentile, BC and BCa CIs), "contrasts" (the same per contrast
+			and statistic) and "replicates", an array of shape
+			(reps1, groups, statistics). Cells where the statistic fails,
+			e.g. sd of a group with one observation, are NaN and counted in
+			"failed"
+	"""
+	t_start = time.monotonic()
+	names = [_name(func) for func in funcs]
+	funcs = [get_function(func) for func in funcs]
+	data = np.asarray(data, dtype=np.float64)
+	n = len(data)
+	if groups is None:
+		groups = np.zeros(n, dtype=np.int64)
+	labels = np.unique(np.asarray(groups)).tolist()
+	design = Design(n, groups)
+	res = {"funcs": funcs, "statistics": names, "groups": labels, "n": n, "reps1": reps1, "alpha": alpha,
+		"prec": prec, "failed": 0, "design": design,
+		"batch_size": default_batch_size(data.size) if batch_size is None else batch_size}
+
+	if engine is None:
+		output = np.empty((reps1, len(labels), len(funcs)))
+		tempdata = run_serial(tablefunc, (data, res, output), reps1, with_offsets=True, seed=seed)
+		replicates = output
+	else:
+		#Data, group codes and replicates are shared with the workers
+		shared = publish(data)
+		codes = SharedArray.from_array(_codes(groups))
+		result = SharedArray((reps1, len(labels), len(funcs)))
+		try:
+			res["design"] = (n, codes.handle, None, False)
+			args = (data if shared is None else shared.handle, res, result.handle)
+			tempdata = engine.run(tablefunc, args, reps1, with_offsets=True, seed=seed)
+			replicates = result.array.copy()
+		finally:
+			#Also if a worker raised, the shared blocks must not leak
+			res["design"] = design
+			for element in (shared, codes, result):
+				if element is not None:
+					element.release()
+	res["failed"] = sum(tempdata)
+
+	samples = [data[design.order[begin:end]] for begin, end in design.stratum_ranges()]
+	thetas = np.empty((len(labels), len(funcs)))
+	for g, sample in enumerate(samples):
+		for s, func in enumerate(funcs):
+			try:
+				thetas[g, s] = func(sample.tolist())
+			except:
+				thetas[g, s] = np.nan		#e.g. sd of a single observation, the cell is NaN
+				res["failed"] += 1
+	table = []
+	for g, label in enumerate(labels):
+		for s, func in enumerate(funcs):
+			a = None
+			if bca:
+				try:
+					a = acceleration_coefficient(func, samples[g].tolist())
+				except:
+					a = None
+			row = {"group": label, "statistic": names[s]}
+			row.update(_summarize(replicates[:, g, s], thetas[g, s], alpha, a))
+			table.append(row)
+	res["table"] = table
+
+	res["contrasts"] = []
+	for first, second in (contrasts or []):
+		g1, g2 = labels.index(first), labels.index(second)
+		for s in range(len(funcs)):
+			row = {"group": (first, second), "statistic": names[s]}
+			row.update(_summarize(replicates[:, g1, s] - replicates[:, g2, s], thetas[g1, s] - thetas[g2, s], alpha))
+			res["contrasts"].append(row)
+	res["replicates"] = replicates
+	res["runtime"] = time.monotonic() - t_start
+
+	if not quiet:
+		columns = ("theta_hat", "se_boot", "percentile", "bca")
+		for title, rows in (("Groups", table), ("Contrasts", res["contrasts"])):
+			if not rows:
+				continue
+			print(title)
+			for row in rows:
+				print(row["group"], row["statistic"], *[f"{key} {_rounded(row[key], prec)}" for key in columns])
+		print("runtime", _rounded(res["runtime"], prec))
+	return res
+
+
+
+
+if __name__ == '__main__':
+	import random
+	random.seed(1)
+	grade = [random.choice([10, 12, 14, 16]) for i in range(2000)]
+	wage = [5 + 0.8 * g + random.gauss(0, 3) for g in grade]
+	bootstrap_table(["mean", "median", "sd"], wage, reps1=5000, groups=grade, contrasts=[(16, 12)], seed=123)
@@ -0,0 +1,139 @@
+#Runtime and memory prediction from timed phases, progress reports
+#Instead of timing a few single-threaded calls and dividing by the number of
+#threads, every phase of a run is timed on the actual data: drawing the random
+#numbers, gathering the resamples, evaluating the statistic, sending tasks and
+#results between processes and reducing the replications. These are combined
+#with the process startup, the number of usable cores and the waves in which
+#the chunks are computed. Progress objects count finished replications during
+#a run and pass progress and ETA to a callback.
+
+import os
+import math
+import time
+import pickle
+from multiprocessing import Process
+
+
+_startup = None		#measured once per process
+
+
+def timed(func, *args, min_time=0.02):
+	"""Average seconds per call of func(*args). The call is repeated until
+	min_time has passed, at least once"""
+	calls = 0
+	start = time.perf_counter()
+	while True:
+		func(*args)
+		calls += 1
+		elapsed = time.perf_counter() - start
+		if elapsed >= min_time:
+			return elapsed / calls
+
+
+def process_startup():
+	"""Seconds to start and join one worker process, measured once"""
+	global _startup
+	if _startup is None:
+		start = time.perf_counter()
+		process = Process(target=int)
+		process.start()
+		process.join()
+		_startup = time.perf_counter() - start
+	return _startup
+
+
+def usable_cores(threads):
+	"""Processes that really run at the same time"""
+	return max(1, min(threads, os.cpu_count() or 1))
+
+
+def roundtrip(obj):
+	"""Seconds to pickle and unpickle obj, like every task and result sent
+	to or from a worker process. Objects that cannot be pickled (e.g. with
+	a lambda function) are inherited by forked workers and cost nothing"""
+	try:
+		pickle.dumps(obj)
+	except Exception:
+		return 0.0
+	return timed(lambda: pickle.loads(pickle.dumps(obj)))
+
+
+def predict(phases, reps, threads=1, chunks=64, parallel=True, memory=0):
+	"""Combines timed phases into a wall time prediction
+
+	Args:
+		phases (dict): Seconds per replication for "draw", "gather" and
+			"statistic", total seconds for "startup", "transport", "reduce"
+			and "jackknife" (missing phases count as 0)
+		reps (int): Number of replications
+		threads (int): Number of worker processes (default is 1)
+		chunks (int): Chunks the replications are split into. The workers
+			compute them in waves, so the slowest wave counts (default is 64)
+		parallel (bool): False if all chunks run in this process (default is True)
+		memory (int): Estimated peak memory in bytes (default is 0)
+
+	Returns:
+		dict with the phases, the usable workers, the predicted compute time,
+			wall time and peak memory
+	"""
+	phases = dict({name: 0.0 for name in ("draw", "gather", "statistic", "startup", "transport", "reduce",
+		"jackknife")}, **phases)
+	workers = usable_cores(threads) if parallel else 1
+	per_rep = phases["draw"] + phases["gather"] + phases["statistic"]
+	chunks = max(1, min(chunks, reps))
+	waves = math.ceil(chunks / workers)
+	compute = waves * math.ceil(reps / chunks) * per_rep
+	fixed = phases["startup"] + phases["transport"] + phases["reduce"] + phases["jackknife"]
+	return {"phases": phases, "workers": workers, "compute": compute, "wall_time": compute + fixed,
+		"peak_memory": memory}
+
+
+def format_runtime(seconds):
+	"""Message with a rounded runtime"""
+	if 0 <= seconds < 5:
+		return "Estimated runtime below 5 seconds"
+	elif 5 <= seconds < 60:
+		return f"Estimated runtime about {seconds:.0f} seconds"
+	elif 60 <= seconds < 3600:
+		return f"Estimated runtime about {seconds / 60:.1f} minutes"
+	return f"Estimated runtime about {seconds / 3600:.1f} hours"
+
+
+def format_bytes(size):
+	for unit in ("bytes", "KB", "MB", "GB"):
+		if size < 1024 or unit == "GB":
+			return f"{size:.0f} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+		size /= 1024
+
+
+def report(prediction):
+	"""Prints a prediction of predict"""
+	print(format_runtime(prediction["wall_time"]))
+	print(f"Estimated peak memory about {format_bytes(prediction['peak_memory'])}")
+
+
+class Progress:
+	"""Counts finished replications and calls callback(info) after every
+	chunk. info is a dict with done, total, elapsed (seconds), rate
+	(replications per second) and eta (seconds left). Pass it as progress
+	to ResamplingEngine.run or run_serial"""
+
+	def __init__(self, total, callback):
+		self.total = total
+		self.callback = callback
+		self.done = 0
+		self.start = time.monotonic()
+
+	def __call__(self, finished):
+		self.done += finished
+		elapsed = time.monotonic() - self.start
+		rate = self.done / elapsed if elapsed > 0 else math.inf
+		eta = (self.total - self.done) / rate if rate > 0 else math.inf
+		self.callback({"done": self.done, "total": self.total, "elapsed": elapsed, "rate": rate, "eta": eta})
+
+
+def print_progress(info):
+	"""Ready-made callback that prints progress and ETA on one line"""
+	end = "\n" if info["done"] >= info["total"] else ""
+	print(f"\r{info['done']} / {info['total']} replications, {info['elapsed']:.1f} s elapsed, "
+		f"about {info['eta']:.1f} s left   ", end=end, flush=True)
@@ -0,0 +1,221 @@
+#Streaming CSV loader with typed, array-backed columns
+#The file is read in chunks of rows and every column is stored as one NumPy
+#array (int64 or float64) plus a mask of missing values, instead of a list of
+#lists of Python floats. Parsed columns can be cached as binary .npy files
+#that later runs open memory-mapped, so the CSV does not have to be parsed
+#again and the bootstrap engines can use the data without copying.
+
+import os
+import csv
+import json
+import numpy as np
+
+
+MISSING = ("", ".", "NA", "NaN", "nan")		#entries treated as missing values
+
+
+class Column:
+	"""One column of a data set
+
+	Attributes:
+		name (str): Column name from the header
+		values (array): int64, float64 or string array, missing entries are
+			0 / NaN / ""
+		missing (array): bool array, True where the entry is missing
+	"""
+
+	def __init__(self, name, values, missing):
+		self.name = name
+		self.values = values
+		self.missing = missing
+
+	def __len__(self):
+		return len(self.values)
+
+	def __repr__(self):
+		return f"Column({self.name!r}, n={len(self)}, dtype={self.values.dtype}, missing={int(self.missing.sum())})"
+
+	def valid(self):
+		"""Returns all non-missing values. If nothing is missing, the stored
+		(possibly memory-mapped) array is returned without a copy"""
+		if not self.missing.any():
+			return self.values
+		return self.values[~self.missing]
+
+	def tolist(self):
+		"""Non-missing values as a Python list for the classic functions"""
+		return self.valid().tolist()
+
+
+def _convert(strings):
+	"""Converts a list of strings into (values, missing). Integer columns
+	become int64, other numbers float64 and text columns stay strings"""
+	raw = np.array(strings, dtype=str)
+	missing = np.isin(np.char.strip(raw), MISSING)
+	numbers = raw.copy()
+	numbers[missing] = "0"
+	for dtype in (np.int64, np.float64):
+		try:
+			return numbers.astype(dtype), missing
+		except ValueError:
+			pass
+	raw[missing] = ""
+	return raw, missing
+
+
+def _combine(parts):
+	"""Concatenates the chunks of one column, ints are promoted to float
+	if any chunk contained decimal numbers and to strings if any chunk
+	contained text"""
+	if any(part[0].dtype.kind == "U" for part in parts):
+		parts = [(part[0].astype(str), part[1]) for part in parts]
+	values = np.concatenate([part[0] for part in parts]) if parts else np.empty(0)
+	missing = np.concatenate([part[1] for part in parts]) if parts else np.empty(0, dtype=bool)
+	if values.dtype == np.float64:
+		values[missing] = np.nan
+	elif values.dtype.kind == "U":
+		values[missing] = ""
+	return values, missing
+
+
+def _header(reader):
+	"""Column names from the first line of a csv.reader"""
+	return [name.strip() for name in next(reader)]
+
+
+def read_csv(path, columns=None, chunksize=100_000, delimiter=","):
+	"""Reads a CSV file with a header line in chunks of rows
+
+	Args:
+		path (str): CSV file
+		columns (list): Names of the columns to keep. If None, all columns
+			are read (default is None)
+		chunksize (int): Number of rows converted at once, limits the memory
+			needed for the intermediate strings (default is 100,000)
+		delimiter (str): Field separator (default is ",")
+
+	Returns:
+		dict of Column objects, keyed by column name
+	"""
+	with open(path, mode="r", newline="") as inputfile:
+		reader = csv.reader(inputfile, delimiter=delimiter)
+		header = _header(reader)
+		if columns is None:
+			columns = header
+		for name in columns:
+			if name not in header:
+				raise KeyError(f"Column {name!r} not found in {path}")
+		positions = [header.index(name) for name in columns]
+		parts = {name: [] for name in columns}
+		buffer = [[] for name in columns]
+		for row in reader:
+			if not row:
+				continue	#Skip empty lines
+			for target, position in zip(buffer, positions):
+				target.append(row[position] if position < len(row) else "")
+			if len(buffer[0]) >= chunksize:
+				for name, target in zip(columns, buffer):
+					parts[name].append(_convert(target))
+					target.clear()
+		if buffer[0]:
+			for name, target in zip(columns, buffer):
+				parts[name].append(_convert(target))
+	return {name: Column(name, *_combine(parts[name])) for name in columns}
+
+
+def records(data, columns):
+	"""Stacks columns into a float64 array with one row per record, e.g.
+	records(data, ["grade", "wage"]) for a regression of wage on grade.
+	Rows with a missing value in any of the columns are dropped"""
+	missing = np.zeros(len(data[columns[0]]), dtype=bool)
+	for name in columns:
+		missing |= data[name].missing
+	return np.column_stack([data[name].values[~missing] for name in columns]).astype(np.float64)
+
+
+def save_cache(data, directory, source=None, keep=()):
+	"""Stores columns as .npy files in directory (one for the values and one
+	for the missing mask per column) plus a small metadata file. The names in
+	keep are columns already stored in directory that stay in the cache"""
+	os.makedirs(directory, exist_ok=True)
+	for name, column in data.items():
+		np.save(os.path.join(directory, f"{name}.values.npy"), column.values)
+		np.save(os.path.join(directory, f"{name}.missing.npy"), column.missing)
+	rows = len(next(iter(data.values()))) if data else 0
+	meta = {"columns": [name for name in keep if name not in data] + list(data), "rows": rows}
+	if source is not None:
+		stat = os.stat(source)
+		meta["source"] = {"path": os.path.abspath(source), "size": stat.st_size, "mtime": stat.st_mtime}
+	with open(os.path.join(directory, "meta.json"), mode="w") as outputfile:
+		json.dump(meta, outputfile)
+
+
+def load_cache(directory, columns=None):
+	"""Opens cached columns memory-mapped (read-only), nothing is copied
+	into memory until the values are used"""
+	with open(os.path.join(directory, "meta.json")) as inputfile:
+		meta = json.load(inputfile)
+	if columns is None:
+		columns = meta["columns"]
+	data = {}
+	for name in columns:
+		values = np.load(os.path.join(directory, f"{name}.values.npy"), mmap_mode="r")
+		missing = np.load(os.path.join(directory, f"{name}.missing.npy"), mmap_mode="r")
+		data[name] = Column(name, values, missing)
+	return data
+
+
+def _cached_columns(directory, path):
+	"""Names of the columns in the cache, empty if there is no cache or it
+	does not belong to the unchanged CSV file"""
+	try:
+		with open(os.path.join(directory, "meta.json")) as inputfile:
+			meta = json.load(inputfile)
+	except (OSError, ValueError):
+		return []
+	stat = os.stat(path)
+	source = meta.get("source", {})
+	if (source.get("path") != os.path.abspath(path) or source.get("size") != stat.st_size
+		or source.get("mtime") != stat.st_mtime):
+		return []
+	return meta["columns"]
+
+
+def load_csv(path, columns=None, chunksize=100_000, delimiter=",", cache=None):
+	"""Loads columns of a CSV file, using a binary cache if given
+
+	Args:
+		path (str): CSV file
+		columns (list): Names of the columns to load, for example
+			["wage", "hours", "grade"]. If None, all columns (default is None)
+		chunksize (int): Number of rows converted at once (default is 100,000)
+		delimiter (str): Field separator (default is ",")
+		cache (str): Directory for the memory-mapped cache. If it holds the
+			columns of the unchanged file, the CSV is not parsed at all.
+			Otherwise only the missing columns are parsed and added to the
+			cache (all columns are parsed again if the file changed). If
+			None, no cache is used (default is None)
+
+	Returns:
+		dict of Column objects, keyed by column name
+	"""
+	if cache is None:
+		return read_csv(path, columns, chunksize, delimiter)
+	cached = _cached_columns(cache, path)
+	if columns is None:
+		with open(path, mode="r", newline="") as inputfile:
+			columns = _header(csv.reader(inputfile, delimiter=delimiter))
+	new = [name for name in columns if name not in cached]
+	if new:
+		save_cache(read_csv(path, new, chunksize, delimiter), cache, source=path, keep=cached)
+	return load_cache(cache, columns)
+
+
+
+
+if __name__ == '__main__':
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "testfile.csv")		#in the repo root
+	data = load_csv(path, columns=["grade", "wage", "hours"])
+	print(data)
+	wage = data["wage"].valid()
+	print(len(wage), wage[:10], wage.mean())
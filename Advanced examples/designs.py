@@ -0,0 +1,145 @@
+#Stratified and cluster (two-stage) resampling designs
+#The group structure is analysed once: observations are ordered by stratum
+#and cluster, and the offsets and sizes of all groups are stored as arrays.
+#A resample is then drawn for a whole block of replications at once, either
+#as indices (stratified designs, the resample size is fixed) or as counts
+#per observation (all designs), which the weighted kernels use directly.
+
+from collections import OrderedDict
+import numpy as np
+from engine import attach
+
+
+_designs = OrderedDict()		#designs built by this process from shared labels
+MAX_DESIGNS = 4
+
+
+def _codes(labels):
+	"""Turns arbitrary labels into integer codes 0 ... k - 1"""
+	return np.unique(np.asarray(labels), return_inverse=True)[1].reshape(-1).astype(np.int64)
+
+
+class Design:
+	"""Resampling design for stratified and/or clustered data
+
+	Stratified: every stratum is resampled separately with its own size.
+	Clustered: whole clusters are drawn with replacement (within strata if
+	given). Two-stage: the observations of every drawn cluster are
+	resampled again with replacement
+	"""
+
+	def __init__(self, n, strata=None, clusters=None, two_stage=False):
+		"""
+		Args:
+			n (int): Number of observations
+			strata (list): Stratum label per observation or None
+			clusters (list): Cluster label per observation or None. Labels
+				only need to be unique within a stratum
+			two_stage (bool): Resample within the drawn clusters (default is False)
+		"""
+		self.n = n
+		self.two_stage = two_stage and clusters is not None
+		stratum = _codes(strata) if strata is not None else np.zeros(n, dtype=np.int64)
+		if clusters is None:
+			cluster = np.arange(n)		#every observation is its own cluster
+		else:
+			within = _codes(clusters)
+			cluster = _codes(stratum * (within.max() + 1) + within)		#unique across strata
+		self.clustered = clusters is not None
+		self.order = np.lexsort((cluster, stratum))
+		self.cluster_of = cluster
+		#Clusters in the order of self.order, with offsets and sizes
+		ordered = cluster[self.order]
+		starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+		self.cluster_offsets = starts
+		self.cluster_sizes = np.diff(np.r_[starts, n])
+		self.cluster_stratum = stratum[self.order][starts]
+		#Strata as ranges of clusters (and of positions in self.order)
+		cluster_starts = np.flatnonzero(np.r_[True, self.cluster_stratum[1:] != self.cluster_stratum[:-1]])
+		self.strata = [(first, last) for first, last in zip(cluster_starts, np.r_[cluster_starts[1:], len(starts)])]
+		#Per position in self.order: offset and size of its stratum, for index draws
+		self.position_offset = np.empty(n, dtype=np.int64)
+		self.position_size = np.empty(n, dtype=np.int64)
+		for begin, end in self.stratum_ranges():
+			self.position_offset[begin:end] = begin
+			self.position_size[begin:end] = end - begin
+
+	def stratum_ranges(self):
+		"""Positions (begin, end) of every stratum in self.order. In the index
+		matrices of index_batches, these columns are a resample of the stratum"""
+		ends = np.r_[self.cluster_offsets, self.n]
+		return [(int(ends[first]), int(ends[last])) for first, last in self.strata]
+
+	def __repr__(self):
+		return (f"Design(n={self.n}, strata={len(self.strata)}, "
+			f"clusters={len(self.cluster_sizes) if self.clustered else None}, two_stage={self.two_stage})")
+
+	def index_batches(self, reps, batch_size, rng):
+		"""Yields index matrices of stratified resamples (no clusters)"""
+		assert not self.clustered, "Resamples of clustered data differ in size, use count_batches"
+		done = 0
+		while done < reps:
+			rows = min(batch_size, reps - done)
+			draws = (rng.random((rows, self.n)) * self.position_size).astype(np.int64)
+			yield self.order[self.position_offset + draws]
+			done += rows
+
+	def cluster_counts(self, rows, rng):
+		"""How often every cluster is drawn, shape (rows, clusters)"""
+		counts = np.empty((rows, len(self.cluster_sizes)), dtype=np.int64)
+		for first, last in self.strata:
+			size = last - first
+			counts[:, first:last] = rng.multinomial(size, np.full(size, 1 / size), size=rows)
+		return counts
+
+	def count_batches(self, reps, batch_size, rng):
+		"""Yields matrices of counts per observation (frequency weights),
+		one row per resample"""
+		done = 0
+		while done < reps:
+			rows = min(batch_size, reps - done)
+			clusters = self.cluster_counts(rows, rng)
+			if not self.clustered or not self.two_stage:
+				#Every drawn cluster enters with all its observations
+				counts = np.empty((rows, self.n), dtype=np.int64)
+				counts[:, self.order] = np.repeat(clusters, self.cluster_sizes, axis=1)
+			else:
+				#A cluster drawn c times contributes c * m draws among its m members
+				counts = np.zeros((rows, self.n), dtype=np.int64)
+				for g, (offset, size) in enumerate(zip(self.cluster_offsets, self.cluster_sizes)):
+					members = self.order[offset:offset + size]
+					counts[:, members] = rng.multinomial(clusters[:, g] * size, np.full(size, 1 / size))
+			yield counts
+			done += rows
+
+	def resample(self, data, rng):
+		"""One resample of a list as a list, for the pure Python engines"""
+		counts = next(self.count_batches(1, 1, rng))[0]
+		return [data[i] for i in np.repeat(np.arange(self.n), counts).tolist()]
+
+	def jackknife(self, func, data):
+		"""Leave-one-cluster-out values of func (leave-one-out without clusters)"""
+		data = list(data)
+		output = []
+		for offset, size in zip(self.cluster_offsets, self.cluster_sizes):
+			left_out = set(self.order[offset:offset + size].tolist())
+			output.append(func([value for i, value in enumerate(data) if i not in left_out]))
+		return output
+
+
+def get_design(spec):
+	"""Returns the Design for res["design"]. This is a Design, None or, for
+	worker processes, (n, strata, clusters, two_stage) with SharedArray
+	handles of the label codes. Designs from handles are built once per process"""
+	if spec is None or isinstance(spec, Design):
+		return spec
+	n, strata, clusters, two_stage = spec
+	key = (None if strata is None else strata[0], None if clusters is None else clusters[0], two_stage)
+	if key in _designs:
+		_designs.move_to_end(key)
+	else:
+		_designs[key] = Design(n, None if strata is None else attach(strata),
+			None if clusters is None else attach(clusters), two_stage)
+		while len(_designs) > MAX_DESIGNS:
+			_designs.popitem(last=False)
+	return _designs[key]
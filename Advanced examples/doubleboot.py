@@ -0,0 +1,174 @@
+#Vectorized engine for the double (iterated) bootstrap
+#The inner loops of many outer resamples are drawn together as one 3D block
+#of indices (outer resamples x reps2 x n), so reps1 * reps2 resamples need
+#only about reps1 * reps2 * n / max_elements NumPy calls. Where a formula
+#for the bootstrap standard error exists, the inner loop is skipped.
+
+import math
+import warnings
+import statistics
+import numpy as np
+from vectorboot import apply_statistic, apply_weighted_statistic, default_batch_size, index_batches, count_batches
+from seeding import make_rng
+import instrumentation
+
+
+def _centered_moments(samples):
+	centered = samples - samples.mean(axis=1, keepdims=True)
+	squares = centered ** 2
+	return squares.mean(axis=1), (squares ** 2).mean(axis=1)
+
+
+def _mean_se(samples):
+	"""Exact ideal bootstrap SE of the mean, also for proportions (0/1 data)"""
+	return samples.std(axis=1) / math.sqrt(samples.shape[1])
+
+
+def _sum_se(samples):
+	return samples.std(axis=1) * math.sqrt(samples.shape[1])
+
+
+def _pvariance_se(samples):
+	"""Delta method, Var(m2) = (m4 - m2 ** 2) / n"""
+	m2, m4 = _centered_moments(samples)
+	return np.sqrt(np.maximum(m4 - m2 ** 2, 0) / samples.shape[1])
+
+
+def _variance_se(samples):
+	n = samples.shape[1]
+	return _pvariance_se(samples) * n / (n - 1)
+
+
+def _pstdev_se(samples):
+	return _pvariance_se(samples) / (2 * samples.std(axis=1))
+
+
+def _stdev_se(samples):
+	return _variance_se(samples) / (2 * samples.std(axis=1, ddof=1))
+
+
+#Python functions with a formula for the bootstrap SE of a (reps x n) block of resamples
+ANALYTIC_SE = {
+	statistics.mean: _mean_se,
+	statistics.variance: _variance_se,
+	statistics.pvariance: _pvariance_se,
+	statistics.stdev: _stdev_se,
+	statistics.pstdev: _pstdev_se,
+	sum: _sum_se,
+}
+if hasattr(statistics, "fmean"):		#Python 3.8 or newer
+	ANALYTIC_SE[statistics.fmean] = _mean_se
+
+
+def get_inner_se(func):
+	"""Returns the analytic SE function for func (from ANALYTIC_SE or the
+	attribute func.inner_se) or None if there is none"""
+	try:
+		se_function = ANALYTIC_SE.get(func)
+	except TypeError:		#unhashable callable
+		se_function = None
+	if se_function is None:
+		se_function = getattr(func, "inner_se", None)
+	return se_function
+
+
+def inner_replicates(func, samples, reps2, rng, max_elements=2 ** 22):
+	"""Draws reps2 inner resamples of every row of samples and evaluates func.
+	The inner loops of several rows form one block of at most max_elements
+	values. Returns a (rows x reps2) array and the number of failed evaluations"""
+	rows, n = samples.shape[:2]
+	per_block = max(1, max_elements // (reps2 * samples[0].size))
+	values = np.empty((rows, reps2))
+	failed = 0
+	for first in range(0, rows, per_block):
+		block = samples[first:first + per_block]
+		b = len(block)
+		indices = rng.integers(0, n, size=(b, reps2, n))
+		inner = block[np.arange(b)[:, None, None], indices]
+		results, nfailed = apply_statistic(func, inner.reshape((b * reps2,) + samples.shape[1:]))
+		values[first:first + b] = results.reshape(b, reps2)
+		failed += nfailed
+	return values, failed
+
+
+def counts_to_indices(counts):
+	"""Index matrix with the same resamples as a matrix of counts. Every row
+	sums to n, so all repeated indices fit into a (rows x n) matrix (sorted
+	within each row, which does not matter for the statistic)"""
+	rows, n = counts.shape
+	return np.repeat(np.tile(np.arange(n), rows), counts.ravel()).reshape(rows, n)
+
+
+def nested_bootstrap(func, data, reps1, reps2, theta_hat, batch_size=None, rng=None, inner_se="auto",
+	calibrate=False, resampling="indices"):
+	"""Double bootstrap with vectorized inner loops
+
+	Args:
+		inner_se (str): "auto" uses a formula for the inner SE if func has
+			one (mean, proportions, sum, variance and standard deviation by
+			the delta method), "bootstrap" always runs the inner loop
+			(default is "auto")
+		calibrate (bool): If True, also returns for every outer resample the
+			share of its inner replicates that are at most theta_hat
+			(prepivoting). Needs the inner loop (default is False)
+		resampling (str): "weights" draws the outer resamples as counts and
+			evaluates the weighted version of func, like
+			vectorboot.bootstrap_replicates. The inner level always uses
+			the resamples themselves (default is "indices")
+
+	Returns:
+		(theta_stars, tvalues, uvalues, failed, failed_inner): uvalues is
+			None if calibrate is False. Outer resamples with an inner SE of
+			zero (e.g. all values equal) get a nan t-value and are counted
+			in failed_inner
+	"""
+	data = np.asarray(data, dtype=np.float64)
+	n = len(data)
+	if batch_size is None:
+		batch_size = default_batch_size(data.size)
+	if rng is None:
+		rng = make_rng()
+	se_function = get_inner_se(func) if inner_se == "auto" and not calibrate else None
+	theta_stars = np.empty(reps1)
+	tvalues = np.empty(reps1)
+	uvalues = np.empty(reps1) if calibrate else None
+	failed, failed_inner = 0, 0
+	pos = 0
+	timers = instrumentation.timers()
+	clock = timers.start()
+	if resampling == "weights":
+		blocks = count_batches(n, reps1, batch_size, rng)
+	else:
+		blocks = index_batches(n, reps1, batch_size, rng)
+	for block in blocks:
+		clock = timers.lap("rng", clock)
+		if resampling == "weights":
+			values, nfailed = apply_weighted_statistic(func, data, block)
+			samples = data[counts_to_indices(block)]		#for the inner level
+		else:
+			samples = data[block]
+			clock = timers.lap("resample", clock)
+			values, nfailed = apply_statistic(func, samples)
+		failed += nfailed
+		clock = timers.lap("statistic", clock)
+		if se_function is not None:
+			se = se_function(samples)
+		else:
+			inner, nfailed = inner_replicates(func, samples, reps2, rng, batch_size * data.size)
+			failed_inner += nfailed
+			with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+				warnings.simplefilter("ignore", RuntimeWarning)		#fewer than two valid inner values give NaN
+				se = np.nanstd(inner, axis=1, ddof=1)
+				if calibrate:
+					valid = (~np.isnan(inner)).sum(axis=1)
+					uvalues[pos:pos + len(values)] = (inner <= theta_hat).sum(axis=1) / valid
+		clock = timers.lap("inner", clock)
+		theta_stars[pos:pos + len(values)] = values
+		with np.errstate(divide="ignore", invalid="ignore"):
+			t = (values - theta_hat) / se
+		degenerate = ~np.isfinite(t) & ~np.isnan(values)		#inner SE is zero or nan
+		t[degenerate] = np.nan		#skipped in the studentized quantiles
+		failed_inner += int(degenerate.sum())
+		tvalues[pos:pos + len(values)] = t
+		pos += len(values)
+	return theta_stars, tvalues, uvalues, failed, failed_inner
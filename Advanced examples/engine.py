@@ -0,0 +1,348 @@
+#Reusable multiprocessing engine for bootstrap_ci and permutationtest
+#The worker processes are started once and kept alive between calls. The
+#replications are split into small chunks that are handed out whenever a
+#worker becomes idle, so faster workers process more chunks. Large inputs and
+#outputs are exchanged through shared memory instead of being pickled.
+
+import math
+import pickle
+import random
+from collections import OrderedDict, deque
+from multiprocessing import Pool, get_context, shared_memory, resource_tracker
+import numpy as np
+from seeding import seed_sequence, chunk_sequence, python_seed
+from instrumentation import instrumented
+
+
+_attached = OrderedDict()	#shared memory blocks attached by this process
+MAX_ATTACHED = 8
+_released = deque(maxlen=64)	#blocks released by this process, workers detach them with the next tasks
+DEFAULT_CHUNKS = 64		#replications are split into this many chunks
+_current_sequence = None	#SeedSequence of the chunk computed by this process
+_inherited = None		#tasks that cannot be pickled, inherited by forked workers
+
+
+class SharedArray:
+	"""NumPy array in shared memory. Worker processes attach to it by name
+	(see attach), so the data is neither pickled nor copied per worker"""
+
+	def __init__(self, shape, dtype=np.float64):
+		dtype = np.dtype(dtype)
+		nbytes = int(np.prod(shape)) * dtype.itemsize
+		self.shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+		self.array = np.ndarray(shape, dtype, buffer=self.shm.buf)
+		self.handle = (self.shm.name, tuple(shape), dtype.str)
+
+	@classmethod
+	def from_array(cls, values):
+		"""Copies an existing array into shared memory"""
+		values = np.asarray(values)
+		shared = cls(values.shape, values.dtype)
+		shared.array[...] = values
+		return shared
+
+	def release(self):
+		"""Frees the shared memory, the array must not be used afterwards.
+		Workers still attached to it detach when they get their next task"""
+		_released.append(self.shm.name)
+		self.array = None
+		self.shm.close()
+		self.shm.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.release()
+
+
+def publish(data):
+	"""Puts numeric data into shared memory. Returns None if the data cannot
+	be stored as a float64 array, it has to be pickled in this case"""
+	try:
+		values = np.asarray(data, dtype=np.float64)
+	except (TypeError, ValueError):
+		return None
+	return SharedArray.from_array(values)
+
+
+def attach(handle, as_list=False):
+	"""Returns the array of a SharedArray handle inside a worker process. The
+	block stays attached for later chunks. Arrays are returned unchanged.
+	With as_list=True, the values are returned as a sequence of Python
+	numbers for functions that expect lists: a read-only memoryview of the
+	shared block for 1-D float64 data (no copy per worker), a cached list
+	for records"""
+	if isinstance(handle, np.ndarray):		#data in this process, nothing to attach
+		return handle.tolist() if as_list else handle
+	name, shape, dtype = handle
+	if name in _attached:
+		_attached.move_to_end(name)
+	else:
+		shm = shared_memory.SharedMemory(name=name)
+		_attached[name] = [shm, np.ndarray(shape, dtype, buffer=shm.buf), None]
+		while len(_attached) > MAX_ATTACHED:
+			_close(_attached.popitem(last=False)[1])
+	entry = _attached[name]
+	if not as_list:
+		return entry[1]
+	if entry[2] is None:
+		if len(shape) == 1 and np.dtype(dtype) == np.float64:
+			entry[2] = entry[0].buf.cast("d").toreadonly()
+		else:
+			entry[2] = entry[1].tolist()		#memoryviews cannot return rows
+	return entry[2]
+
+
+def _close(entry):
+	"""Unmaps an attached block"""
+	shm, entry[1] = entry[0], None
+	if isinstance(entry[2], memoryview):
+		entry[2].release()
+	entry[2] = None
+	try:
+		shm.close()
+	except BufferError:		#still used somewhere, unmapped when the last view is gone
+		pass
+
+
+def detach(names):
+	"""Unmaps the given blocks if attached, called with the names of blocks
+	the publishing process has released"""
+	for name in names:
+		entry = _attached.pop(name, None)
+		if entry is not None:
+			_close(entry)
+
+
+def chunk_rng():
+	"""Returns a NumPy random generator for the chunk that is currently
+	computed. Workers using NumPy must draw from it instead of a global
+	generator, the random module is already seeded for the chunk"""
+	return np.random.default_rng(_current_sequence)
+
+
+def chunk_sizes(reps, chunksize=None, chunks=DEFAULT_CHUNKS):
+	"""Splits reps into chunks that sum up to exactly reps. The split does not
+	depend on the number of processes, so seeded results do not either"""
+	if chunksize is None:
+		chunksize = max(1, math.ceil(reps / chunks))
+	sizes = [chunksize] * (reps // chunksize)
+	if reps % chunksize:
+		sizes.append(reps % chunksize)
+	return sizes
+
+
+def make_tasks(worker, args, reps, chunksize=None, with_offsets=False, seed=None, chunks=DEFAULT_CHUNKS,
+	first_chunk=0, instrument=False):
+	"""Creates one task per chunk, each with its own random stream. Chunks are
+	numbered from first_chunk on, so later calls with the same seed can add
+	new replications instead of repeating earlier ones. With instrument=True,
+	every chunk returns (result, record), see instrumentation"""
+	root = seed_sequence(seed)
+	tasks = []
+	start = 0
+	for number, size in enumerate(chunk_sizes(reps, chunksize, chunks)):
+		tasks.append((worker, args, start, size, chunk_sequence(root, first_chunk + number), with_offsets,
+			instrument, tuple(_released)))
+		start += size
+	return tasks
+
+
+def _run_chunk(task, sent=True):
+	"""Runs one chunk inside a worker process (sent=False: in this process)"""
+	global _current_sequence
+	worker, args, start, size, sequence, with_offsets, instrument, released = task
+	detach(released)
+	_current_sequence = sequence
+	random.seed(python_seed(sequence))
+	args = args + (start, size) if with_offsets else args + (size,)
+	if instrument:
+		return instrumented(worker, args, size, sent)
+	return worker(*args)
+
+
+def _run_counted(task):
+	"""Runs one chunk and also returns its size, for progress reports"""
+	return task[3], _run_chunk(task)
+
+
+def _run_inherited(number):
+	"""Runs the chunk with the given number of the tasks inherited from the
+	process that forked this worker"""
+	return _run_counted(_inherited[number])
+
+
+def picklable(obj):
+	"""Whether obj can be sent to the worker processes, e.g. False for lambda
+	functions and closures"""
+	try:
+		pickle.dumps(obj)
+	except Exception:
+		return False
+	return True
+
+
+def _collected(results, profile):
+	"""Chunk results of an instrumented run, the records go to profile"""
+	for result in results:
+		yield result if profile is None else profile.collect(result)
+
+
+def iter_serial(worker, args, reps, chunksize=None, with_offsets=False, seed=None, chunks=DEFAULT_CHUNKS,
+	first_chunk=0, profile=None):
+	"""Same as ResamplingEngine.iter_run, but computes the chunks in this process"""
+	tasks = make_tasks(worker, args, reps, chunksize, with_offsets, seed, chunks, first_chunk, profile is not None)
+	if profile is not None:
+		profile.begin(tasks, sent=False)
+	try:
+		yield from _collected((_run_chunk(task, sent=False) for task in tasks), profile)
+	finally:
+		if profile is not None:
+			profile.finish()
+
+
+def run_serial(worker, args, reps, chunksize=None, with_offsets=False, seed=None, chunks=DEFAULT_CHUNKS,
+	first_chunk=0, progress=None, profile=None):
+	"""Same as ResamplingEngine.run, but computes all chunks in this process.
+	Uses the same chunks and random streams, so the results are identical"""
+	tasks = make_tasks(worker, args, reps, chunksize, with_offsets, seed, chunks, first_chunk, profile is not None)
+	if profile is not None:
+		profile.begin(tasks, sent=False)
+	results = []
+	for task in tasks:
+		results.extend(_collected([_run_chunk(task, sent=False)], profile))
+		if progress is not None:
+			progress(task[3])
+	if profile is not None:
+		profile.finish()
+	return results
+
+
+class ResamplingEngine:
+	"""Pool of worker processes that can be reused for many computations
+
+	Use it as a context manager or call close() when done:
+
+		with ResamplingEngine(threads=4) as engine:
+			for data in datasets:
+				bootstrap_ci(mean, data, reps1=10_000, engine=engine)
+
+	Note that all functions and data sent to the workers are pickled. Runs
+	with a statistic that cannot be pickled (lambda functions, closures) are
+	computed by worker processes forked for this run, which inherit the
+	statistic. Without the fork start method (Windows, macOS default), a
+	TypeError is raised for them.
+	"""
+
+	def __init__(self, threads=2, chunks=DEFAULT_CHUNKS):
+		"""
+		Args:
+			threads (int): Number of worker processes (default is 2)
+			chunks (int): Into how many chunks the replications are split.
+				More chunks balance the load better, fewer chunks cause less
+				overhead. Seeded results depend on this number, but not on
+				the number of threads (default is 64)
+		"""
+		assert threads > 0
+		self.threads = threads
+		self.chunks = chunks
+		#Workers must share the resource tracker of this process. Otherwise
+		#each worker tracks attached shared memory and removes it on exit
+		resource_tracker.ensure_running()
+		self.pool = Pool(processes=threads)
+
+	def run(self, worker, args, reps, chunksize=None, with_offsets=False, seed=None, first_chunk=0, progress=None,
+		profile=None):
+		"""Computes worker(*args, size) for chunks with a total size of
+		exactly reps and returns the list of chunk results (in order of
+		completion). With with_offsets=True, worker(*args, start, size) is
+		called instead, where start is the position of the first replication
+		of the chunk, e.g. to write into a SharedArray. Every chunk gets its
+		own random stream derived from seed and the chunk number (counted
+		from first_chunk). progress(size) is called whenever a chunk of size
+		replications has finished, e.g. a calibration.Progress. If profile
+		(an instrumentation.Profile) is given, the chunks are timed and their
+		records are added to it"""
+		tasks = make_tasks(worker, args, reps, chunksize, with_offsets, seed, self.chunks, first_chunk,
+			profile is not None)
+		if profile is not None:
+			profile.begin(tasks)
+		if picklable(tasks[0][:2]):
+			chunks = self.pool.imap_unordered(_run_counted, tasks)
+		else:
+			chunks = self._forked(tasks)
+		results = []
+		for size, result in chunks:
+			results.extend(_collected([result], profile))
+			if progress is not None:
+				progress(size)
+		if profile is not None:
+			profile.finish()
+		return results
+
+	def iter_run(self, worker, args, reps, chunksize=None, with_offsets=False, seed=None, first_chunk=0,
+		profile=None):
+		"""Like run, but yields the chunk results one by one in chunk order.
+		Only one chunk per worker is computed ahead, so the caller can stop
+		iterating early (e.g. sequential tests) without wasting much work.
+		The results up to any chunk do not depend on the number of threads"""
+		tasks = make_tasks(worker, args, reps, chunksize, with_offsets, seed, self.chunks, first_chunk,
+			profile is not None)
+		if profile is not None:
+			profile.begin(tasks)
+		try:
+			if not picklable(tasks[0][:2]):
+				yield from _collected((result for size, result in self._forked(tasks)), profile)
+				return
+			for first in range(0, len(tasks), self.threads):
+				results = self.pool.imap(_run_chunk, tasks[first:first + self.threads])
+				try:
+					yield from _collected(results, profile)
+				finally:
+					for result in results:
+						pass		#wait for the rest of the wave before shared data is released
+		finally:
+			if profile is not None:
+				profile.finish()
+
+	def _forked(self, tasks):
+		"""Yields (size, result) of all chunks in chunk order, computed by new
+		processes that are forked for this run and inherit the tasks"""
+		global _inherited
+		try:
+			context = get_context("fork")
+		except ValueError:
+			raise TypeError("The statistic cannot be pickled and sent to the worker processes, define it "
+				"at module level instead of a lambda function or closure") from None
+		_inherited = tasks
+		try:
+			with context.Pool(processes=self.threads) as pool:
+				yield from pool.imap(_run_inherited, range(len(tasks)))
+		finally:
+			_inherited = None
+
+	def imap(self, func, iterable, chunksize=1000):
+		"""Applies func to all items of iterable in the worker processes and
+		returns an iterator over the results (in order of completion)"""
+		return self.pool.imap_unordered(func, iterable, chunksize)
+
+	def close(self):
+		"""Stops all worker processes"""
+		self.pool.close()
+		self.pool.join()
+
+	def terminate(self):
+		"""Stops all worker processes at once, chunks not yet computed are
+		dropped (e.g. after a worker raised)"""
+		self.pool.terminate()
+		self.pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.terminate()
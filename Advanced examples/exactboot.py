@@ -0,0 +1,241 @@
+#Exact (exhaustive) bootstrap by enumerating count vectors
+#A bootstrap resample is fully described by how often every observation is
+#drawn, so instead of all n ** n ordered resamples (or all permutations of
+#every multiset, see History/Python_Exhaustive_Bootstrap.py) only the count
+#vectors are visited. Their multinomial probabilities are computed in closed
+#form. Duplicate values are collapsed first, the statistic is evaluated for
+#blocks of count vectors with the weighted kernels from vectorboot, and the
+#results are reduced into weighted moments and a weighted CDF on the fly.
+
+import math
+import statistics
+from functools import lru_cache
+import numpy as np
+import vectorboot
+from kernels import get_function
+from exactperm import SUM_STATISTICS, integer_scale
+
+
+@lru_cache(maxsize=4096)
+def compositions(total, parts):
+	"""All vectors of parts non-negative integers that sum up to total, as
+	an array with one row per vector (lexicographic order). Cached, the
+	returned array must not be modified"""
+	if parts == 1:
+		return np.array([[total]], dtype=np.int64)
+	blocks = []
+	for first in range(total, -1, -1):
+		rest = compositions(total - first, parts - 1)
+		blocks.append(np.column_stack([np.full(len(rest), first, dtype=np.int64), rest]))
+	return np.concatenate(blocks)
+
+
+def _composition_pieces(total, parts, blocksize):
+	"""Fixes the leading part recursively until the rest fits into a block"""
+	if math.comb(total + parts - 1, parts - 1) <= blocksize or parts == 1:
+		yield compositions(total, parts)
+		return
+	for first in range(total, -1, -1):
+		for piece in _composition_pieces(total - first, parts - 1, blocksize):
+			yield np.column_stack([np.full(len(piece), first, dtype=np.int64), piece])
+
+
+def composition_blocks(total, parts, blocksize=2 ** 16):
+	"""Yields all compositions of total into parts as arrays of blocksize to
+	2 * blocksize rows (except the last one), so the whole space is never
+	held in memory. Small pieces are collected into one block"""
+	pieces, rows = [], 0
+	for piece in _composition_pieces(total, parts, blocksize):
+		pieces.append(piece)
+		rows += len(piece)
+		if rows >= blocksize:
+			yield np.concatenate(pieces)
+			pieces, rows = [], 0
+	if pieces:
+		yield np.concatenate(pieces)
+
+
+def log_weights(counts, multiplicities, n):
+	"""Log probabilities of count vectors over unique values. A count vector
+	k has n! / prod(k_j!) orderings, and each position can be filled by any
+	of the c_j copies of value j, out of n ** n equally likely resamples"""
+	logfactorial = np.array([math.lgamma(k + 1) for k in range(n + 1)])
+	result = logfactorial[n] - n * math.log(n) - logfactorial[counts].sum(axis=1)
+	if (multiplicities > 1).any():		#only if the data contains ties
+		result += counts @ np.log(multiplicities)
+	return result
+
+
+class WeightedSummary:
+	"""Mergeable summary of weighted results: total weight, weighted mean,
+	weighted sum of squared deviations (Chan et al.) and a weighted CDF as a
+	dict of value -> weight"""
+
+	def __init__(self):
+		self.weight = 0.0
+		self.mean = 0.0
+		self.m2 = 0.0
+		self.cdf = {}
+		self.count = 0
+		self.failed = 0
+
+	def add(self, values, weights):
+		"""Adds a block of results with their probabilities, NaN results are
+		counted as failed and skipped"""
+		valid = ~np.isnan(values)
+		self.failed += int((~valid).sum())
+		values, weights = values[valid], weights[valid]
+		self.count += len(values)
+		if len(values) == 0:
+			return
+		block = WeightedSummary()
+		block.weight = weights.sum()
+		block.mean = (weights @ values) / block.weight
+		block.m2 = weights @ (values - block.mean) ** 2
+		unique, inverse = np.unique(values, return_inverse=True)
+		block.cdf = dict(zip(unique.tolist(), np.bincount(inverse, weights).tolist()))
+		self.merge(block)
+
+	def merge(self, other):
+		"""Combines two summaries, same result as one summary of all blocks"""
+		total = self.weight + other.weight
+		if other.weight > 0:
+			delta = other.mean - self.mean
+			self.mean += delta * other.weight / total
+			self.m2 += other.m2 + delta ** 2 * self.weight * other.weight / total
+		self.weight = total
+		for value, weight in other.cdf.items():
+			self.cdf[value] = self.cdf.get(value, 0.0) + weight
+		self.count += other.count
+		self.failed += other.failed
+
+	def stdev(self):
+		"""Standard deviation of the weighted distribution"""
+		return math.sqrt(self.m2 / self.weight)
+
+	def quantiles(self, probabilities):
+		"""Smallest values whose cumulative weight reaches p * total weight"""
+		values = sorted(self.cdf)
+		cumulative = np.cumsum([self.cdf[value] for value in values])
+		positions = np.searchsorted(cumulative, np.asarray(probabilities) * self.weight * (1 - 1e-12))
+		return [values[min(position, len(values) - 1)] for position in positions]
+
+
+def _exact_task(task):
+	"""Enumerates all count vectors starting with the given prefix"""
+	func, values, multiplicities, n, prefix, blocksize = task
+	summary = WeightedSummary()
+	rest = n - sum(prefix)
+	for block in composition_blocks(rest, len(values) - len(prefix), blocksize):
+		counts = np.column_stack([np.tile(prefix, (len(block), 1)), block]) if prefix else block
+		weights = np.exp(log_weights(counts, multiplicities, n))
+		results = vectorboot.apply_weighted_statistic(func, values, counts)[0]
+		summary.add(results, weights)
+	return summary
+
+
+def partition_prefixes(n, parts, depth):
+	"""Splits the composition space by fixing the first depth parts"""
+	depth = max(0, min(depth, parts - 1))
+	prefixes = [()]
+	for level in range(depth):
+		prefixes = [prefix + (k,) for prefix in prefixes for k in range(n - sum(prefix), -1, -1)]
+	return prefixes
+
+
+def exact_mean_distribution(data):
+	"""Exact bootstrap distribution of the mean without enumeration. If the
+	data can be scaled to integers, the distribution of the resample sum is
+	the n-fold convolution of the empirical distribution (one FFT).
+	Returns a WeightedSummary or None if the data is not on a grid"""
+	values = [float(x) for x in data]
+	n = len(values)
+	scale = integer_scale(values)
+	if scale is None:
+		return None
+	integers = [int(round(x * scale)) for x in values]
+	low = min(integers)
+	single = np.bincount([x - low for x in integers]) / n
+	size = n * (len(single) - 1) + 1
+	if size > 2 ** 24:
+		return None
+	length = 1 << (size - 1).bit_length() if size > 1 else 1
+	distribution = np.fft.irfft(np.fft.rfft(single, length) ** n, length)[:size]
+	distribution = np.clip(distribution, 0, None)
+	distribution /= distribution.sum()
+	summary = WeightedSummary()
+	means = (np.arange(size) + n * low) / (scale * n)
+	summary.weight = 1.0
+	summary.mean = math.fsum(values) / n
+	summary.m2 = statistics.pvariance(values) / n		#Var(mean*) = plug-in variance / n
+	summary.cdf = {mean: weight for mean, weight in zip(means.tolist(), distribution.tolist()) if weight > 0}
+	summary.count = size
+	return summary
+
+
+def exact_bootstrap(func, data, alpha=0.05, engine=None, depth=None, blocksize=2 ** 16):
+	"""Computes the ideal bootstrap distribution of func, i.e. the result
+	with infinitely many replications, by visiting every possible resample
+	once (as a count vector). Feasible for n up to the mid-teens and for
+	larger samples with many ties
+
+	Args:
+		func (func): Statistic, vectorized for frequency weights if possible
+			(mean, variance, stdev, median, the quantiles from vectorboot).
+			Other functions are called once per count vector
+		data (list): Given data
+		alpha (float): Nominal coverage of the percentile CI is 1 - alpha
+			(default is 0.05)
+		engine (ResamplingEngine): If given, the count vectors are split by
+			their first parts and enumerated in the worker processes
+			(default is None)
+		depth (int): Number of leading parts fixed per task. If None, 2 with
+			an engine and 0 without (default is None)
+		blocksize (int): Number of count vectors evaluated at once
+			(default is 2 ** 16)
+
+	Returns:
+		res: dict with theta_hat, mean_boot, se_boot, bias, the percentile
+			CI, the number of distinct resamples and the method ("closed form" for
+			the mean or sum of data on a grid, "enumeration" otherwise)
+	"""
+	func = get_function(func)
+	values, multiplicities = np.unique(np.asarray(data, dtype=np.float64), return_counts=True)
+	n = len(data)
+	res = {"func": func, "n": n, "theta_hat": func(data), "alpha": alpha, "unique": len(values)}
+	summary = None
+	if func in SUM_STATISTICS:
+		summary = exact_mean_distribution(data)
+		if summary is not None and func is sum:
+			summary.mean *= n
+			summary.m2 *= n ** 2
+			summary.cdf = {mean * n: weight for mean, weight in summary.cdf.items()}
+	if summary is not None:
+		res["method"] = "closed form"
+	else:
+		res["method"] = "enumeration"
+		if depth is None:
+			depth = 0 if engine is None else 2
+		tasks = [(func, values, multiplicities, n, prefix, blocksize)
+			for prefix in partition_prefixes(n, len(values), depth)]
+		parts = map(_exact_task, tasks) if engine is None else engine.imap(_exact_task, tasks, chunksize=1)
+		summary = WeightedSummary()
+		for part in parts:
+			summary.merge(part)
+	res["compositions"] = math.comb(n + len(values) - 1, n)		#distinct resamples
+	res["failed"] = summary.failed
+	res["mean_boot"] = float(summary.mean)
+	res["se_boot"] = summary.stdev()
+	res["bias"] = res["mean_boot"] - res["theta_hat"]
+	res["percentile"] = tuple(summary.quantiles([alpha / 2, 1 - alpha / 2]))
+	return res
+
+
+
+
+if __name__ == '__main__':
+	testdata = [1, 2, 3, 4, 5, 6, 7]
+	print(exact_bootstrap(statistics.mean, testdata))
+	print(exact_bootstrap(statistics.median, testdata))
+	studentdata = [19, 29, 29, 30, 34, 36, 39, 47, 51, 52, 53, 60, 60, 64, 66, 68, 70]
+	print(exact_bootstrap(statistics.median, studentdata))
@@ -0,0 +1,317 @@
+#Exact (exhaustive) permutation tests without evaluating the statistic for
+#every combination. For the difference in means or sums, only the sum of
+#group 1 matters. The combinations are visited in revolving door (Gray code)
+#order, where each step swaps one element in and one element out, so the
+#group sum is updated in O(1) instead of rebuilding both groups. For paired
+#data, the exact distribution of the sum of the signed differences is
+#computed by dynamic programming if the differences scale to integers, or by
+#enumerating the sums of both halves of the differences (meet in the middle)
+#instead of all 2 ** n signs. Only larger samples of non-integer differences
+#fall back to an FFT on a grid, which is approximate.
+
+import math
+import statistics
+import numpy as np
+
+
+#Statistics for which the group difference is monotone in the sum of group 1
+SUM_STATISTICS = {statistics.mean, sum}
+if hasattr(statistics, "fmean"):		#Python 3.8 or newer
+	SUM_STATISTICS.add(statistics.fmean)
+
+
+def revolving_door(n, k):
+	"""Visits all k-element subsets of range(n) in revolving door order
+	(Knuth, TAOCP 7.2.1.3, Algorithm R), starting with {0, ..., k - 1}.
+	Yields one pair (out, in) per step: the index leaving and the index
+	entering the subset"""
+	if k <= 0 or k >= n:
+		return
+	c = [None] + list(range(k)) + [n]	#c[1] < ... < c[k], c[k + 1] is a sentinel
+	while True:
+		if k % 2 == 1:
+			if c[1] + 1 < c[2]:
+				yield c[1], c[1] + 1
+				c[1] += 1
+				continue
+			j, increase = 2, False
+		else:
+			if c[1] > 0:
+				yield c[1], c[1] - 1
+				c[1] -= 1
+				continue
+			j, increase = 2, True
+		while True:
+			if j > k:
+				return
+			if not increase:		#Try to decrease c[j]
+				if c[j] >= j:
+					yield c[j], j - 2
+					c[j] = c[j - 1]
+					c[j - 1] = j - 2
+					break
+				j += 1
+			if j > k:
+				return
+			if c[j] + 1 < c[j + 1]:		#Try to increase c[j]
+				yield j - 2, c[j] + 1
+				c[j - 1] = c[j]
+				c[j] += 1
+				break
+			j += 1
+			increase = False
+
+
+def count_extreme_sums(values, k, base, lower, upper, blocksize=2 ** 16):
+	"""Counts the k-subsets of values whose sum plus base is <= lower or
+	>= upper. The running sum is updated per swap and recomputed exactly
+	after every blocksize steps, so rounding errors cannot accumulate"""
+	n = len(values)
+	inset = [i < k for i in range(n)]
+	current = base + math.fsum(values[:k])
+	count = 1 if (current <= lower or current >= upper) else 0
+	steps = 0
+	for out, new in revolving_door(n, k):
+		inset[out] = False
+		inset[new] = True
+		current += values[new] - values[out]
+		steps += 1
+		if steps == blocksize:
+			current = base + math.fsum(value for value, member in zip(values, inset) if member)
+			steps = 0
+		if current <= lower or current >= upper:
+			count += 1
+	return count
+
+
+def _count_task(task):
+	"""Worker function for one part of the combination space"""
+	return count_extreme_sums(*task)
+
+
+def partition_tasks(values, k, lower, upper, depth, blocksize=2 ** 16):
+	"""Splits the combination space by fixing the membership of the last
+	depth elements. Every task walks the subsets of the remaining elements
+	with its own revolving door sequence"""
+	n = len(values)
+	depth = max(0, min(depth, n - 1))
+	m = n - depth
+	tasks = []
+	for mask in range(2 ** depth):
+		forced = [m + i for i in range(depth) if mask >> i & 1]
+		rest = k - len(forced)
+		if 0 <= rest <= m:
+			base = math.fsum(values[i] for i in forced)
+			tasks.append((values[:m], rest, base, lower, upper, blocksize))
+	return tasks
+
+
+def exhaustive_sum_test(data1, data2, alternative="auto", engine=None, depth=None, tolerance=1e-9,
+	func=statistics.mean):
+	"""Exact permutation test for the difference in means (or sums) of two
+	groups, visiting all C(n1 + n2, n1) splits
+
+	Args:
+		data1 (list): Data of group 1
+		data2 (list): Data of group 2
+		alternative (str): "greater" counts splits with a difference at least
+			as large as observed, "less" at most as large, "two-sided" at
+			least as large in absolute value. "auto" uses the direction of
+			the observed difference like permutationtest (default is "auto")
+		engine (ResamplingEngine): If given, the combination space is split
+			into parts that are counted in the worker processes (default is None)
+		depth (int): Number of elements whose membership is fixed to create
+			2 ** depth parts. If None, chosen from the number of threads
+			(default is None)
+		tolerance (float): Relative tolerance for ties between sums (default is 1e-9)
+		func (func): Statistic of SUM_STATISTICS whose difference is tested.
+			With unequal group sizes, the difference of the sums is zero at
+			another sum of group 1 than the difference of the means
+			(default is statistics.mean)
+
+	Returns:
+		(more_extreme, total): number of splits at least as extreme as the
+			observed one and number of all splits
+	"""
+	values = [float(x) for x in list(data1) + list(data2)]
+	n1, n2 = len(data1), len(data2)
+	total_sum = math.fsum(values)
+	observed = math.fsum(values[:n1])
+	#Sum of group 1 for a difference of zero, both differences increase with it
+	if func is sum:
+		center = total_sum / 2
+	else:
+		center = total_sum * n1 / (n1 + n2)
+	tol = tolerance * max(1.0, math.fsum(abs(x) for x in values))
+	if alternative == "auto":
+		alternative = "greater" if observed - center > tol else "less"
+	if alternative == "greater":
+		lower, upper = -math.inf, observed - tol
+	elif alternative == "less":
+		lower, upper = observed + tol, math.inf
+	else:
+		distance = abs(observed - center) - tol
+		lower, upper = center - distance, center + distance
+	total = math.comb(n1 + n2, n1)
+	if engine is None:
+		return count_extreme_sums(values, n1, 0.0, lower, upper), total
+	if depth is None:
+		depth = max(1, math.ceil(math.log2(engine.threads * 8)))
+	tasks = partition_tasks(values, n1, lower, upper, depth)
+	return sum(engine.imap(_count_task, tasks, chunksize=1)), total
+
+
+def integer_scale(values, max_decimals=6, tolerance=1e-9):
+	"""Returns the smallest power of ten that turns all values into integers
+	(up to floating point rounding errors) or None if there is none"""
+	for decimals in range(max_decimals + 1):
+		scale = 10 ** decimals
+		if all(abs(x * scale - round(x * scale)) <= tolerance * max(1.0, abs(x * scale)) for x in values):
+			return scale
+	return None
+
+
+def subset_sum_distribution(weights):
+	"""Distribution of sum(s_i * w_i) over s in {0, 1}^n with all 2 ** n sign
+	vectors equally likely, for non-negative integer weights. Dynamic
+	programming, each weight convolves the distribution with a two-point
+	distribution. Returns an array of probabilities for the sums 0 ... sum(w)"""
+	distribution = np.zeros(sum(weights) + 1)
+	distribution[0] = 1.0
+	top = 0		#Largest reachable sum so far
+	for w in weights:
+		if w == 0:
+			continue	#Both signs give the same sum
+		distribution[w:top + w + 1] += distribution[:top + 1].copy()
+		top += w
+		distribution[:top + 1] /= 2
+	return distribution
+
+
+def _binomial_on_lattice(weight, count):
+	"""Distribution of the sum of count two-point distributions on {0, weight}:
+	Binomial(count, 1 / 2) on the multiples of weight"""
+	k = np.arange(1, count + 1)
+	log_pmf = np.concatenate([[0.0], np.cumsum(np.log((count - k + 1) / k))]) - count * math.log(2)
+	distribution = np.zeros(count * weight + 1)
+	distribution[::weight] = np.exp(log_pmf)
+	return distribution
+
+
+def _convolve_fft(a, b):
+	size = len(a) + len(b) - 1
+	length = 1 << (size - 1).bit_length()
+	return np.fft.irfft(np.fft.rfft(a, length) * np.fft.rfft(b, length), length)[:size]
+
+
+def subset_sum_distribution_fft(weights, size):
+	"""Same as subset_sum_distribution, but fast for many weights and large
+	sums. Equal weights are grouped (their sum is binomial), the distributions
+	of the groups are then convolved pairwise with FFTs. The cost depends on
+	the number of different weights and the total, not on n times the total.
+	The result has rounding errors of about 1e-15"""
+	counts = np.bincount(np.asarray(weights, dtype=np.int64))
+	parts = [_binomial_on_lattice(weight, int(count)) for weight, count in enumerate(counts)
+		if weight > 0 and count > 0]
+	while len(parts) > 1:
+		parts = [_convolve_fft(parts[i], parts[i + 1]) if i + 1 < len(parts) else parts[i]
+			for i in range(0, len(parts), 2)]
+	distribution = np.zeros(size)
+	if parts:
+		distribution[:min(size, len(parts[0]))] = parts[0][:size]
+	else:
+		distribution[0] = 1.0		#all weights are zero
+	return np.clip(distribution, 0, None)
+
+
+def _subset_sums(values):
+	"""All 2 ** len(values) subset sums, sorted"""
+	sums = np.zeros(1)
+	for x in values:
+		sums = np.concatenate([sums, sums + x])
+	return np.sort(sums)
+
+
+def enumerated_paired_test(values, alternative, tolerance=1e-9):
+	"""Exact paired test for any (also non-integer) differences. The sum of
+	the absolute differences with a positive sign is split into the sums of
+	both halves, the subset sums of each half are enumerated and the
+	combinations at least as extreme are counted with a binary search.
+	Needs memory and time of about 2 ** (n / 2). Sums closer than tolerance
+	(relative to the total) count as ties"""
+	weights = [abs(x) for x in values]
+	total = math.fsum(weights)
+	observed = math.fsum(w for w, x in zip(weights, values) if x > 0)
+	tolerance *= max(1.0, total)
+	half = len(weights) // 2
+	left, right = _subset_sums(weights[:half]), _subset_sums(weights[half:])
+	def at_least(bound):
+		return int((len(right) - np.searchsorted(right, bound - left, side="left")).sum())
+	def at_most(bound):
+		return int(np.searchsorted(right, bound - left, side="right").sum())
+	if alternative == "greater":
+		count = at_least(observed - tolerance)
+	elif alternative == "less":
+		count = at_most(observed + tolerance)
+	else:
+		distance = abs(2 * observed - total)
+		if distance <= tolerance:
+			return 1.0
+		count = at_least((total + distance - tolerance) / 2) + at_most((total - distance + tolerance) / 2)
+	return min(1.0, count / 2 ** len(weights))
+
+
+def exact_paired_test(differences, alternative="auto", max_size=10 ** 7, max_enumeration=40, grid=2 ** 20):
+	"""Exact paired permutation (sign flip) test for the mean or sum of the
+	differences. The null distribution of the sum is computed directly
+	instead of enumerating all 2 ** n sign vectors
+
+	Args:
+		differences (list): Paired differences
+		alternative (str): "greater", "less", "two-sided" or "auto" (direction
+			of the observed mean, like permutationtest) (default is "auto")
+		max_size (int): If the differences can be scaled to integers with a
+			total below max_size, dynamic programming gives the exact
+			distribution (default is 10 ** 7)
+		max_enumeration (int): Otherwise, up to this many differences, the
+			sums of both halves are enumerated, which is exact as well
+			(default is 40)
+		grid (int): Otherwise, the absolute differences are rounded to a grid
+			with this many points and the distribution is computed with an
+			FFT. The p-value is only approximate (default is 2 ** 20)
+
+	Returns:
+		(p_value, method): method is "dp" or "enumeration" (both exact) or
+			"fft" (approximate, on a grid)
+	"""
+	values = [float(x) for x in differences]
+	if not values:
+		raise ValueError("At least one difference is needed")
+	if alternative == "auto":
+		alternative = "greater" if math.fsum(values) > 0 else "less"
+	scale = integer_scale(values)
+	if scale is not None and math.fsum(abs(x) for x in values) * scale < max_size:
+		weights = [int(round(abs(x) * scale)) for x in values]
+		method = "dp"
+	elif len(values) <= max_enumeration:
+		return enumerated_paired_test(values, alternative), "enumeration"
+	else:
+		step = max(abs(x) for x in values) * len(values) / grid
+		weights = [int(round(abs(x) / step)) for x in values]
+		method = "fft"
+	total = sum(weights)
+	if method == "dp":
+		distribution = subset_sum_distribution(weights)
+	else:
+		distribution = subset_sum_distribution_fft(weights, total + 1)
+	#Sum of the weights with a positive sign, the test statistic is 2 * P - total
+	observed = sum(w for w, x in zip(weights, values) if x > 0)
+	if alternative == "greater":
+		p_value = distribution[observed:].sum()
+	elif alternative == "less":
+		p_value = distribution[:observed + 1].sum()
+	else:
+		distance = abs(2 * observed - total)
+		sums = 2 * np.arange(total + 1) - total
+		p_value = distribution[np.abs(sums) >= distance].sum()
+	return min(1.0, float(p_value)), method
@@ -0,0 +1,155 @@
+#Optional instrumentation of the resampling engines
+#If a Profile is passed to a run, every chunk is computed with fresh Timers.
+#The hot loops (multifunc, helper, vectorboot, vectorperm, ...) add the time
+#of each phase to the Timers of the current chunk via timers().lap. Without
+#a Profile, timers() returns a do-nothing object, so the loops only pay for
+#a cheap method call. The engine sends one record per chunk back (worker
+#process, replications, wall and CPU seconds, seconds per phase, bytes of the
+#result), which the Profile aggregates and can export as JSON lines.
+
+import os
+import json
+import time
+import pickle
+
+
+class Timers:
+	"""Seconds and calls per phase"""
+
+	def __init__(self):
+		self.seconds = {}
+		self.calls = {}
+
+	def start(self):
+		return time.perf_counter()
+
+	def lap(self, name, start):
+		"""Adds the time since start to phase name and returns the current
+		time, so consecutive phases can be chained:
+		clock = timers.lap("statistic", clock)"""
+		now = time.perf_counter()
+		self.add(name, now - start)
+		return now
+
+	def add(self, name, seconds, calls=1):
+		self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+		self.calls[name] = self.calls.get(name, 0) + calls
+
+	def merge(self, other):
+		for name, seconds in other.seconds.items():
+			self.add(name, seconds, other.calls[name])
+
+
+class _NullTimers:
+	"""Stands in for Timers when nothing is measured"""
+
+	def start(self):
+		return 0.0
+
+	def lap(self, name, start):
+		return 0.0
+
+	def add(self, name, seconds, calls=1):
+		pass
+
+
+NULL_TIMERS = _NullTimers()
+_current = NULL_TIMERS		#Timers of the chunk that is computed in this process
+
+
+def timers():
+	"""Timers of the current chunk, a do-nothing object if the run is not
+	instrumented"""
+	return _current
+
+
+def instrumented(worker, args, size, sent=True):
+	"""Runs worker(*args) with fresh Timers (inside the worker process).
+	Returns (result, record). If sent is False, the chunk is computed in the
+	calling process and the result is not serialized"""
+	global _current
+	_current = chunk_timers = Timers()
+	began, cpu = time.perf_counter(), time.process_time()
+	try:
+		result = worker(*args)
+	finally:
+		_current = NULL_TIMERS
+	record = {"type": "chunk", "pid": os.getpid(), "reps": size, "started": began,
+		"seconds": time.perf_counter() - began, "cpu": time.process_time() - cpu}
+	record["result_bytes"] = 0
+	if sent:
+		clock = chunk_timers.start()
+		record["result_bytes"] = len(pickle.dumps(result))
+		chunk_timers.lap("ipc", clock)		#the pool serializes the result once more
+	record["phases"] = chunk_timers.seconds
+	record["calls"] = chunk_timers.calls
+	return result, record
+
+
+class Profile:
+	"""Collects the chunk records of instrumented runs and the phases timed
+	in the calling process (e.g. jackknife, quantiles), use it as
+
+		profile = Profile()
+		res = bootstrap_ci(mean, data, reps1=10_000, profile=profile)
+		print(res["profile"])		#aggregates, same as profile.summary()
+		profile.export("profile.jsonl")
+
+	A Profile can be passed to several runs, everything is accumulated"""
+
+	def __init__(self):
+		self.records = []
+		self.timers = Timers()		#phases of the calling process
+		self.wall = 0.0		#seconds spent inside engine runs
+		self.task_bytes = 0
+		self._began = None
+
+	def begin(self, tasks, sent=True):
+		"""Called by the engine before the tasks are sent to the workers
+		(sent=False: computed in this process)"""
+		self._began = time.perf_counter()
+		if sent:
+			clock = self.timers.start()
+			self.task_bytes += sum(len(pickle.dumps(task)) for task in tasks)
+			self.timers.lap("ipc", clock)
+
+	def collect(self, item):
+		"""Stores the record of a chunk and returns its result"""
+		result, record = item
+		self.records.append(record)
+		return result
+
+	def finish(self):
+		"""Called by the engine when a run is done"""
+		if self._began is not None:
+			self.wall += time.perf_counter() - self._began
+			self._began = None
+
+	def summary(self):
+		"""Aggregates: number of chunks and replications, wall time of the
+		runs, seconds per phase (workers and calling process together), bytes
+		sent to and from the workers and per worker process the busy seconds
+		and utilization (busy / wall)"""
+		phases = dict(self.timers.seconds)
+		workers = {}
+		for record in self.records:
+			for name, seconds in record["phases"].items():
+				phases[name] = phases.get(name, 0.0) + seconds
+			worker = workers.setdefault(record["pid"], {"chunks": 0, "reps": 0, "busy": 0.0})
+			worker["chunks"] += 1
+			worker["reps"] += record["reps"]
+			worker["busy"] += record["seconds"]
+		for worker in workers.values():
+			worker["utilization"] = worker["busy"] / self.wall if self.wall > 0 else None
+		return {"chunks": len(self.records), "reps": sum(record["reps"] for record in self.records),
+			"wall": self.wall, "phases": phases, "task_bytes": self.task_bytes,
+			"result_bytes": sum(record["result_bytes"] for record in self.records), "workers": workers}
+
+	def export(self, path):
+		"""Writes all chunk records and the summary as JSON lines"""
+		with open(path, mode="w") as outputfile:
+			for record in self.records:
+				outputfile.write(json.dumps(record) + "\n")
+			summary = dict(self.summary(), type="summary")
+			summary["workers"] = {str(pid): worker for pid, worker in summary["workers"].items()}
+			outputfile.write(json.dumps(summary) + "\n")
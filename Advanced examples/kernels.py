@@ -0,0 +1,123 @@
+#Registry of batched statistic kernels
+#A kernel evaluates a statistic for a whole block of resamples at once. The
+#block has one resample per row, shape (reps, n) for a list of numbers or
+#(reps, n, k) for records like (x, y) pairs. The engines look up the kernel of
+#the Python function they are given (e.g. statistics.mean) or of a name like
+#"mean"; functions without a kernel are called once per resample. The kernels
+#are also used by morestatistics.jackknife for the leave-one-out values.
+
+import statistics
+import numpy as np
+import morestatistics
+
+
+def _moment_ratio(block, power):
+	"""Central moment m_power / m2 ** (power / 2) along the rows"""
+	centered = block - block.mean(axis=1, keepdims=True)
+	m2 = (centered ** 2).mean(axis=1)
+	return (centered ** power).mean(axis=1) / m2 ** (power / 2)
+
+
+def _trimmed_mean(block, proportion=0.1):
+	cut = int(proportion * block.shape[1])
+	return np.sort(block, axis=1)[:, cut:block.shape[1] - cut].mean(axis=1)
+
+
+def _iqr(block):
+	lower, upper = np.percentile(block, [25, 75], axis=1)
+	return upper - lower
+
+
+def _pearson_r(block):
+	"""Correlation of the columns 0 and 1 of a (reps, n, 2) block"""
+	centered = block - block.mean(axis=1, keepdims=True)
+	x, y = centered[..., 0], centered[..., 1]
+	return (x * y).sum(axis=1) / np.sqrt((x ** 2).sum(axis=1) * (y ** 2).sum(axis=1))
+
+
+def _ratio_of_means(block):
+	return block[..., 0].sum(axis=1) / block[..., 1].sum(axis=1)
+
+
+#Python functions with a vectorized counterpart working on a (reps x n) block
+KERNELS = {
+	statistics.mean: lambda block: block.mean(axis=1),
+	statistics.median: lambda block: np.median(block, axis=1),
+	statistics.variance: lambda block: block.var(axis=1, ddof=1),
+	statistics.pvariance: lambda block: block.var(axis=1),
+	statistics.stdev: lambda block: block.std(axis=1, ddof=1),
+	statistics.pstdev: lambda block: block.std(axis=1),
+	morestatistics.kurtosis: lambda block: _moment_ratio(block, 4),
+	morestatistics.skewness: lambda block: _moment_ratio(block, 3),
+	morestatistics.trimmed_mean: _trimmed_mean,
+	morestatistics.iqr: _iqr,
+	morestatistics.pearson_r: _pearson_r,
+	morestatistics.ratio_of_means: _ratio_of_means,
+	sum: lambda block: block.sum(axis=1),
+	max: lambda block: block.max(axis=1),
+	min: lambda block: block.min(axis=1),
+}
+if hasattr(statistics, "fmean"):		#Python 3.8 or newer
+	KERNELS[statistics.fmean] = KERNELS[statistics.mean]
+morestatistics.JACKKNIFE_KERNELS.update(KERNELS)		#used by morestatistics.jackknife
+
+
+#Names that can be given instead of a function
+NAMES = {
+	"mean": statistics.mean,
+	"median": statistics.median,
+	"variance": statistics.variance,
+	"pvariance": statistics.pvariance,
+	"stdev": statistics.stdev,
+	"sd": statistics.stdev,
+	"pstdev": statistics.pstdev,
+	"kurtosis": morestatistics.kurtosis,
+	"skewness": morestatistics.skewness,
+	"trimmed_mean": morestatistics.trimmed_mean,
+	"iqr": morestatistics.iqr,
+	"pearson_r": morestatistics.pearson_r,
+	"ratio_of_means": morestatistics.ratio_of_means,
+	"sum": sum,
+	"max": max,
+	"min": min,
+}
+
+
+def register_kernel(name, func, kernel):
+	"""Registers a batched kernel for a Python function under a name
+
+	Args:
+		name (str): Name that can be passed to the engines instead of func
+		func (func): Python function computing the statistic for one list,
+			used for theta_hat and by the pure Python engines
+		kernel (func): Takes a block with one resample per row and returns
+			one result per row
+	"""
+	NAMES[name] = func
+	KERNELS[func] = kernel
+	morestatistics.JACKKNIFE_KERNELS[func] = kernel
+
+
+def get_function(func):
+	"""Returns the Python function for a registered name. Functions are
+	returned unchanged"""
+	if isinstance(func, str):
+		try:
+			return NAMES[func]
+		except KeyError:
+			raise KeyError(f"No statistic called {func!r}, registered are {sorted(NAMES)}") from None
+	return func
+
+
+def get_kernel(func):
+	"""Returns the vectorized kernel for func (a function or a registered
+	name) or None if there is none. Besides the registry, the attribute
+	func.vectorized is used (see vectorboot.make_quantile)"""
+	func = get_function(func)
+	try:
+		kernel = KERNELS.get(func)
+	except TypeError:		#unhashable callable
+		kernel = None
+	if kernel is None:
+		kernel = getattr(func, "vectorized", None)
+	return kernel
@@ -2,50 +2,109 @@
 #Felix Bittmann, 2020
 #Two-sided permutation test with multithreading
 
+import os
+import sys
 import math
 import time
 import random
 import itertools
 import statistics as stats
-from multiprocessing import Process, Queue, Pool
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))		#morestatistics
+from engine import ResamplingEngine, publish, attach, chunk_rng, run_serial, iter_serial, DEFAULT_CHUNKS
+from calibration import Progress, timed, roundtrip, process_startup, usable_cores, predict, report
+from exactperm import SUM_STATISTICS, exhaustive_sum_test, exact_paired_test
+from sequential import SequentialTest
+from kernels import get_function
+import instrumentation
 
 
-def helper(res, queue):
+MAX_PAIRED_EXHAUSTIVE = 24		#Largest n for enumerating all 2 ** n signs
+PAIRED_FALLBACK_REPS = 100_000		#Random samples used instead
+
+
+def helper(res, reps):
 	"""Helper Function for the multithreading processing"""
 	
-	reps = (res["reps"] // res["threads"]) + 1
-	data = res["data1"] + res["data2"]
+	return shuffle_test(res["data1"] + res["data2"], res, reps)
+	
+	
+def shuffle_test(data, res, reps):
+	"""Random permutations of the combined data (a list that is shuffled in
+	place), returns the number of results at least as extreme as empdiff"""
 	alldiffs = []
+	timers = instrumentation.timers()		#does nothing unless the run is profiled
+	clock = timers.start()
 	for i in range(reps):
 		random.shuffle(data)
+		clock = timers.lap("rng", clock)
 		s1 = data[:res["len1"]]
 		s2 = data[res["len1"]:]
+		clock = timers.lap("resample", clock)
 		diff = res["func"](s1) - res["func"](s2)
 		alldiffs.append(diff)
+		clock = timers.lap("statistic", clock)
 	if res["empdiff"] < 0:
 		overlimit = sum(1 for diff in alldiffs if diff <= res["empdiff"])
 	else:
 		overlimit = sum(1 for diff in alldiffs if diff >= res["empdiff"])
+	timers.lap("reduce", clock)
 	results = (overlimit, reps)
-	queue.put(results)
+	return results
 	
 	
-def helper_paired(res, queue):
+def helper_paired(res, reps):
 	"""Helper Function for Multithreading for paired data"""
 	
-	reps = (res["reps"] // res["threads"]) + 1
 	allthetas = []
+	timers = instrumentation.timers()
+	clock = timers.start()
 	for i in range(reps):
 		signs = random.choices([-1, 1], k=res["len1"])
+		clock = timers.lap("rng", clock)
 		allthetas.append(
 			res["func"](s * r for s, r in zip(signs, res["differences"]))
 		)
+		clock = timers.lap("statistic", clock)		#includes flipping the signs
 	if res["empdiff"] > 0:
 		more_extreme = sum(1 for theta in allthetas if theta >= res["empdiff"])
 	else:
 		more_extreme = sum(1 for theta in allthetas if theta <= res["empdiff"])
+	timers.lap("reduce", clock)
 	results = (more_extreme, reps)
-	queue.put(results)
+	return results
+	
+	
+def worker_res(res):
+	"""Returns a copy of res without the data lists, so only a few bytes
+	have to be sent to the worker processes"""
+	return {key: value for key, value in res.items() if not isinstance(value, (list, tuple))}
+	
+	
+def helper_shared(data, res, reps):
+	"""Runs helper on the combined data published in shared memory. Only
+	the list that is shuffled is copied per chunk"""
+	if not isinstance(data, list):
+		data = attach(data, as_list=True)
+	return shuffle_test(list(data), res, reps)
+	
+	
+def helper_paired_shared(differences, res, reps):
+	"""Runs helper_paired on the differences published in shared memory"""
+	if not isinstance(differences, list):
+		differences = attach(differences, as_list=True)
+	return helper_paired(dict(res, differences=differences), reps)
+	
+	
+def vector_helper(data, res, reps):
+	"""Vectorized helper (numpy backend) for both kinds of tests. data is
+	the combined data or the paired differences"""
+	import vectorperm
+	data = attach(data)
+	if res["paired"]:
+		return vectorperm.sampled_paired_test(res["func"], data, reps, res["empdiff"],
+			res["blocksize"], chunk_rng())
+	return vectorperm.sampled_test(res["func"], data[:res["len1"]], data[res["len1"]:], reps,
+		res["empdiff"], res["blocksize"], chunk_rng())
 	
 	
 def all_combos(res):
@@ -53,12 +112,13 @@ def all_combos(res):
 	non-paired permutation"""
 	
 	alldata = res["data1"] + res["data2"]
+	slim = worker_res(res)
 	combos = itertools.combinations(alldata, res["len1"])
 	for out1 in combos:
 		out2 = alldata[:]	#Create copy of list with all items
 		for element in out1:
 			out2.remove(element)
-		heap = (res, out1, out2)
+		heap = (slim, out1, out2)
 		yield heap	#Packing into a single tuple since the consuming function is allowed only 1 argument
 		
 		
@@ -80,8 +140,9 @@ def all_combos_paired(res):
 	paired permutation"""
 	
 	signs = [-1, 1]
+	slim = dict(worker_res(res), differences=res["differences"])
 	for element in itertools.product(signs, repeat=res["len1"]):
-		yield (res, element)
+		yield (slim, element)
 		
 		
 def more_extreme_paired(heap):
@@ -104,77 +165,114 @@ def display_results(res):
 	display = {"func": "Function", "theta1": "Theta Group 1", "theta2": "Theta Group 2", "empdiff": "Group Difference",
 		"len1": "N Group 1", "len2": "N Group 2", "reps": "Replications",
 		"paired": "Paired Testing", "runtime": "Runtime", "threads": "Threads",
-		"p_value": "P-Value",}
+		"p_value": "P-Value", "reps_used": "Replications Used", "mc_error": "Monte Carlo Error",
+		"decision": "Sequential Decision"}
 	p = res["prec"]
 	for key, value in display.items():
+		if key not in res:
+			continue
 		if isinstance(res[key], float):
 			print(f"{value}: {res[key]:.{p}f}")
 		else:
 			print(f"{value}: {res[key]}")
 			
 			
-def run_benchmark(res):
-	"""Function to estimate the runtime of the desired computation"""
+def run_benchmark(res, engine=None):
+	"""Predicts the runtime of the desired computation. Drawing the random
+	samples, building the groups, the statistic, counting the extreme results
+	and the transport to the worker processes are timed separately (see
+	calibration.py). Prints the estimate and returns the prediction"""
 	
+	if res["reps"] == 0 and res["func"] in SUM_STATISTICS:
+		print("Exact algorithm for the sum or mean, its runtime depends on the data and is not estimated")
+		return None
 	testsize = 2000
-	trash = []
-	t_start = time.monotonic()
-	if res["paired"]:
-		if res["reps"] == 0:
-			ntotal = 2 ** res["len1"]
-		else:
-			ntotal = res["reps"]		
-		signs = [-1, 1]
-		
-		for i in range(testsize):
-			allsigns = random.choices(signs, k=res["len1"])
-			trash.append(res["func"](s * d for s, d in zip(allsigns, res["data1"])))
-		trash2 = sum(1 for element in trash)
-		t_end = time.monotonic()
-		benchmark = t_end - t_start
-		
+	paired = res["paired"]
+	if paired:
+		data = [e1 - e2 for e1, e2 in zip(res["data1"], res["data2"])]
+		ntotal = 2 ** res["len1"] if res["reps"] == 0 else res["reps"]
 	else:
-		if res["reps"] == 0:
-			ntotal = math.factorial(res["len1"] + res["len2"]) // ((math.factorial(res["len1"]) * math.factorial(res["len2"])))
-		else:
-			ntotal = res["reps"]
-			
 		data = res["data1"] + res["data2"]
-		for i in range(testsize):
-			random.shuffle(data)
-			s1 = data[:res["len1"]]
-			s2 = data[res["len1"]:]
-			diff = res["func"](s1) - res["func"](s2)
-			trash.append(diff)
-		overlimit = sum(1 for x in trash if x < res["empdiff"])
-		
-		t_end = time.monotonic()
-		benchmark = t_end - t_start
-		
-	estimated_runtime = ((ntotal / testsize) * benchmark) / res["threads"]
-	estimated_runtime = estimated_runtime + (estimated_runtime * 0.15)		#Add buffer
-	
-	if 0 <= estimated_runtime < 5:
-		print("Estimated runtime below 5 seconds")
-	elif 5 <= estimated_runtime < 60:
-		print(f"Estimated runtime about {estimated_runtime:.0f} seconds")
-	elif 60 <= estimated_runtime < 3600:
-		print(f"Estimated runtime about {estimated_runtime / 60:.1f} minutes")
+		ntotal = math.comb(res["len1"] + res["len2"], res["len1"]) if res["reps"] == 0 else res["reps"]
+	phases = {}
+	if res["backend"] == "numpy" and res["reps"] > 0:
+		import numpy as np		#only needed for the numpy backend
+		import vectorperm
+		values = np.asarray(data, dtype=np.float64)
+		rows = min(testsize, res["blocksize"] or vectorperm.default_batch_size(len(values)))
+		rng = np.random.default_rng()
+		if paired:
+			draw = lambda: next(vectorperm.sign_blocks(len(values), rows, rows, rng))
+			signs = draw()
+			phases["gather"] = timed(lambda: signs * values) / rows
+			block = signs * values
+			statistic = lambda: vectorperm.apply_statistic(res["func"], block)[0]
+		else:
+			draw = lambda: next(vectorperm.permutation_blocks(len(values), rows, rows, rng))
+			permutations = draw()
+			phases["gather"] = timed(values.__getitem__, permutations) / rows
+			block = values[permutations]
+			statistic = lambda: (vectorperm.apply_statistic(res["func"], block[:, :res["len1"]])[0]
+				- vectorperm.apply_statistic(res["func"], block[:, res["len1"]:])[0])
+		phases["draw"] = timed(draw) / rows
+		phases["statistic"] = timed(statistic) / rows
+		results = statistic()
+		phases["statistic"] += timed(vectorperm.count_extreme, results, res["empdiff"], True) / rows
+		parallel = engine is not None
 	else:
-		print(f"Estimated runtime about {estimated_runtime / 3600:.1f} hours")
+		if paired:
+			allsigns = [random.choices([-1, 1], k=res["len1"]) for i in range(testsize)]
+			samples = [[s * d for s, d in zip(signs, data)] for signs in allsigns]
+			phases["draw"] = timed(lambda: [random.choices([-1, 1], k=res["len1"]) for i in range(testsize)]) / testsize
+			phases["gather"] = timed(lambda: [[s * d for s, d in zip(signs, data)] for signs in allsigns]) / testsize
+			phases["statistic"] = timed(lambda: [res["func"](sample) for sample in samples]) / testsize
+		else:
+			shuffled = data[:]
+			phases["draw"] = timed(lambda: [random.shuffle(shuffled) for i in range(testsize)]) / testsize
+			phases["gather"] = timed(lambda: [(shuffled[:res["len1"]], shuffled[res["len1"]:])
+				for i in range(testsize)]) / testsize
+			groups = (shuffled[:res["len1"]], shuffled[res["len1"]:])
+			phases["statistic"] = timed(lambda: [res["func"](groups[0]) - res["func"](groups[1])
+				for i in range(testsize)]) / testsize
+		parallel = True
+	
+	if parallel and engine is None:
+		phases["startup"] = process_startup() * res["threads"]
+	chunks = DEFAULT_CHUNKS if engine is None else engine.chunks
+	if parallel and res["reps"] == 0:
+		#Every combination is sent to the workers and every result back
+		phases["transport"] = ntotal * (roundtrip((data[:res["len1"]], data[res["len1"]:], worker_res(res)))
+			+ roundtrip(0))
+	elif parallel:
+		phases["transport"] = min(chunks, ntotal) * (roundtrip(worker_res(res)) + roundtrip((0, 0)))
+	memory = 8 * len(data) * (1 + usable_cores(res["threads"]))
+	if res["backend"] == "numpy" and res["reps"] > 0:
+		memory += 3 * 8 * len(data) * (res["blocksize"] or vectorperm.default_batch_size(len(data)))
+	prediction = predict(phases, ntotal, res["threads"], chunks, parallel, memory)
+	report(prediction)
+	return prediction
 		
 		
-def permutationtest(func, input1, input2, reps, prec=4, threads=4, paired=False, quiet=False, benchmark=False):
+def permutationtest(func, input1, input2, reps, prec=4, threads=4, paired=False, quiet=False, benchmark=False,
+	engine=None, seed=None, backend="python", blocksize=None, alpha_stop=None, stop_rule="interval",
+	check_every=1000, progress=None, profile=None):
 	"""Computes permutation test for paired and unpaired data
 	
 	Args:
 		func (func): Function to compute the test with. Will be in most cases
-			the arithmetic mean (statistics.mean)
+			the arithmetic mean (statistics.mean). Can also be the name of a
+			statistic in the kernel registry, e.g. "median" (see kernels.NAMES)
 		input1 (list): Containing data for group 1
 		input2 (list): Containing data for group 2
 		reps (int): Specifices how many random samples to take. When 0 is
 			specified, an exhaustive test (testing *all* combinations) is run.
-			Only feasible for small samples.
+			Only feasible for small samples. For the mean or sum, much faster
+			exact algorithms are used (unpaired: 30+ observations, paired:
+			hundreds of observations). Only a paired test with more than 40
+			differences that do not scale to integers gives an approximate
+			p-value, see res["exact_method"]. For other statistics and more
+			than 24 pairs, random sampling with 100,000 replications is used
+			instead
 		prec (int): Specifies the display format of the results (default is 4)
 		threads (int): Specifies the number of processes to create. The
 			larger the faster the computation. Depends on your CPU (default is 4)
@@ -189,7 +287,42 @@ def permutationtest(func, input1, input2, reps, prec=4, threads=4, paired=False,
 			is False)
 		benchmark (bool): Specifies whether to run a quick benchmark before
 			the main compuation to estimate how long the computation will take.
-			Gives a rough estimate of the expected runtime (default is False)
+			The phases are timed separately, the prediction of runtime and
+			peak memory is stored in res["prediction"] (default is False)
+		engine (ResamplingEngine): A running engine whose worker processes
+			are reused, which saves the process startup when many tests are
+			computed. If given, threads is ignored. If None, a temporary
+			engine is created (default is None)
+		seed (int): Seed for repeatable random sampling. The results do not
+			depend on the number of threads (default is None)
+		backend (str): "python" draws every random sample with random.shuffle
+			or random.choices. "numpy" draws blocks of permutations or signs as
+			matrices and evaluates vectorized statistics (mean, median, ...)
+			along the rows, keeping only the count of extreme results. Uses the
+			worker processes only if an engine is given (default is "python")
+		blocksize (int): Only for the numpy backend. Number of random samples
+			drawn at once, limits the memory used. If None, chosen
+			automatically (default is None)
+		alpha_stop (float): Enables sequential random sampling. The running
+			count of extreme results is checked after every chunk and sampling
+			stops as soon as the p-value is clearly below or above alpha_stop.
+			reps is then the maximum number of random samples. The number of
+			samples used and the decision are added to res. If None, all reps
+			samples are computed (default is None)
+		stop_rule (str): "interval" stops when a confidence interval (error
+			rate 0.001 over all checks) excludes alpha_stop, "besag-clifford"
+			stops after 20 extreme results (default is "interval")
+		check_every (int): Number of random samples between two checks in
+			sequential mode (default is 1000)
+		progress (func): Only for random sampling. Called after every
+			finished chunk with a dict of done, total, elapsed, rate and eta
+			(seconds left), e.g. calibration.print_progress (default is None)
+		profile (Profile): An instrumentation.Profile. If given, the phases
+			of every chunk (rng, resample, statistic, reduce), the bytes sent
+			to and from the workers and the busy time of every worker are
+			recorded. The aggregates are stored in res["profile"], the
+			records per chunk stay in profile.records. Exhaustive tests are
+			only timed as a whole (default is None)
 	
 	Returns:
 		res: a dict containing all relevant computed statistics and arguments
@@ -197,7 +330,13 @@ def permutationtest(func, input1, input2, reps, prec=4, threads=4, paired=False,
 	
 	assert threads > 0
 	t_start = time.monotonic()
+	func = get_function(func)		#registered names like "mean"
 	res = locals()	#Collect all arguments in new dict
+	del res["engine"]	#Not needed by the workers
+	del res["progress"]
+	del res["profile"]
+	if engine is not None:
+		res["threads"] = engine.threads
 	#if unequal number of items, data1 should have fewer items
 	alldata = sorted([input1, input2], key=len)
 	res["data1"] = alldata[0]	#Shorter list
@@ -209,79 +348,145 @@ def permutationtest(func, input1, input2, reps, prec=4, threads=4, paired=False,
 	combined = res["data1"] + res["data2"]
 	res["empdiff"] = res["theta1"] - res["theta2"]
 	if benchmark:
-		run_benchmark(res)
+		res["prediction"] = run_benchmark(res, engine)
 	
-	if reps == 0 and res["len1"] + res["len2"] > 16 and not quiet:
+	if reps == 0 and res["len1"] + res["len2"] > 16 and not quiet and func not in SUM_STATISTICS:
 		print("Warning, this operation (exhaustive) may take a *very* long time")
 		print("Consider using random sampling instead")
 	
-	##### Not Paired - Exhaustive #####
-	if not paired and reps == 0:
-		with Pool(processes=res["threads"]) as pool:
-			output = list(pool.imap_unordered(more_extreme, all_combos(res)))
+	tempengine = None
+	def get_engine():
+		"""The given engine or a temporary one, started only when needed (the
+		exact paired test and the serial numpy backend do not use one)"""
+		nonlocal tempengine
+		if engine is not None:
+			return engine
+		if tempengine is None:
+			tempengine = ResamplingEngine(res["threads"])
+		return tempengine
+	
+	sequential = None
+	if alpha_stop is not None:
+		sequential = SequentialTest(alpha_stop, rule=stop_rule)
+	chunksize = None if sequential is None else check_every
+	timers = instrumentation.NULL_TIMERS if profile is None else profile.timers
+	
+	def run_sampling(data):
+		"""Computes the random samples in chunks and returns the chunk results.
+		In sequential mode, stops after the chunk that decides the test"""
+		shared = chunks = None
+		tracker = None if progress is None else Progress(reps, progress)
+		try:
+			if backend == "numpy" and engine is None:
+				import numpy as np
+				args = (np.asarray(data, dtype=np.float64), worker_res(res))
+				if sequential is None:
+					chunks = run_serial(vector_helper, args, reps, chunksize, seed=seed, progress=tracker,
+						profile=profile)
+				else:
+					chunks = iter_serial(vector_helper, args, reps, chunksize, seed=seed, profile=profile)
+			else:
+				if backend == "numpy":
+					worker = vector_helper
+				else:
+					worker = helper_paired_shared if paired else helper_shared
+				clock = timers.start()
+				shared = publish(data)
+				timers.lap("ipc", clock)
+				args = (data if shared is None else shared.handle, worker_res(res))
+				if sequential is None:
+					chunks = get_engine().run(worker, args, reps, chunksize, seed=seed, progress=tracker,
+						profile=profile)
+				else:
+					chunks = get_engine().iter_run(worker, args, reps, chunksize, seed=seed, profile=profile)
+			output = []
+			for result in chunks:
+				output.append(result)
+				if sequential is not None and tracker is not None:
+					tracker(result[1])		#chunks are yielded one by one
+				if sequential is not None and sequential.update(*result):
+					break
+			if sequential is not None:
+				res["decision"] = sequential.decision
+		finally:
+			#Also if a worker raised, the shared data must not leak
+			if sequential is not None and chunks is not None:
+				chunks.close()		#stop computing further chunks
+			if shared is not None:
+				shared.release()
+		total_extreme = sum(element[0] for element in output)
+		total_reps = sum(element[1] for element in output)
+		res["reps_used"] = total_reps
+		res["p_value"] = total_extreme / total_reps
+		res["mc_error"] = math.sqrt(res["p_value"] * (1 - res["p_value"]) / total_reps)
+	
+	try:
+		##### Not Paired - Exhaustive #####
+		if not paired and reps == 0 and func in SUM_STATISTICS:
+			#Only the sum of group 1 matters, combinations in Gray code order
+			sum_engine = None if engine is None and res["threads"] == 1 else get_engine()
+			overlimit, total = exhaustive_sum_test(res["data1"], res["data2"], engine=sum_engine, func=func)
+			res["p_value"] = overlimit / total
+		
+		elif not paired and reps == 0:
+			clock = timers.start()
+			output = list(get_engine().imap(more_extreme, all_combos(res)))
+			timers.lap("exhaustive", clock)
 			total = len(output)
 			overlimit = sum(output)
 			res["p_value"] = overlimit / total
 			
 			
-	##### Not Paired - Random Sampling #####		
-	if not paired and reps > 0:
-		collections = Queue()
-		threadlist = []
-		for thread in range(res["threads"]):
-			thread = Process(target=helper, args=(res, collections))
-			thread.start()
-			threadlist.append(thread)
-		allres = []
-		while len(allres) < res["threads"]:
-			allres.append(collections.get(True))
-			time.sleep(0.1)
-		for thread in threadlist:
-			thread.join()
-			
-		total_overlimit = sum(element[0] for element in allres)
-		total_reps = sum(element[1] for element in allres)
-		res["p_value"] = total_overlimit / total_reps
+		##### Not Paired - Random Sampling #####		
+		if not paired and reps > 0:
+			run_sampling(combined)
 			
 	
-	if paired:
-		if not res["len1"] == res["len2"]:
-			raise AssertionError("Both groups must have the same number of elements in a paired test!")
+		if paired:
+			if not res["len1"] == res["len2"]:
+				raise AssertionError("Both groups must have the same number of elements in a paired test!")
 			
-		res["differences"] = [e1 - e2 for e1, e2 in zip(res["data1"], res["data2"])]
-		res["empdiff"] = res["func"](res["differences"])
+			res["differences"] = [e1 - e2 for e1, e2 in zip(res["data1"], res["data2"])]
+			res["empdiff"] = res["func"](res["differences"])
 		
-		##### Paired - Exhaustive #####
-		if reps == 0:
-			with Pool(processes=res["threads"]) as pool:
-				output = list(pool.imap_unordered(more_extreme_paired, all_combos_paired(res)))
+			##### Paired - Exhaustive #####
+			if reps == 0 and func in SUM_STATISTICS:
+				#Null distribution of the sum of the signed differences, exact
+				#unless more than 40 differences do not scale to integers
+				res["p_value"], res["exact_method"] = exact_paired_test(res["differences"])
+				if res["exact_method"] == "fft" and not quiet:
+					print("The differences do not scale to integers, the p-value is approximate (FFT on a grid)")
+			
+			elif reps == 0 and res["len1"] > MAX_PAIRED_EXHAUSTIVE:
+				#2 ** n sign vectors are too many for other statistics
+				if not quiet:
+					print(f"Too many observations for an exhaustive test, using {PAIRED_FALLBACK_REPS} random samples")
+				res["reps"] = reps = PAIRED_FALLBACK_REPS
+			
+			elif reps == 0:
+				clock = timers.start()
+				output = list(get_engine().imap(more_extreme_paired, all_combos_paired(res)))
+				timers.lap("exhaustive", clock)
 				total = len(output)
 				overlimit = sum(output)
 				res["p_value"] = overlimit / total
 			
-		##### Paired - Random Sampling #####
-		if reps > 0:
-			collections = Queue()
-			threadlist = []
-			for thread in range(res["threads"]):
-				thread = Process(target=helper_paired, args=(res, collections))
-				thread.start()
-				threadlist.append(thread)
-			
-			allres = []
-			while len(allres) < res["threads"]:
-				allres.append(collections.get(True))
-				time.sleep(0.1)
-			for thread in threadlist:
-				thread.join()
-				
-			assert len(allres) == res["threads"]
-			total_more_extreme = sum(element[0] for element in allres)
-			total_reps = sum(element[1] for element in allres)
-			res["p_value"] = total_more_extreme / total_reps
+			##### Paired - Random Sampling #####
+			if reps > 0:
+				run_sampling(res["differences"])
 
+	except BaseException:
+		if tempengine is not None:
+			tempengine.terminate()		#do not wait for the remaining chunks
+			tempengine = None
+		raise
+	finally:
+		if tempengine is not None:
+			tempengine.close()
 	t_end = time.monotonic()
 	res["runtime"] = round(t_end - t_start, 2)
+	if profile is not None:
+		res["profile"] = profile.summary()
 	if not quiet:
 		display_results(res)
 	return res
@@ -0,0 +1,190 @@
+#On-disk store of bootstrap replications
+#Seeded replications are saved as .npy files (float64) together with a small
+#metadata file, keyed by a hash of the data, the statistic, the seed and the
+#resampling scheme. Later runs open them memory-mapped, so other alpha levels
+#or intervals are computed without drawing a single resample. The number of
+#replications is part of the scheme, as it decides the random stream of every
+#replication, so a stored run gives exactly the result of a fresh one. The
+#least recently used entries are removed when the store grows above its size
+#limit.
+
+import os
+import json
+import time
+import types
+import pickle
+import shutil
+import hashlib
+import numpy as np
+
+
+ARRAYS = ("theta_stars", "tvalues", "uvalues")
+
+
+SIMPLE = (bool, int, float, str, type(None))
+
+
+def _simple(value):
+	"""True for numbers, strings, None and tuples of these"""
+	if isinstance(value, tuple):
+		return all(_simple(element) for element in value)
+	return isinstance(value, SIMPLE)
+
+
+def _code_identity(code):
+	"""Bytecode, constants and names of a code object. Nested code objects
+	(lambdas, comprehensions) are included recursively instead of their repr,
+	which contains a memory address"""
+	consts = [_code_identity(const) if isinstance(const, types.CodeType) else repr(const)
+		for const in code.co_consts]
+	return f"{code.co_code.hex()}|{consts}|{code.co_names}"
+
+
+def statistic_identity(func):
+	"""Stable identity of a statistic across runs: module, qualified name,
+	bytecode, constants and defaults, and the values the function closes
+	over (e.g. the percent of a quantile from vectorboot.make_quantile), so
+	editing a function or another lambda gives another identity. Returns None
+	if there is no stable identity (callable objects, closures over other
+	objects), such statistics are not stored"""
+	name = f"{getattr(func, '__module__', None)}.{getattr(func, '__qualname__', None)}"
+	if isinstance(func, types.BuiltinFunctionType):
+		return name		#e.g. min, max
+	if not isinstance(func, types.FunctionType):
+		return None
+	parts = [name, _code_identity(func.__code__)]
+	defaults = tuple(func.__defaults__ or ()) + tuple(sorted((func.__kwdefaults__ or {}).items()))
+	if not _simple(defaults):
+		return None
+	parts.append(repr(defaults))
+	for cell in func.__closure__ or ():
+		value = cell.cell_contents
+		if _simple(value):
+			parts.append(repr(value))
+		elif callable(value) and statistic_identity(value) is not None:
+			parts.append(statistic_identity(value))
+		else:
+			return None
+	return "|".join(parts)
+
+
+def _fingerprint(value):
+	"""JSON replacement for arrays (e.g. stratum labels) in a scheme"""
+	if isinstance(value, np.ndarray):
+		return hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+	return repr(value)
+
+
+class ReplicateStore:
+	"""Directory with one subdirectory per entry, holding theta_stars.npy,
+	tvalues.npy and uvalues.npy (if computed) and meta.json. Use it with
+	bootstrap_ci(..., seed=..., store=ReplicateStore("replicates"))"""
+
+	def __init__(self, directory, max_bytes=2 ** 30):
+		"""
+		Args:
+			directory (str): Where the entries are stored, created if needed
+			max_bytes (int): Size limit of all entries together. Least
+				recently used entries are deleted above it (default is 1 GiB)
+		"""
+		self.directory = directory
+		self.max_bytes = max_bytes
+		os.makedirs(directory, exist_ok=True)
+
+	def key(self, data, func, seed, scheme):
+		"""Key of an entry. scheme is a dict of all settings that change the
+		replications (backend, reps2, chunks, design, ...). Returns None if
+		func has no stable identity (see statistic_identity)"""
+		identity = statistic_identity(func)
+		if identity is None:
+			return None
+		digest = hashlib.sha256()
+		try:
+			values = np.ascontiguousarray(data, dtype=np.float64)
+			digest.update(repr(values.shape).encode())
+			digest.update(values.tobytes())
+		except (TypeError, ValueError):
+			digest.update(pickle.dumps(list(data)))		#not numeric, e.g. strings
+		digest.update(identity.encode())
+		digest.update(repr(seed).encode())
+		digest.update(json.dumps(scheme, sort_keys=True, default=_fingerprint).encode())
+		return digest.hexdigest()[:32]
+
+	def _path(self, key, name):
+		return os.path.join(self.directory, key, name)
+
+	def _read_meta(self, key):
+		try:
+			with open(self._path(key, "meta.json")) as inputfile:
+				return json.load(inputfile)
+		except (OSError, ValueError):
+			return None
+
+	def _write_meta(self, key, meta):
+		temporary = self._path(key, "meta.json.tmp")
+		with open(temporary, mode="w") as outputfile:
+			json.dump(meta, outputfile)
+		os.replace(temporary, self._path(key, "meta.json"))
+
+	def load(self, key):
+		"""Returns (meta, arrays) of an entry or None. arrays is a dict of
+		memory-mapped, read-only arrays. Marks the entry as used"""
+		meta = self._read_meta(key)
+		if meta is None:
+			return None
+		arrays = {}
+		for name in meta["arrays"]:
+			arrays[name] = np.load(self._path(key, f"{name}.npy"), mmap_mode="r")
+		meta["last_used"] = time.time()
+		self._write_meta(key, meta)
+		return meta, arrays
+
+	def save(self, key, arrays, meta):
+		"""Stores (or replaces) an entry. arrays maps names from ARRAYS to
+		the replications, meta is any JSON serializable dict. Then evicts
+		other entries if the store is too large"""
+		os.makedirs(os.path.join(self.directory, key), exist_ok=True)
+		for name, values in arrays.items():
+			temporary = self._path(key, f"{name}.tmp.npy")
+			np.save(temporary, np.asarray(values, dtype=np.float64))
+			os.replace(temporary, self._path(key, f"{name}.npy"))		#open memory maps stay valid
+		meta = dict(meta, arrays=list(arrays), reps=len(arrays["theta_stars"]), last_used=time.time())
+		self._write_meta(key, meta)
+		self.evict(keep=(key,))
+
+	def entries(self):
+		"""List of (key, meta, bytes) of all entries, least recently used first"""
+		output = []
+		for key in os.listdir(self.directory):
+			meta = self._read_meta(key)
+			if meta is None:
+				continue
+			folder = os.path.join(self.directory, key)
+			size = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+			output.append((key, meta, size))
+		return sorted(output, key=lambda entry: entry[1]["last_used"])
+
+	def size(self):
+		"""Bytes used by all entries"""
+		return sum(entry[2] for entry in self.entries())
+
+	def remove(self, key):
+		shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+	def evict(self, keep=()):
+		"""Removes least recently used entries until the store fits into
+		max_bytes. Entries in keep are never removed"""
+		entries = self.entries()
+		total = sum(entry[2] for entry in entries)
+		for key, meta, size in entries:
+			if total <= self.max_bytes:
+				break
+			if key in keep:
+				continue
+			self.remove(key)
+			total -= size
+
+	def clear(self):
+		"""Removes all entries"""
+		for key, meta, size in self.entries():
+			self.remove(key)
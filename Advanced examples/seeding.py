@@ -0,0 +1,36 @@
+#Reproducible and independent random streams for the resampling engines
+#A root SeedSequence is created from the user seed and every chunk of
+#replications gets its own child stream keyed by the chunk number (not by the
+#worker process). Results are therefore identical no matter how many
+#processes compute the chunks.
+
+import hashlib
+import numpy as np
+
+
+def seed_sequence(seed=None):
+	"""Creates the root SeedSequence. Integers are used directly, other seeds
+	(for example strings) are hashed first. None gives fresh entropy"""
+	if isinstance(seed, np.random.SeedSequence):
+		return seed
+	if seed is None or isinstance(seed, (int, np.integer)):
+		return np.random.SeedSequence(seed)
+	digest = hashlib.sha256(str(seed).encode("utf-8")).digest()
+	return np.random.SeedSequence(int.from_bytes(digest[:8], "little"))
+
+
+def chunk_sequence(root, chunk):
+	"""Returns the independent child stream of the given chunk number. Same as
+	root.spawn(), but can be computed for any chunk without spawning all"""
+	return np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + (chunk,),
+		pool_size=root.pool_size)
+
+
+def python_seed(sequence):
+	"""Converts a SeedSequence into an integer seed for the random module"""
+	return int.from_bytes(sequence.generate_state(4, np.uint32).tobytes(), "little")
+
+
+def make_rng(seed=None):
+	"""Creates a NumPy random generator from any seed accepted by seed_sequence"""
+	return np.random.default_rng(seed_sequence(seed))
@@ -0,0 +1,59 @@
+#Sequential early stopping for Monte Carlo p-values
+#The running count of extreme results is checked after every chunk of random
+#samples. Sampling stops as soon as it is clear on which side of alpha the
+#p-value lies, or (Besag-Clifford) once enough extreme results were seen.
+
+import math
+from morestatistics import inverse_normal_CDF
+
+
+def wilson_interval(extreme, reps, z):
+	"""Wilson score interval for a binomial proportion"""
+	p = extreme / reps
+	denominator = 1 + z ** 2 / reps
+	center = (p + z ** 2 / (2 * reps)) / denominator
+	radius = z * math.sqrt(p * (1 - p) / reps + z ** 2 / (4 * reps ** 2)) / denominator
+	return max(0.0, center - radius), min(1.0, center + radius)
+
+
+class SequentialTest:
+	"""Stopping rule for a Monte Carlo p-value
+
+	rule="interval": After look t, a Wilson interval with error probability
+		delta / (t * (t + 1)) is computed. These sum up to delta over all
+		looks, so the decision is wrong with probability of at most about
+		delta. Stops when the interval lies completely below or above alpha.
+	rule="besag-clifford": Stops when h extreme results were observed, the
+		p-value is then estimated as h / reps (Besag and Clifford 1991).
+	"""
+
+	def __init__(self, alpha=0.05, delta=0.001, rule="interval", h=20):
+		self.alpha = alpha
+		self.delta = delta
+		self.rule = rule
+		self.h = h
+		self.extreme = 0
+		self.reps = 0
+		self.looks = 0
+		self.decision = "undecided"
+
+	def update(self, extreme, reps):
+		"""Adds the results of one chunk, returns True if sampling can stop"""
+		self.extreme += extreme
+		self.reps += reps
+		self.looks += 1
+		if self.rule == "besag-clifford":
+			if self.extreme >= self.h:
+				self.decision = "not reject" if self.p_value() > self.alpha else "reject"
+				return True
+			return False
+		z = inverse_normal_CDF(1 - self.delta / (self.looks * (self.looks + 1)) / 2)
+		lower, upper = wilson_interval(self.extreme, self.reps, z)
+		if upper < self.alpha:
+			self.decision = "reject"
+		elif lower > self.alpha:
+			self.decision = "not reject"
+		return self.decision != "undecided"
+
+	def p_value(self):
+		return self.extreme / self.reps
@@ -0,0 +1,279 @@
+#Vectorized resampling engine for bootstrap_ci
+#Requires NumPy. Instead of drawing every resample with random.choices, a whole
+#matrix of resample indices (rows = replications, columns = observations) is
+#drawn at once and the statistic is evaluated along the rows. Records (rows of
+#several variables) are resampled as a whole, giving (reps, n, k) blocks.
+
+import statistics
+import numpy as np
+import morestatistics
+from seeding import make_rng
+import instrumentation
+from kernels import get_kernel, get_function, register_kernel
+
+
+def make_quantile(percent):
+	"""Returns a function computing the given percentile of a list. The
+	function works with the regular engine and has a vectorized kernel"""
+	def quantile(data):
+		return morestatistics.percentile(data, percent)
+	quantile.vectorized = lambda block: np.percentile(block, percent, axis=1)
+	quantile.weighted = lambda data, weights: weighted_quantile(data, weights, percent)
+	quantile.__name__ = f"quantile_{percent}"
+	return quantile
+
+
+def weighted_mean(data, weights):
+	"""Weighted mean of data. weights is either one vector or a matrix with
+	one row of frequency weights (counts) per resample"""
+	weights = np.asarray(weights, dtype=np.float64)
+	return (weights @ data) / weights.sum(axis=-1)
+
+
+def weighted_variance(data, weights):
+	"""Weighted sample variance with frequency weights, identical to the
+	variance of the expanded sample"""
+	weights = np.asarray(weights, dtype=np.float64)
+	center = np.expand_dims(weighted_mean(data, weights), -1)
+	total = weights.sum(axis=-1)
+	return (weights * (data - center) ** 2).sum(axis=-1) / (total - 1)
+
+
+def weighted_stdev(data, weights):
+	"""Weighted sample standard deviation with frequency weights"""
+	return np.sqrt(weighted_variance(data, weights))
+
+
+def weighted_quantile(data, weights, percent):
+	"""Percentile of data with integer frequency weights. Interpolates like
+	morestatistics.percentile applied to the expanded sample"""
+	weights = np.asarray(weights)
+	single = weights.ndim == 1
+	weights = np.atleast_2d(weights)
+	order = np.argsort(data, kind="stable")
+	sorted_data = np.asarray(data, dtype=np.float64)[order]
+	cumulative = np.cumsum(weights[:, order], axis=1)
+	position = (cumulative[:, -1] - 1) * (percent / 100)
+	lower = np.floor(position)
+	#Sorted index of the observation at (0-based) rank k in the expanded sample
+	rank_lower = (cumulative <= lower[:, None]).sum(axis=1)
+	rank_upper = (cumulative <= lower[:, None] + 1).sum(axis=1)
+	rank_upper = np.minimum(rank_upper, len(sorted_data) - 1)
+	fraction = position - lower
+	result = sorted_data[rank_lower] * (1 - fraction) + sorted_data[rank_upper] * fraction
+	return result[0] if single else result
+
+
+def cross_products(X):
+	"""Products X_i * X_j of all column pairs per row, shape (n, k * k). The
+	cross-product matrix of any resample is then a single matrix product
+	of its counts with this array"""
+	n, k = X.shape
+	return (X[:, :, None] * X[:, None, :]).reshape(n, k * k)
+
+
+def weighted_ols(data, weights):
+	"""Weighted least squares coefficients for rows of (x1, ..., xk, y). An
+	intercept is added, coefficients are returned as (intercept, b1, ..., bk)"""
+	data = np.asarray(data, dtype=np.float64)
+	weights = np.asarray(weights, dtype=np.float64)
+	X = np.column_stack([np.ones(len(data)), data[:, :-1]])
+	y = data[:, -1]
+	k = X.shape[1]
+	xtwx = (weights @ cross_products(X)).reshape(weights.shape[:-1] + (k, k))
+	xtwy = weights @ (X * y[:, None])
+	return np.linalg.solve(xtwx, xtwy[..., None])[..., 0]
+
+
+def ols_block(block):
+	"""OLS coefficients (intercept, b1, ..., bk) for every resample of a
+	(reps, n, k + 1) block of rows (x1, ..., xk, y)"""
+	X = np.concatenate([np.ones(block.shape[:2] + (1,)), block[..., :-1]], axis=2)
+	xtx = np.einsum("rni,rnj->rij", X, X)
+	xty = np.einsum("rni,rn->ri", X, block[..., -1])
+	return np.linalg.solve(xtx, xty[..., None])[..., 0]
+
+
+def ols_slope(data):
+	"""Slope of a simple linear regression of y on x for a list of (x, y) pairs"""
+	n = len(data)
+	meanx = sum(row[0] for row in data) / n
+	meany = sum(row[1] for row in data) / n
+	numerator = sum((row[0] - meanx) * (row[1] - meany) for row in data)
+	denominator = sum((row[0] - meanx) ** 2 for row in data)
+	return numerator / denominator
+ols_slope.weighted = lambda data, weights: weighted_ols(data, weights)[..., 1]
+register_kernel("ols_slope", ols_slope, lambda block: ols_block(block)[:, 1])
+
+
+def make_coefficient(index):
+	"""Returns a function computing the OLS coefficient number index (0 is
+	the intercept) for rows of (x1, ..., xk, y), e.g. make_coefficient(2)
+	for b2 of a regression with two predictors. Has both kernels"""
+	def coefficient(data):
+		data = np.asarray(data, dtype=np.float64)
+		return float(weighted_ols(data, np.ones(len(data)))[index])
+	coefficient.vectorized = lambda block: ols_block(block)[:, index]
+	coefficient.weighted = lambda data, weights: weighted_ols(data, weights)[..., index]
+	coefficient.__name__ = f"ols_coefficient_{index}"
+	return coefficient
+
+
+def weighted_pearson_r(data, weights):
+	"""Pearson's r of (x, y) pairs with frequency weights. The sums of x, y,
+	x * x, y * y and x * y of all resamples come from one matrix product"""
+	data = np.asarray(data, dtype=np.float64)
+	data = data - data.mean(axis=0)		#r does not change, better rounding
+	weights = np.asarray(weights, dtype=np.float64)
+	total = weights.sum(axis=-1)
+	sx, sy = np.moveaxis(weights @ data, -1, 0)
+	sxx, sxy, _, syy = np.moveaxis(weights @ cross_products(data), -1, 0)
+	return (total * sxy - sx * sy) / np.sqrt((total * sxx - sx ** 2) * (total * syy - sy ** 2))
+
+
+def weighted_ratio_of_means(data, weights):
+	"""Ratio of the means of x and y of (x, y) pairs with frequency weights"""
+	sums = np.asarray(weights, dtype=np.float64) @ np.asarray(data, dtype=np.float64)
+	return sums[..., 0] / sums[..., 1]
+
+
+#Python functions with a counterpart taking (data, weights) directly
+WEIGHTED_KERNELS = {
+	statistics.mean: weighted_mean,
+	statistics.variance: weighted_variance,
+	statistics.stdev: weighted_stdev,
+	statistics.median: lambda data, weights: weighted_quantile(data, weights, 50),
+	sum: lambda data, weights: np.asarray(weights, dtype=np.float64) @ data,
+	morestatistics.pearson_r: weighted_pearson_r,
+	morestatistics.ratio_of_means: weighted_ratio_of_means,
+}
+if hasattr(statistics, "fmean"):		#Python 3.8 or newer
+	WEIGHTED_KERNELS[statistics.fmean] = weighted_mean
+
+
+def get_weighted_kernel(func):
+	"""Returns the frequency weight version of func or None if there is none"""
+	func = get_function(func)
+	try:
+		kernel = WEIGHTED_KERNELS.get(func)
+	except TypeError:
+		kernel = None
+	if kernel is None:
+		kernel = getattr(func, "weighted", None)
+	return kernel
+
+
+def default_batch_size(n, max_elements=2 ** 22):
+	"""Number of resamples per block so that one block holds at most
+	max_elements values (about 32 MB for float64)"""
+	return max(1, max_elements // max(1, n))
+
+
+def index_batches(n, reps, batch_size, rng):
+	"""Yields matrices of resample indices with at most batch_size rows
+	until reps rows were produced in total"""
+	done = 0
+	while done < reps:
+		rows = min(batch_size, reps - done)
+		yield rng.integers(0, n, size=(rows, n))
+		done += rows
+
+
+def count_batches(n, reps, batch_size, rng, probabilities=None):
+	"""Yields matrices of multinomial counts (frequency weights) with at most
+	batch_size rows. Row i tells how often each observation appears in
+	resample i, so no resample has to be built"""
+	if probabilities is None:
+		probabilities = np.full(n, 1 / n)
+	done = 0
+	while done < reps:
+		rows = min(batch_size, reps - done)
+		yield rng.multinomial(n, probabilities, size=rows)
+		done += rows
+
+
+def apply_weighted_statistic(func, data, counts):
+	"""Evaluates func for every row of counts. Uses the weighted version of
+	func if available, otherwise the resample is expanded and func is called
+	once per row (slow path)"""
+	kernel = get_weighted_kernel(func)
+	if kernel is not None:
+		with np.errstate(all="ignore"):		#failed rows are NaN, e.g. constant resamples
+			results = np.asarray(kernel(data, counts), dtype=np.float64)
+		return results, int(np.isnan(results).sum())
+	results = np.empty(len(counts))
+	for i, row in enumerate(counts):
+		try:
+			results[i] = func(np.repeat(data, row, axis=0).tolist())
+		except Exception:
+			results[i] = np.nan
+	return results, int(np.isnan(results).sum())		#raised or returned NaN
+
+
+def apply_statistic(func, block):
+	"""Evaluates func on every row of block. Uses the vectorized kernel if
+	available, otherwise func is called once per row (slow path). Returns the
+	results as a float array and the number of failed evaluations (NaN)"""
+	kernel = get_kernel(func)
+	if kernel is not None:
+		with np.errstate(all="ignore"):		#failed rows are NaN, e.g. constant resamples
+			results = np.asarray(kernel(block), dtype=np.float64)
+		return results, int(np.isnan(results).sum())
+	results = np.empty(len(block))
+	for i, row in enumerate(block):
+		try:
+			results[i] = func(row.tolist())
+		except Exception:
+			results[i] = np.nan
+	return results, int(np.isnan(results).sum())		#raised or returned NaN
+
+
+def bootstrap_replicates(func, data, reps, batch_size=None, rng=None, resampling="indices", design=None):
+	"""Computes reps bootstrap replicates of func for the given data
+
+	Args:
+		resampling (str): "indices" gathers every resample from a matrix of
+			drawn indices, "weights" only draws multinomial counts and passes
+			them to the weighted version of func (default is "indices")
+		design (Design): Stratified or clustered design from designs.py.
+			Clustered resamples are always drawn as counts (default is None)
+
+	Returns:
+		(theta_stars, failed): float array of length reps and number of
+			failed evaluations
+	"""
+	data = np.asarray(data, dtype=np.float64)
+	n = len(data)
+	if batch_size is None:
+		batch_size = default_batch_size(data.size)		#rows of records count k times
+	if rng is None:
+		rng = make_rng()
+	theta_stars = np.empty(reps)
+	failed = 0
+	pos = 0
+	weighted = resampling == "weights" or (design is not None and design.clustered)
+	if weighted:
+		if design is None:
+			blocks = count_batches(n, reps, batch_size, rng)
+		else:
+			blocks = design.count_batches(reps, batch_size, rng)
+	else:
+		if design is None:
+			blocks = index_batches(n, reps, batch_size, rng)
+		else:
+			blocks = design.index_batches(reps, batch_size, rng)
+	timers = instrumentation.timers()
+	clock = timers.start()
+	for block in blocks:
+		clock = timers.lap("rng", clock)
+		if weighted:
+			values, nfailed = apply_weighted_statistic(func, data, block)
+		else:
+			sample = data[block]
+			clock = timers.lap("resample", clock)
+			values, nfailed = apply_statistic(func, sample)
+		clock = timers.lap("statistic", clock)
+		theta_stars[pos:pos + len(values)] = values
+		pos += len(values)
+		failed += nfailed
+	return theta_stars, failed
@@ -0,0 +1,91 @@
+#Vectorized Monte Carlo sampler for permutation tests
+#Requires NumPy. Instead of one random.shuffle or random.choices per
+#replication, a whole block of permutations (or sign vectors) is drawn as a
+#matrix and the statistic is evaluated along the rows. Only the running count
+#of extreme results is kept, so the memory needed depends on the block size,
+#not on the number of replications.
+
+import numpy as np
+from vectorboot import apply_statistic, default_batch_size
+from seeding import make_rng
+import instrumentation
+
+
+def permutation_blocks(n, reps, blocksize, rng):
+	"""Yields matrices with one random permutation of range(n) per row, at
+	most blocksize rows each, until reps rows were produced"""
+	done = 0
+	while done < reps:
+		rows = min(blocksize, reps - done)
+		yield rng.permuted(np.broadcast_to(np.arange(n), (rows, n)), axis=1)
+		done += rows
+
+
+def sign_blocks(n, reps, blocksize, rng):
+	"""Yields matrices of random signs (-1 or 1), at most blocksize rows each"""
+	done = 0
+	while done < reps:
+		rows = min(blocksize, reps - done)
+		yield rng.integers(0, 2, size=(rows, n), dtype=np.int8) * 2 - 1
+		done += rows
+
+
+def count_extreme(values, empdiff, larger):
+	"""Number of values at least as extreme as empdiff in the given direction"""
+	if larger:
+		return int(np.count_nonzero(values >= empdiff))
+	return int(np.count_nonzero(values <= empdiff))
+
+
+def sampled_test(func, data1, data2, reps, empdiff, blocksize=None, rng=None):
+	"""Random sampling permutation test for two independent groups
+
+	Returns:
+		(more_extreme, reps): results at least as extreme as empdiff (same
+			direction rule as helper in permutationtests) and replications
+	"""
+	data = np.concatenate([np.asarray(data1, dtype=np.float64), np.asarray(data2, dtype=np.float64)])
+	n, n1 = len(data), len(data1)
+	if blocksize is None:
+		blocksize = default_batch_size(n)
+	if rng is None:
+		rng = make_rng()
+	more_extreme = 0
+	timers = instrumentation.timers()
+	clock = timers.start()
+	for permutations in permutation_blocks(n, reps, blocksize, rng):
+		clock = timers.lap("rng", clock)
+		block = data[permutations]
+		clock = timers.lap("resample", clock)
+		diffs = apply_statistic(func, block[:, :n1])[0] - apply_statistic(func, block[:, n1:])[0]
+		clock = timers.lap("statistic", clock)
+		more_extreme += count_extreme(diffs, empdiff, empdiff >= 0)
+		clock = timers.lap("reduce", clock)
+	return more_extreme, reps
+
+
+def sampled_paired_test(func, differences, reps, empdiff, blocksize=None, rng=None):
+	"""Random sampling (sign flip) permutation test for paired differences
+
+	Returns:
+		(more_extreme, reps): results at least as extreme as empdiff (same
+			direction rule as helper_paired in permutationtests) and replications
+	"""
+	differences = np.asarray(differences, dtype=np.float64)
+	n = len(differences)
+	if blocksize is None:
+		blocksize = default_batch_size(n)
+	if rng is None:
+		rng = make_rng()
+	more_extreme = 0
+	timers = instrumentation.timers()
+	clock = timers.start()
+	for signs in sign_blocks(n, reps, blocksize, rng):
+		clock = timers.lap("rng", clock)
+		flipped = signs * differences
+		clock = timers.lap("resample", clock)
+		thetas = apply_statistic(func, flipped)[0]
+		clock = timers.lap("statistic", clock)
+		more_extreme += count_extreme(thetas, empdiff, empdiff > 0)
+		clock = timers.lap("reduce", clock)
+	return more_extreme, reps
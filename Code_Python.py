@@ -43,7 +43,8 @@ from random import choices
 from statistics import mean, median, stdev
 from morestatistics import *
 
-def CI_normal(data, func, reps):
+def CI_normal(data, func, reps, alpha=0.05):
+	"""alpha can also be a list of levels, then a list of CIs is returned"""
 	theta_hat = func(data)
 	theta_hat_stars = []
 	for i in range(reps):
@@ -51,26 +52,36 @@ def CI_normal(data, func, reps):
 		theta_hat_star = func(resample)
 		theta_hat_stars.append(theta_hat_star)
 	SE_theta_hat = stdev(theta_hat_stars)
-	CI_lower = theta_hat - 1.96 * SE_theta_hat
-	CI_upper = theta_hat + 1.96 * SE_theta_hat
-	return (CI_lower, CI_upper)
+	levels, single = alpha_levels(alpha)
+	results = []
+	for level in levels:
+		z = inverse_normal_CDF(1 - level / 2)	#0.975 --> 1.96
+		CI_lower = theta_hat - z * SE_theta_hat
+		CI_upper = theta_hat + z * SE_theta_hat
+		results.append((CI_lower, CI_upper))
+	return results[0] if single else results
 data = [19, 29, 29, 30, 34, 36, 39, 47, 51, 52, 53, 60, 60, 64, 66, 68, 70]
 print(CI_normal(data, mean, 10000))
+print(CI_normal(data, mean, 10000, alpha=[0.2, 0.1, 0.05, 0.01, 0.001]))
 print("\n" * 5)
 
 
 
 #Example 5: Bootstrap percentile CI
 print("Example 5")
-def CI_percentile(data, func, reps):
+def CI_percentile(data, func, reps, alpha=0.05):
 	theta_hat_stars = []
 	for i in range(reps):
 		resample = choices(data, k=len(data))
 		theta_hat_star = func(resample)
 		theta_hat_stars.append(theta_hat_star)
-	CI_lower = percentile(theta_hat_stars, 2.5)
-	CI_upper = percentile(theta_hat_stars, 97.5)
-	return (CI_lower, CI_upper)
+	levels, single = alpha_levels(alpha)
+	percents = []
+	for level in levels:
+		percents += [level / 2 * 100, (1 - level / 2) * 100]	#0.05 --> 2.5, 97.5
+	bounds = percentiles(theta_hat_stars, percents)	#all levels at once
+	results = [(bounds[2 * i], bounds[2 * i + 1]) for i in range(len(levels))]
+	return results[0] if single else results
 print(CI_percentile(data, mean, 10000))
 print("\n" * 5)
 
@@ -78,7 +89,7 @@ print("\n" * 5)
 
 #Example 6: Bootstrap BCa CI
 print("Example 6")
-def CI_BCa(data, func, reps, bca):
+def CI_BCa(data, func, reps, bca, alpha=0.05):
 	theta_hat = func(data)
 	theta_hat_stars = []
 	for i in range(reps):
@@ -88,25 +99,27 @@ def CI_BCa(data, func, reps, bca):
 	n_smaller = sum([1 for theta_hat_star in theta_hat_stars if theta_hat_star <= theta_hat])
 	share_smaller = n_smaller / len(theta_hat_stars)
 	z0 = inverse_normal_CDF(share_smaller)	#0.975 --> 1.96
-	if not bca:		#compute BC
-		lower = normal_CDF(2 * z0 - 1.96)	#1.96 --> 0.975
-		upper = normal_CDF(2 * z0 + 1.96)
-	else:			#compute BCa
-		a = acceleration_coefficient(func, data)
-		lower = normal_CDF(z0 + ((z0 - 1.96) / (1 - a * (z0 - 1.96))))
-		upper = normal_CDF(z0 + ((z0 + 1.96) / (1 - a * (z0 + 1.96))))
-	CI_lower = percentile(theta_hat_stars, lower * 100)
-	CI_upper = percentile(theta_hat_stars, upper * 100)
-	return (CI_lower, CI_upper)
+	a = acceleration_coefficient(func, data) if bca else 0	#a = 0 gives BC
+	levels, single = alpha_levels(alpha)
+	percents = []
+	for level in levels:	#z0 and a are the same for all levels
+		z = inverse_normal_CDF(1 - level / 2)
+		lower = normal_CDF(z0 + ((z0 - z) / (1 - a * (z0 - z))))	#1.96 --> 0.975
+		upper = normal_CDF(z0 + ((z0 + z) / (1 - a * (z0 + z))))
+		percents += [lower * 100, upper * 100]
+	bounds = percentiles(theta_hat_stars, percents)
+	results = [(bounds[2 * i], bounds[2 * i + 1]) for i in range(len(levels))]
+	return results[0] if single else results
 print(CI_BCa(data, mean, 10000, bca=False))
 print(CI_BCa(data, mean, 10000, bca=True))
+print(CI_BCa(data, mean, 10000, bca=True, alpha=[0.2, 0.1, 0.05, 0.01, 0.001]))
 print("\n" * 5)
 
 
 
 #Example 7: Bootstrap double CI
 print("Example 7")
-def CI_double(data, func, reps1, reps2):
+def CI_double(data, func, reps1, reps2, alpha=0.05):
 	tvalues = []
 	theta_hat_stars = []
 	theta_hat = func(data)
@@ -122,11 +135,18 @@ def CI_double(data, func, reps1, reps2):
 		t = (theta_hat_star - theta_hat) / SE_theta_hat_star
 		tvalues.append(t)
 	SE_theta_hat = stdev(theta_hat_stars)
-	lower = percentile(tvalues, 2.5)
-	upper = percentile(tvalues, 97.5)
-	CI_lower = theta_hat - SE_theta_hat * upper
-	CI_upper = theta_hat - SE_theta_hat * lower
-	return(CI_lower, CI_upper)
+	levels, single = alpha_levels(alpha)
+	percents = []
+	for level in levels:
+		percents += [level / 2 * 100, (1 - level / 2) * 100]
+	bounds = percentiles(tvalues, percents)
+	results = []
+	for i in range(len(levels)):
+		lower, upper = bounds[2 * i], bounds[2 * i + 1]
+		CI_lower = theta_hat - SE_theta_hat * upper
+		CI_upper = theta_hat - SE_theta_hat * lower
+		results.append((CI_lower, CI_upper))
+	return results[0] if single else results
 print(CI_double(data, mean, 10000, 100))
 print("\n" * 5)
 
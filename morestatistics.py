@@ -5,49 +5,276 @@
 
 
 import math
+import numbers
+import statistics
 from statistics import mean
+try:
+	import numpy as np
+except ImportError:		#NumPy is optional, only used for the generic jackknife
+	np = None
 
-def rational_approximation(t):
-	#Source: https://www.johndcook.com/blog/python_phi_inverse/
-	# Abramowitz and Stegun formula 26.2.23.
-	# The absolute value of the error should be less than 4.5 e-4.
-	c = [2.515517, 0.802853, 0.010328]
-	d = [1.432788, 0.189269, 0.001308]
-	numerator = (c[2] * t + c[1]) * t + c[0]
-	denominator = ((d[2] * t + d[1]) * t + d[0]) * t + 1
-	return t - (numerator / denominator)
+#Coefficients of algorithm AS241 (PPND16, Wichura 1988), relative accuracy
+#about 1e-16, highest power first
+_AS241_CENTRAL = (
+	(2509.0809287301226727, 33430.575583588128105, 67265.770927008700853, 45921.953931549871457,
+	13731.693765509461125, 1971.5909503065514427, 133.14166789178437745, 3.387132872796366608),
+	(5226.495278852545925, 28729.085735721942674, 39307.89580009271061, 21213.794301586595867,
+	5394.1960214247511077, 687.1870074920579083, 42.313330701600911252, 1.0))
+_AS241_INTERMEDIATE = (
+	(7.7454501427834140764e-4, 0.0227238449892691845833, 0.24178072517745061177, 1.27045825245236838258,
+	3.64784832476320460504, 5.7694972214606914055, 4.6303378461565452959, 1.42343711074968357734),
+	(1.05075007164441684324e-9, 5.475938084995344946e-4, 0.0151986665636164571966, 0.14810397642748007459,
+	0.68976733498510000455, 1.6763848301838038494, 2.05319162663775882187, 1.0))
+_AS241_TAIL = (
+	(2.01033439929228813265e-7, 2.71155556874348757815e-5, 0.0012426609473880784386, 0.026532189526576123093,
+	0.29656057182850489123, 1.7848265399172913358, 5.4637849111641143699, 6.6579046435011037772),
+	(2.04426310338993978564e-15, 1.4215117583164458887e-7, 1.8463183175100546818e-5, 7.868691311456132591e-4,
+	0.0148753612908506148525, 0.13692988092273580531, 0.59983220655588793769, 1.0))
+
+#Coefficients of Cody's (1969) rational approximations of erf and erfc,
+#relative accuracy about 1e-16, highest power first
+_CODY_ERF = (
+	(0.185777706184603153, 3.16112374387056560, 113.864154151050156, 377.485237685302021, 3209.37758913846947),
+	(1.0, 23.6012909523441209, 244.024637934444173, 1282.61652607737228, 2844.23683343917062))
+_CODY_ERFC = (
+	(2.15311535474403846e-8, 0.564188496988670089, 8.88314979438837594, 66.1191906371416295,
+	298.635138197400131, 881.952221241769090, 1712.04761263407058, 2051.07837782607147, 1230.33935479799725),
+	(1.0, 15.7449261107098347, 117.693950891312499, 537.181101862009858, 1621.38957456669019,
+	3290.79923573345963, 4362.61909014324716, 3439.36767414372164, 1230.33935480374942))
+_CODY_ASYMPTOTIC = (
+	(0.0163153871373020978, 0.305326634961232344, 0.360344899949804439, 0.125781726111229246,
+	0.0160837851487422766, 6.58749161529837803e-4),
+	(1.0, 2.56852019228982242, 1.87295284992346725, 0.527905102951428412, 0.0605183413124413191,
+	0.00233520497626869185))
+
+
+def _rational(coefficients, r):
+	"""Evaluates the ratio of two polynomials with Horner's method, works for
+	numbers and NumPy arrays"""
+	numerator, denominator = 0, 0
+	for c in coefficients[0]:
+		numerator = numerator * r + c
+	for d in coefficients[1]:
+		denominator = denominator * r + d
+	return numerator / denominator
+
+
+def _inverse_normal_CDF_array(p):
+	"""Vectorized version of inverse_normal_CDF for NumPy arrays"""
+	p = np.asarray(p, dtype=np.float64)
+	q = p - 0.5
+	output = np.full(p.shape, np.nan)
+	central = np.abs(q) <= 0.425
+	r = 0.180625 - q[central] ** 2
+	output[central] = q[central] * _rational(_AS241_CENTRAL, r)
+	tail = ~central & (p > 0) & (p < 1)
+	r = np.sqrt(-np.log(np.where(q < 0, p, 1 - p)[tail]))
+	x = np.where(r <= 5, _rational(_AS241_INTERMEDIATE, r - 1.6), _rational(_AS241_TAIL, r - 5))
+	output[tail] = np.where(q[tail] < 0, -x, x)
+	output[p == 0] = -math.inf
+	output[p == 1] = math.inf
+	return output
 
 
 def inverse_normal_CDF(p):
-	assert 0 < p < 1
-	if p < 0.5:
-		# F^-1(p) = - G^-1(p)
-		return round(-rational_approximation(math.sqrt(-2 * math.log(p))), 4)
+	"""Quantile function (probit) of the standard normal distribution in full
+	double precision (algorithm AS241). p can be a number or a list / array
+	of probabilities. Returns -inf for p = 0, inf for p = 1 and nan for
+	values outside of [0, 1]"""
+	if not isinstance(p, numbers.Real):
+		if np is not None:
+			return _inverse_normal_CDF_array(p)
+		return [inverse_normal_CDF(element) for element in p]
+	p = float(p)		#also NumPy scalars like np.float32
+	if not 0 <= p <= 1:
+		return math.nan
+	if p == 0:
+		return -math.inf
+	if p == 1:
+		return math.inf
+	q = p - 0.5
+	if abs(q) <= 0.425:
+		return q * _rational(_AS241_CENTRAL, 0.180625 - q * q)
+	r = math.sqrt(-math.log(p if q < 0 else 1 - p))
+	if r <= 5:
+		x = _rational(_AS241_INTERMEDIATE, r - 1.6)
 	else:
-		# F^-1(p) = G^-1(1-p)
-		return round(rational_approximation(math.sqrt(-2 * math.log(1 - p))), 4)
+		x = _rational(_AS241_TAIL, r - 5)
+	return -x if q < 0 else x
+
+
+def _erfc_array(x):
+	"""Vectorized erfc for NumPy arrays (Cody's algorithm, like math.erfc)"""
+	y = np.abs(x)
+	output = np.zeros(x.shape)		#erfc(y) is below the smallest double for y >= 27.3
+	small = y <= 0.46875
+	output[small] = 1 - x[small] * _rational(_CODY_ERF, y[small] ** 2)		#erf is odd, sign of x kept
+	tail = ~small & (y < 27.3)
+	t = y[tail]
+	#exp(-t * t) is split into two factors, which avoids the rounding error of t * t
+	rounded = np.trunc(t * 16) / 16
+	scale = np.exp(-rounded * rounded) * np.exp(-(t - rounded) * (t + rounded))
+	z = 1 / t ** 2
+	output[tail] = scale * np.where(t <= 4, _rational(_CODY_ERFC, t),
+		(1 / math.sqrt(math.pi) - z * _rational(_CODY_ASYMPTOTIC, z)) / t)
+	flip = ~small & (x < 0)
+	output[flip] = 2 - output[flip]
+	output[np.isnan(x)] = np.nan
+	return output
 
 
 def normal_CDF(x):
-	"""Cumulative distribution function for the standard normal distribution"""
-	return (1 + math.erf(x / math.sqrt(2))) / 2
+	"""Cumulative distribution function for the standard normal distribution.
+	x can be a number or a list / array. Uses erfc, which stays accurate far
+	out in the lower tail"""
+	if not isinstance(x, numbers.Real):
+		if np is not None:
+			return _erfc_array(-np.asarray(x, dtype=np.float64) / math.sqrt(2)) / 2
+		return [normal_CDF(element) for element in x]
+	return math.erfc(-float(x) / math.sqrt(2)) / 2
+
+
+def _centered(data):
+	"""Returns the mean and the deviations from the mean of a given list"""
+	m = math.fsum(data) / len(data)
+	deviations = [x - m for x in data]
+	correction = math.fsum(deviations) / len(data)		#rounding error of m, large for a large offset
+	return m + correction, [d - correction for d in deviations]
+
+
+def _jackknife_mean(data):
+	n = len(data)
+	total = math.fsum(data)
+	return [(total - x) / (n - 1) for x in data]
+
+
+def _jackknife_sum(data):
+	total = math.fsum(data)
+	return [total - x for x in data]
+
+
+def _jackknife_sumsquares(data):
+	"""Leave-one-out sum of squared deviations, SS - n / (n - 1) * d_i^2"""
+	n = len(data)
+	m, deviations = _centered(data)
+	ss = math.fsum(d * d for d in deviations)
+	factor = n / (n - 1)
+	return [ss - factor * d * d for d in deviations]
+
+
+def _jackknife_kurtosis(data):
+	"""Leave-one-out kurtosis from the power sums of the deviations"""
+	n = len(data) - 1		#size of each jackknife sample
+	m, deviations = _centered(data)
+	p2 = math.fsum(d ** 2 for d in deviations)
+	p3 = math.fsum(d ** 3 for d in deviations)
+	p4 = math.fsum(d ** 4 for d in deviations)
+	output = []
+	for i, d in enumerate(deviations):
+		mu = -d / n		#shift of the mean, the deviations sum to zero
+		s2 = (p2 - d ** 2) / n
+		s3 = (p3 - d ** 3) / n
+		s4 = (p4 - d ** 4) / n
+		m2 = s2 - mu ** 2
+		if m2 <= 1e-6 * p2 / n:
+			#Cancellation, e.g. only the left out value differs from the
+			#others, so the moments are computed from the sample itself
+			output.append(kurtosis(data[:i] + data[i + 1:]))
+			continue
+		m4 = s4 - 4 * mu * s3 + 6 * mu ** 2 * s2 - 3 * mu ** 4
+		output.append(m4 / (m2 ** 2))
+	return output
+
+
+def _jackknife_median(data):
+	"""Leave-one-out median using the order statistics of the sorted list"""
+	n = len(data)
+	order = sorted(range(n), key=data.__getitem__)
+	ordered = [data[i] for i in order]
+	rank = [0] * n
+	for r, i in enumerate(order):
+		rank[i] = r
+
+	def value(r, j):
+		#j-th order statistic after removing the element of rank r
+		return ordered[j] if j < r else ordered[j + 1]
+
+	m = n - 1
+	output = []
+	for i in range(n):
+		r = rank[i]
+		if m % 2 == 1:
+			output.append(value(r, m // 2))
+		else:
+			output.append((value(r, m // 2 - 1) + value(r, m // 2)) / 2)
+	return output
+
+
+#Statistics with a leave-one-out shortcut in O(n) or O(n log n)
+JACKKNIFE_SHORTCUTS = {
+	statistics.mean: _jackknife_mean,
+	statistics.median: _jackknife_median,
+	sum: _jackknife_sum,
+	statistics.variance: lambda data: [ss / (len(data) - 2) for ss in _jackknife_sumsquares(data)],
+	statistics.pvariance: lambda data: [ss / (len(data) - 1) for ss in _jackknife_sumsquares(data)],
+	statistics.stdev: lambda data: [math.sqrt(ss / (len(data) - 2)) for ss in _jackknife_sumsquares(data)],
+	statistics.pstdev: lambda data: [math.sqrt(ss / (len(data) - 1)) for ss in _jackknife_sumsquares(data)],
+}
+if hasattr(statistics, "fmean"):		#Python 3.8 or newer
+	JACKKNIFE_SHORTCUTS[statistics.fmean] = _jackknife_mean
+
+
+#Vectorized kernels for all other statistics, evaluated on the leave-one-out
+#matrix. Filled by the kernel registry (kernels.py in Advanced examples)
+JACKKNIFE_KERNELS = {}
+
+
+def _jackknife_vectorized(kernel, data, blocksize=2 ** 22):
+	"""Evaluates a vectorized kernel on blocks of the leave-one-out matrix,
+	row i holds all elements except element i"""
+	values = np.asarray(data, dtype=np.float64)
+	n = len(values)
+	columns = np.arange(n - 1)
+	rows = max(1, blocksize // max(1, n - 1))
+	output = []
+	for start in range(0, n, rows):
+		skip = np.arange(start, min(n, start + rows))[:, None]
+		block = values[columns + (columns >= skip)]
+		with np.errstate(all="ignore"):		#undefined values are NaN, e.g. constant samples
+			output.extend(np.asarray(kernel(block), dtype=np.float64).tolist())
+	return output
 
 
 def jackknife(func, data):
 	"""Calculates the jackknife coefficients for a given list"""
+	try:
+		shortcut = JACKKNIFE_SHORTCUTS.get(func)
+		kernel = JACKKNIFE_KERNELS.get(func)
+	except TypeError:		#unhashable callable
+		shortcut = kernel = None
+	if shortcut is not None:
+		return shortcut(list(data))
+	if kernel is None:
+		kernel = getattr(func, "vectorized", None)
+	if kernel is not None and np is not None:
+		return _jackknife_vectorized(kernel, data)
+	data = list(data)
 	output = []
-	for element in data:
-		copylist = data[:]		#Copy original list
-		copylist.remove(element)
-		coef = func(copylist)
+	for i in range(len(data)):
+		coef = func(data[:i] + data[i + 1:])		#Copy without element i
 		output.append(coef)
 	return output
 
 
 def acceleration_coefficient(func, data):
 	"""Calculates the acceleration coefficient for a given list"""
-	jackvalues = jackknife(func, data)
-	mean_jackvalues = mean(jackvalues)
+	return acceleration(jackknife(func, data))
+
+
+def acceleration(jackvalues):
+	"""Calculates the acceleration coefficient from jackknife values, e.g.
+	leave-one-cluster-out values for clustered data"""
+	mean_jackvalues = math.fsum(jackvalues) / len(jackvalues)
 	nominator, denominator = 0, 0
 	for element in jackvalues:
 		nominator += (mean_jackvalues - element) ** 3
@@ -55,17 +282,138 @@ def acceleration_coefficient(func, data):
 	return nominator / (6 * (denominator ** 1.5))
 
 
+def alpha_levels(alpha):
+	"""Returns alpha as a list of levels and whether a single number was
+	given. Any other sequence (list, tuple, array) gives several levels"""
+	if isinstance(alpha, numbers.Real):
+		return [alpha], True
+	return list(alpha), False
+
+
+def percentiles(data, percents, is_sorted=False):
+	"""Computes several percentiles of a given list at once. The list is not
+	modified. Instead of sorting, only the needed order statistics are
+	selected (np.partition, O(n)), interpolation as in percentile. Objects
+	with their own percentiles method (quantile sketches) are asked directly"""
+	if hasattr(data, "percentiles"):
+		return data.percentiles(percents)
+	n = len(data)
+	positions = []
+	for percent in percents:
+		assert 0 <= percent <= 100, "Percent must be in [0, 100]"
+		positions.append((n - 1) * (percent / 100))
+	needed = set()
+	for position in positions:
+		needed.add(int(position))
+		if not position.is_integer():
+			needed.add(int(position) + 1)
+	needed = sorted(needed)
+	if is_sorted:
+		ordered = {k: data[k] for k in needed}
+	else:
+		values = np.asarray(data) if np is not None else None
+		if values is not None and values.ndim == 1 and values.dtype.kind in "iuf":
+			selected = np.partition(values, needed)		#returns a copy
+			ordered = {k: selected[k].item() for k in needed}
+		else:
+			selected = sorted(data)
+			ordered = {k: selected[k] for k in needed}
+	results = []
+	for position in positions:
+		if position.is_integer():
+			results.append(ordered[int(position)])
+		else:
+			lower = int(position)	#equivalent to math.floor(position)
+			d0 = ordered[lower] * ((lower + 1) - position)
+			d1 = ordered[lower + 1] * (position - lower)
+			results.append(d0 + d1)
+	return results
+
+
 def percentile(data, percent, is_sorted=False):
 	#Source: https://code.activestate.com/recipes/511478-finding-the-percentile-of-the-values/
-	"""Computes the percentile of a given list"""
-	assert 0 <= percent <= 100, "Percent must be in [0, 100]"
-	if not is_sorted:
-		data.sort()
-	position = (len(data) - 1) * (percent / 100)
-	if position.is_integer():
-		return data[int(position)]
+	"""Computes the percentile of a given list (the list is not modified)"""
+	return percentiles(data, [percent], is_sorted)[0]
+
+
+def percentile_errors(data, percents):
+	"""Monte Carlo standard errors of several percentiles of a list of
+	replications. The rank of an estimated percentile p has a standard
+	deviation of sqrt(n * p * (1 - p)), half the distance between the
+	percentiles one such deviation below and above is used as the error.
+	Distribution free, no density estimate needed"""
+	n = len(data)
+	shifted = []
+	for percent in percents:
+		p = percent / 100
+		step = math.sqrt(p * (1 - p) / n)
+		shifted += [max(0.0, p - step) * 100, min(1.0, p + step) * 100]
+	values = percentiles(data, shifted)
+	return [(values[i + 1] - values[i]) / 2 for i in range(0, len(values), 2)]
+
+
+def stdev_error(data):
+	"""Monte Carlo standard error of the standard deviation of a list of
+	replications (or a streaming summary), stdev * sqrt((kurtosis - 1) / (4 * n))"""
+	if hasattr(data, "kurtosis"):
+		sd, kurt = data.stdev(), data.kurtosis()
 	else:
-		lower = int(position)	#equivalent to math.floor(position)
-		d0 = data[lower] * ((lower + 1) - position)
-		d1 = data[lower + 1] * (position - lower)
-		return d0 + d1
+		sd, kurt = statistics.stdev(data), kurtosis(data)
+	if sd == 0:
+		return 0.0		#all replications equal
+	return sd * math.sqrt(max(0.0, kurt - 1) / (4 * len(data)))
+
+
+def kurtosis(data):
+	"""Computes the kurtosis (not excess kurtosis) of a given list"""
+	n = len(data)
+	m = sum(data) / n
+	m2 = sum((x - m) ** 2 for x in data) / n
+	m4 = sum((x - m) ** 4 for x in data) / n
+	if m2 == 0:
+		return math.nan		#constant data
+	return m4 / (m2 ** 2)
+
+
+JACKKNIFE_SHORTCUTS[kurtosis] = _jackknife_kurtosis
+
+
+def skewness(data):
+	"""Computes the skewness (moment coefficient m3 / m2 ** 1.5) of a given list"""
+	n = len(data)
+	m = sum(data) / n
+	m2 = sum((x - m) ** 2 for x in data) / n
+	m3 = sum((x - m) ** 3 for x in data) / n
+	if m2 == 0:
+		return math.nan		#constant data
+	return m3 / (m2 ** 1.5)
+
+
+def trimmed_mean(data, proportion=0.1):
+	"""Mean after removing int(proportion * n) of the smallest and of the
+	largest values"""
+	cut = int(proportion * len(data))
+	ordered = sorted(data)
+	return mean(ordered[cut:len(ordered) - cut])
+
+
+def iqr(data):
+	"""Interquartile range of a given list"""
+	lower, upper = percentiles(data, [25, 75])
+	return upper - lower
+
+
+def pearson_r(data):
+	"""Pearson's correlation coefficient of a list of (x, y) pairs"""
+	n = len(data)
+	meanx = sum(row[0] for row in data) / n
+	meany = sum(row[1] for row in data) / n
+	numerator = sum((row[0] - meanx) * (row[1] - meany) for row in data)
+	d1 = sum((row[0] - meanx) ** 2 for row in data)
+	d2 = sum((row[1] - meany) ** 2 for row in data)
+	return numerator / (d1 * d2) ** 0.5
+
+
+def ratio_of_means(data):
+	"""Ratio of the means of x and y for a list of (x, y) pairs"""
+	return sum(row[0] for row in data) / sum(row[1] for row in data)
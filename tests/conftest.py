@@ -0,0 +1,7 @@
+#The modules live in the repo root and in "Advanced examples", neither is a package
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "Advanced examples"))
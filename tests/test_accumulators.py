@@ -0,0 +1,50 @@
+#Streaming summaries against the in-memory results
+
+import statistics
+import random
+import numpy as np
+import pytest
+from accumulators import Moments, QuantileSketch
+from all_cis import bootstrap_ci
+
+
+_rng = random.Random(2)
+DATA = [_rng.expovariate(1) for i in range(80)]
+
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_streaming_se_boot_equals_in_memory(backend):
+	kwargs = dict(reps1=4000, seed=9, backend=backend, threads=1, quiet=True)
+	memory = bootstrap_ci(statistics.mean, DATA, **kwargs)
+	streaming = bootstrap_ci(statistics.mean, DATA, streaming=True, **kwargs)
+	assert streaming["se_boot"] == pytest.approx(memory["se_boot"], rel=1e-10)
+	assert streaming["mean_boot"] == pytest.approx(memory["mean_boot"], rel=1e-10)
+	#Up to sketch_size replications the sketch keeps every value
+	assert streaming["percentile"] == pytest.approx(memory["percentile"], rel=1e-12)
+
+
+def test_moments_merge_in_any_order():
+	values = np.random.default_rng(1).normal(5, 2, size=10_000)
+	merged = Moments()
+	for block in np.array_split(values, 37)[::-1]:
+		part = Moments()
+		part.add(block)
+		merged.merge(part)
+	assert merged.count == values.size
+	assert merged.mean == pytest.approx(values.mean(), rel=1e-12)
+	assert merged.stdev() == pytest.approx(values.std(ddof=1), rel=1e-12)
+
+
+def test_quantile_sketch_within_error_bound():
+	values = np.random.default_rng(2).normal(size=200_000)
+	sketch = QuantileSketch(k=256)
+	for block in np.array_split(values, 50):
+		part = QuantileSketch(k=256)
+		part.add(block)
+		sketch.merge(part)
+	assert sum(len(items) for items in sketch.levels) < 4 * 256
+	ordered = np.sort(values)
+	percents = [1, 2.5, 25, 50, 75, 97.5, 99]
+	for percent, value in zip(percents, sketch.percentiles(percents)):
+		rank = np.searchsorted(ordered, value) / values.size
+		assert abs(rank - percent / 100) <= sketch.error_bound()
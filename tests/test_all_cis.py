@@ -0,0 +1,110 @@
+#bootstrap_ci with statistics that fail or give degenerate replications
+
+import math
+import random
+import statistics
+import warnings
+import numpy as np
+import pytest
+from all_cis import bootstrap_ci
+from morestatistics import alpha_levels, kurtosis, skewness, normal_CDF, inverse_normal_CDF
+
+
+_rng = random.Random(3)
+DATA = [1.0] + [float(_rng.randint(2, 9)) for i in range(24)]		#exactly one 1
+
+
+def fails_on_repeated_one(values):
+	"""Mean that fails for resamples with the value 1 at least twice"""
+	if values.count(1.0) > 1:
+		raise ValueError("repeated 1")
+	return statistics.mean(values)
+
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+@pytest.mark.parametrize("streaming", [False, True])
+def test_failed_replications_are_counted_and_skipped(backend, streaming):
+	res = bootstrap_ci(fails_on_repeated_one, DATA, reps1=2000, seed=1, backend=backend, streaming=streaming,
+		threads=1, quiet=True)
+	assert 0 < res["failed"] < 2000
+	assert math.isfinite(res["se_boot"]) and res["se_boot"] > 0
+	assert all(math.isfinite(bound) for bound in res["percentile"] + res["bca"])
+
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+@pytest.mark.parametrize("streaming", [False, True])
+def test_constant_data(backend, streaming):
+	kwargs = dict(reps1=1000, seed=1, backend=backend, streaming=streaming, threads=1, quiet=True)
+	res = bootstrap_ci(statistics.mean, [4.0] * 20, mc_error=True, **kwargs)
+	assert res["se_boot"] == 0
+	assert res["percentile"] == (4.0, 4.0)
+	assert res["mc_error"]["percentile"] == (0.0, 0.0)
+	adaptive = bootstrap_ci(statistics.mean, [4.0] * 20, target_se=0.01, **kwargs)
+	assert adaptive["se_boot"] == 0
+
+
+@pytest.mark.parametrize("backend, resampling", [("python", "indices"), ("numpy", "indices"), ("numpy", "weights")])
+def test_nan_kernel_results_are_counted(backend, resampling):
+	#kurtosis is nan for constant resamples, the vectorized kernel gives NaN
+	with warnings.catch_warnings():
+		warnings.simplefilter("error")
+		res = bootstrap_ci(kurtosis, [1.0] * 8 + [2.0, 3.0], reps1=1000, seed=1, backend=backend,
+			resampling=resampling, threads=1, quiet=True)
+	assert 0 < res["failed"] < 1000
+	assert math.isfinite(res["se_boot"])
+
+
+def test_weights_need_the_numpy_backend():
+	with pytest.raises(ValueError, match="numpy backend"):
+		bootstrap_ci(statistics.mean, DATA, reps1=100, backend="python", resampling="weights", quiet=True)
+	with pytest.raises(ValueError, match="Unknown resampling"):
+		bootstrap_ci(statistics.mean, DATA, reps1=100, backend="numpy", resampling="counts", quiet=True)
+
+
+@pytest.mark.parametrize("func", [statistics.mean, statistics.median, statistics.stdev])
+def test_weights_match_indices_in_distribution(func):
+	#Multinomial counts and index resampling give the same bootstrap distribution
+	kwargs = dict(reps1=40000, backend="numpy", threads=1, quiet=True)
+	indices = bootstrap_ci(func, DATA, seed=1, resampling="indices", **kwargs)
+	weights = bootstrap_ci(func, DATA, seed=2, resampling="weights", **kwargs)
+	assert weights["failed"] == indices["failed"] == 0
+	assert weights["mean_boot"] == pytest.approx(indices["mean_boot"], abs=0.03 * indices["se_boot"])
+	assert weights["se_boot"] == pytest.approx(indices["se_boot"], rel=0.03)
+	for name in ("percentile", "bc"):
+		for bound1, bound2 in zip(weights[name], indices[name]):
+			assert bound1 == pytest.approx(bound2, abs=0.1 * indices["se_boot"])
+
+
+def test_alpha_sequences_and_numpy_scalars():
+	assert alpha_levels(np.float32(0.05)) == ([np.float32(0.05)], True)
+	assert alpha_levels((0.1, 0.05)) == ([0.1, 0.05], False)
+	kwargs = dict(reps1=500, seed=1, threads=1, quiet=True)
+	several = bootstrap_ci(statistics.mean, DATA, alpha=[0.1, 0.05], **kwargs)
+	for alpha in [(0.1, 0.05), np.array([0.1, 0.05])]:
+		assert bootstrap_ci(statistics.mean, DATA, alpha=alpha, **kwargs)["percentile"] == several["percentile"]
+	assert bootstrap_ci(statistics.mean, DATA, alpha=np.float64(0.05), **kwargs)["percentile"] == several["percentile"][0.05]
+
+
+def test_moments_of_constant_data_are_nan():
+	assert math.isnan(kurtosis([2.0] * 5))
+	assert math.isnan(skewness([2.0] * 5))
+
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_min_gives_nan_bca_bounds(backend):
+	#No replication is below theta_hat, the bias correction is infinite
+	res = bootstrap_ci(min, DATA, reps1=1000, seed=1, backend=backend, threads=1, quiet=True)
+	assert all(math.isnan(bound) for bound in res["bca"])
+	assert res["percentile"][0] == min(DATA)
+
+
+def test_normal_cdf_full_precision():
+	points = [-30.0, -8.5, -1.0, 0.0, 0.3, 2.0, 7.0]
+	cdf = normal_CDF(np.array(points))
+	for x, value in zip(points, cdf):
+		expected = math.erfc(-x / math.sqrt(2)) / 2
+		assert value == pytest.approx(expected, rel=1e-14)
+		assert normal_CDF(x) == pytest.approx(expected, rel=1e-14)
+	for p in (1e-300, 1e-10, 0.025, 0.5, 0.975, 1 - 1e-12):
+		assert normal_CDF(inverse_normal_CDF(p)) == pytest.approx(p, rel=1e-12)
+	assert inverse_normal_CDF(0.975) == pytest.approx(1.959963984540054, rel=1e-15)
@@ -0,0 +1,36 @@
+#Batch bootstrap of several statistics and groups
+
+import math
+import statistics
+import warnings
+import pytest
+from batchboot import bootstrap_table
+from all_cis import bootstrap_ci
+
+
+VALUES = [1.0, 2.0, 3.0, 4.0, 5.0, 9.0, 2.5, 6.0]
+GROUPS = [1, 1, 1, 2, 2, 3, 1, 2]		#group 3 has a single observation
+
+
+def test_singleton_group_gives_nan_cell():
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore", RuntimeWarning)		#sd of one value in the kernel
+		res = bootstrap_table(["mean", "sd"], VALUES, reps1=500, groups=GROUPS, seed=1, quiet=True,
+			contrasts=[(1, 3)])
+	cells = {(row["group"], row["statistic"]): row for row in res["table"]}
+	failed = cells[3, "sd"]
+	assert math.isnan(failed["theta_hat"]) and math.isnan(failed["se_boot"])
+	assert all(math.isnan(bound) for bound in failed["percentile"])
+	assert cells[3, "mean"]["theta_hat"] == 9.0
+	assert cells[1, "sd"]["se_boot"] > 0
+	assert res["failed"] == 500 + 1		#every replicate and theta_hat of the cell
+	contrast = {row["statistic"]: row for row in res["contrasts"]}
+	assert math.isnan(contrast["sd"]["se_boot"])
+	assert contrast["mean"]["theta_hat"] == pytest.approx(statistics.mean([1.0, 2.0, 3.0, 2.5]) - 9.0)
+
+
+def test_single_group_matches_bootstrap_ci():
+	table = bootstrap_table(["mean"], VALUES, reps1=2000, seed=4, quiet=True)["table"][0]
+	single = bootstrap_ci(statistics.mean, VALUES, reps1=2000, backend="numpy", quiet=True, seed=4)
+	assert table["theta_hat"] == single["theta_hat"]
+	assert table["se_boot"] == pytest.approx(single["se_boot"], rel=0.1)
@@ -0,0 +1,59 @@
+#CSV loading with text columns and the memory-mapped column cache
+
+import numpy as np
+import pytest
+import columnar
+from columnar import load_csv, read_csv
+
+
+def write_csv(path, rows):
+	path.write_text("name,grade,wage\n" + "".join(f"{row}\n" for row in rows))
+	return str(path)
+
+
+ROWS = ["anna,3,10.5", "ben,,12.0", "cara,5,NA", "dan,4,9.25"]
+
+
+def test_text_columns_stay_strings(tmp_path):
+	data = read_csv(write_csv(tmp_path / "data.csv", ROWS), chunksize=2)
+	assert data["name"].tolist() == ["anna", "ben", "cara", "dan"]
+	assert data["grade"].values.dtype == np.int64 and data["grade"].tolist() == [3, 5, 4]
+	assert data["wage"].tolist() == [10.5, 12.0, 9.25]
+
+
+def test_mixed_chunks_become_strings(tmp_path):
+	path = tmp_path / "mixed.csv"
+	path.write_text("code\n1\n2\nx7\n")
+	assert read_csv(str(path), chunksize=2)["code"].tolist() == ["1", "2", "x7"]
+
+
+def test_cache_miss_parses_requested_columns_and_hit_parses_nothing(tmp_path, monkeypatch):
+	path = write_csv(tmp_path / "data.csv", ROWS)
+	cache = str(tmp_path / "cache")
+	parsed = []
+	def counting_read_csv(path, columns=None, *args):
+		parsed.append(columns)
+		return read_csv(path, columns, *args)
+	monkeypatch.setattr(columnar, "read_csv", counting_read_csv)
+	first = load_csv(path, ["wage"], cache=cache)
+	assert parsed == [["wage"]]
+	assert isinstance(first["wage"].values, np.memmap)
+	second = load_csv(path, ["grade", "wage"], cache=cache)		#only grade is missing
+	assert parsed == [["wage"], ["grade"]]
+	assert second["grade"].tolist() == [3, 5, 4] and second["wage"].tolist() == first["wage"].tolist()
+	load_csv(path, ["wage", "grade"], cache=cache)		#hit
+	everything = load_csv(path, cache=cache)
+	assert parsed == [["wage"], ["grade"], ["name"]]
+	assert everything["name"].tolist() == ["anna", "ben", "cara", "dan"]
+	assert load_csv(path, cache=cache).keys() == everything.keys()
+	assert len(parsed) == 3
+
+
+def test_changed_file_is_parsed_again(tmp_path):
+	path = write_csv(tmp_path / "data.csv", ROWS)
+	cache = str(tmp_path / "cache")
+	assert load_csv(path, ["grade"], cache=cache)["grade"].tolist() == [3, 5, 4]
+	write_csv(tmp_path / "data.csv", ROWS + ["eve,1,8.0"])
+	assert load_csv(path, ["grade"], cache=cache)["grade"].tolist() == [3, 5, 4, 1]
+	with pytest.raises(KeyError):
+		load_csv(path, ["age"], cache=cache)
@@ -0,0 +1,83 @@
+#Worker pool: statistics that cannot be pickled, chunking and random streams
+
+import os
+import random
+import statistics
+import multiprocessing
+import pytest
+from all_cis import bootstrap_ci
+from permutationtests import permutationtest
+from engine import ResamplingEngine
+
+
+_rng = random.Random(5)
+DATA = [_rng.gauss(0, 1) for i in range(40)]
+
+
+def test_lambda_statistic_in_bootstrap_ci():
+	expected = bootstrap_ci(statistics.mean, DATA, reps1=1000, seed=3, threads=2, quiet=True)
+	res = bootstrap_ci(lambda values: statistics.mean(values), DATA, reps1=1000, seed=3, threads=2, quiet=True)
+	assert res["se_boot"] == expected["se_boot"]
+	assert res["percentile"] == expected["percentile"]
+
+
+def test_closure_statistic_with_engine():
+	cut = 0.5
+	def share_above(values):
+		return sum(1 for value in values if value > cut) / len(values)
+	with ResamplingEngine(2) as engine:
+		res = bootstrap_ci(share_above, DATA, reps1=500, seed=1, engine=engine, quiet=True)
+		assert res["failed"] == 0 and res["se_boot"] > 0
+		again = bootstrap_ci(share_above, DATA, reps1=500, seed=1, quiet=True, threads=1)
+	assert res["se_boot"] == again["se_boot"]
+
+
+@pytest.mark.parametrize("alpha_stop", [None, 0.05])
+def test_lambda_statistic_in_permutationtest(alpha_stop):
+	group1, group2 = DATA[:20], [value + 0.5 for value in DATA[20:]]
+	kwargs = dict(reps=1000, seed=2, threads=2, quiet=True, alpha_stop=alpha_stop, check_every=200)
+	expected = permutationtest(statistics.mean, group1, group2, **kwargs)
+	res = permutationtest(lambda values: statistics.mean(values), group1, group2, **kwargs)
+	assert res["p_value"] == expected["p_value"]
+
+
+def failing_kernel(block):
+	raise ValueError("kernel")
+
+
+def kernel_fails(values):
+	"""Mean whose vectorized kernel raises, so the worker computing the
+	replications raises (failures of the function itself are NaN)"""
+	return statistics.mean(values)
+
+
+kernel_fails.vectorized = failing_kernel
+
+
+def stdev_or_fail(values):
+	if list(values) not in (DATA[:20], DATA[20:]):
+		raise ValueError("resample")
+	return statistics.stdev(values)
+
+
+def shared_blocks():
+	return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="shared memory is not listed in /dev/shm")
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_failing_worker_leaves_no_processes_or_blocks(backend):
+	before = shared_blocks()
+	with pytest.raises(ValueError, match="kernel"):
+		bootstrap_ci(kernel_fails, DATA, reps1=200, seed=1, backend=backend, threads=2, quiet=True)
+	assert multiprocessing.active_children() == []
+	assert shared_blocks() == before
+	with ResamplingEngine(2) as engine:
+		with pytest.raises(ValueError, match="kernel"):
+			bootstrap_ci(kernel_fails, DATA, reps1=200, seed=1, backend=backend, engine=engine, quiet=True)
+		assert shared_blocks() == before
+		assert bootstrap_ci(statistics.mean, DATA, reps1=100, engine=engine, quiet=True)["se_boot"] > 0
+	with pytest.raises(ValueError, match="resample"):
+		permutationtest(stdev_or_fail, DATA[:20], DATA[20:], reps=200, seed=1, threads=2, quiet=True)
+	assert multiprocessing.active_children() == []
+	assert shared_blocks() == before
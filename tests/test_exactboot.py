@@ -0,0 +1,34 @@
+#Exact bootstrap against the enumeration of all n ** n resamples
+
+import itertools
+import statistics
+import numpy as np
+import pytest
+from exactboot import exact_bootstrap
+from engine import ResamplingEngine
+
+
+DATA = [1.0, 2.5, 2.5, 4.0, 7.0, 3.0]		#with a tie, so compositions have different weights
+
+
+def enumerate_resamples(func, data):
+	n = len(data)
+	return np.array([func([data[i] for i in indices]) for indices in itertools.product(range(n), repeat=n)])
+
+
+@pytest.mark.parametrize("func", [statistics.mean, sum, statistics.median, statistics.stdev, max])
+def test_exact_bootstrap_matches_enumeration(func):
+	res = exact_bootstrap(func, DATA)
+	values = enumerate_resamples(func, DATA)
+	assert res["theta_hat"] == func(DATA)
+	assert res["mean_boot"] == pytest.approx(values.mean(), rel=1e-12)
+	assert res["se_boot"] == pytest.approx(values.std(), rel=1e-12)
+	assert res["percentile"] == pytest.approx(tuple(np.percentile(values, [2.5, 97.5])), rel=1e-12)
+
+
+def test_exact_bootstrap_same_with_engine():
+	serial = exact_bootstrap(statistics.median, DATA)
+	with ResamplingEngine(2) as engine:
+		parallel = exact_bootstrap(statistics.median, DATA, engine=engine)
+	assert parallel["se_boot"] == pytest.approx(serial["se_boot"], rel=1e-12)
+	assert parallel["percentile"] == serial["percentile"]
@@ -0,0 +1,146 @@
+#Exact permutation tests against brute force enumeration
+
+import itertools
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import pytest
+from exactperm import revolving_door, exhaustive_sum_test, exact_paired_test
+from engine import ResamplingEngine
+from permutationtests import permutationtest
+
+
+@pytest.mark.parametrize("n, k", [(1, 1), (4, 0), (5, 1), (6, 3), (7, 4), (9, 2), (10, 5)])
+def test_revolving_door_visits_every_subset_once(n, k):
+	subset = set(range(k))
+	seen = [frozenset(subset)]
+	for out, new in revolving_door(n, k):
+		assert out in subset and new not in subset
+		subset.remove(out)
+		subset.add(new)
+		seen.append(frozenset(subset))
+	assert len(seen) == math.comb(n, k)
+	assert set(seen) == {frozenset(c) for c in itertools.combinations(range(n), k)}
+
+
+def brute_force_sum_test(data1, data2, alternative, func=statistics.mean):
+	values = list(data1) + list(data2)
+	n1 = len(data1)
+	observed = func(data1) - func(data2)
+	count = total = 0
+	for chosen in itertools.combinations(range(len(values)), n1):
+		group1 = [values[i] for i in chosen]
+		group2 = [values[i] for i in range(len(values)) if i not in chosen]
+		diff = func(group1) - func(group2)
+		if alternative == "greater":
+			count += diff >= observed - 1e-9
+		elif alternative == "less":
+			count += diff <= observed + 1e-9
+		else:
+			count += abs(diff) >= abs(observed) - 1e-9
+		total += 1
+	return count, total
+
+
+@pytest.mark.parametrize("alternative", ["greater", "less", "two-sided"])
+@pytest.mark.parametrize("seed", [1, 2])
+def test_exhaustive_sum_test_matches_brute_force(alternative, seed):
+	rng = random.Random(seed)
+	data1 = [rng.randint(0, 6) for i in range(5)]		#integers, so there are ties
+	data2 = [rng.randint(1, 8) for i in range(7)]
+	assert exhaustive_sum_test(data1, data2, alternative) == brute_force_sum_test(data1, data2, alternative)
+
+
+@pytest.mark.parametrize("alternative", ["auto", "greater", "less", "two-sided"])
+@pytest.mark.parametrize("data1, data2", [
+	([10, 10], [1] * 19 + [3]),
+	([4, 1, 7], [2, 5, 3, 3, 6, 0, 2]),
+	([0.5, 2.5, 1.0, 4.0], [3.0, 1.5, 2.0, 0.5, 5.5, 1.0, 2.5, 3.5]),
+])
+def test_exhaustive_sum_test_with_sum_and_unequal_sizes(data1, data2, alternative):
+	expected_alternative = alternative
+	if alternative == "auto":		#direction of the observed difference of the sums
+		expected_alternative = "greater" if sum(data1) - sum(data2) > 0 else "less"
+	expected = brute_force_sum_test(data1, data2, expected_alternative, func=sum)
+	assert exhaustive_sum_test(data1, data2, alternative, func=sum) == expected
+
+
+def test_permutationtest_exhaustive_sum_matches_brute_force():
+	res = permutationtest(sum, [10, 10], [1] * 19 + [3], reps=0, threads=1, quiet=True)
+	assert res["p_value"] == 1.0
+
+
+def test_exhaustive_sum_test_same_with_engine():
+	rng = random.Random(3)
+	data1 = [rng.gauss(0, 1) for i in range(6)]
+	data2 = [rng.gauss(0.5, 1) for i in range(8)]
+	with ResamplingEngine(2) as engine:
+		parallel = exhaustive_sum_test(data1, data2, "two-sided", engine=engine)
+	assert parallel == exhaustive_sum_test(data1, data2, "two-sided")
+	assert parallel == brute_force_sum_test(data1, data2, "two-sided")
+
+
+def brute_force_paired_test(differences, alternative):
+	observed = sum(differences)
+	count = 0
+	for signs in itertools.product((1, -1), repeat=len(differences)):
+		flipped = sum(sign * abs(d) for sign, d in zip(signs, differences))
+		if alternative == "greater":
+			count += flipped >= observed - 1e-9
+		elif alternative == "less":
+			count += flipped <= observed + 1e-9
+		else:
+			count += abs(flipped) >= abs(observed) - 1e-9
+	return count / 2 ** len(differences)
+
+
+@pytest.mark.parametrize("alternative", ["greater", "less", "two-sided"])
+@pytest.mark.parametrize("differences", [
+	[1, -2, 3, 3, 0, 5, -1, 2],
+	[0.5, 1.25, -0.75, 2.0, 0.5, -0.25, 1.5, 3.0, -1.0, 0.25],
+	[-3, -1, -4, 2, -5, -2],
+])
+def test_exact_paired_test_matches_enumeration(differences, alternative):
+	p_value, method = exact_paired_test(differences, alternative)
+	assert method == "dp"
+	assert p_value == pytest.approx(brute_force_paired_test(differences, alternative), abs=1e-12)
+
+
+@pytest.mark.parametrize("alternative", ["greater", "less", "two-sided"])
+@pytest.mark.parametrize("differences", [
+	[1e-7, 2, 3.3333333],
+	[random.Random(4).gauss(0.4, 1) for i in range(14)],
+	[0.1, -0.1, math.pi, -math.pi, math.e, 1 / 3, -2 / 3, 1 / 3],		#ties and a zero total
+])
+def test_exact_paired_test_non_integer_differences(differences, alternative):
+	p_value, method = exact_paired_test(differences, alternative)
+	assert method == "enumeration"
+	assert p_value == pytest.approx(brute_force_paired_test(differences, alternative), abs=1e-12)
+
+
+def test_exact_paired_test_fft_close_to_enumeration():
+	rng = random.Random(4)
+	differences = [rng.gauss(0.4, 1) for i in range(14)]
+	p_value, method = exact_paired_test(differences, "two-sided", max_enumeration=10)
+	assert method == "fft"
+	assert p_value == pytest.approx(brute_force_paired_test(differences, "two-sided"), abs=1e-3)
+
+
+def test_exact_paired_test_rejects_empty_input():
+	with pytest.raises(ValueError):
+		exact_paired_test([])
+
+
+def test_script_runs_from_its_directory():
+	#Only the numpy backend needs vectorperm, morestatistics is found in the repo root
+	directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Advanced examples")
+	code = ("import sys, statistics, permutationtests\n"
+		"permutationtests.permutationtest(statistics.mean, [55, 58, 60], [12, 22, 34], reps=0, threads=1, quiet=True)\n"
+		"assert 'vectorperm' not in sys.modules\n")
+	env = {key: value for key, value in os.environ.items() if key != "PYTHONPATH"}
+	for args in (["-c", code], ["permutationtests.py"]):
+		done = subprocess.run([sys.executable] + args, cwd=directory, env=env, capture_output=True, text=True)
+		assert done.returncode == 0, done.stderr
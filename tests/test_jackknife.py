@@ -0,0 +1,45 @@
+#Leave-one-out shortcuts and kernels against the brute force jackknife
+
+import math
+import random
+import statistics
+import pytest
+import kernels		#fills morestatistics.JACKKNIFE_KERNELS
+from morestatistics import jackknife, kurtosis, skewness, trimmed_mean, iqr
+
+
+def brute_force(func, data):
+	values = []
+	for i in range(len(data)):
+		try:
+			values.append(func(data[:i] + data[i + 1:]))
+		except statistics.StatisticsError:
+			values.append(math.nan)
+	return values
+
+
+def assert_same(values, expected):
+	assert len(values) == len(expected)
+	for value, reference in zip(values, expected):
+		if math.isnan(reference):
+			assert math.isnan(value)
+		else:
+			assert value == pytest.approx(reference, rel=1e-9, abs=1e-12)
+
+
+_rng = random.Random(6)
+SAMPLES = [
+	[_rng.gauss(0, 1) for i in range(30)],
+	[float(_rng.randint(0, 4)) for i in range(25)],		#many ties
+	[1.0] * 9 + [5.0],		#constant without the last value
+	[1.0, 1.0, 1.0, 5.0],
+	[3.0] * 6,
+	[1e8 + x for x in (0.0, 1.0, 1.0, 2.0, 7.0)],		#large offset
+]
+
+
+@pytest.mark.parametrize("data", SAMPLES)
+@pytest.mark.parametrize("func", [statistics.mean, statistics.median, statistics.variance, statistics.stdev,
+	statistics.pstdev, sum, kurtosis, skewness, trimmed_mean, iqr])
+def test_jackknife_matches_brute_force(func, data):
+	assert_same(jackknife(func, data), brute_force(func, data))
@@ -0,0 +1,69 @@
+#Stored replications give exactly the results of fresh runs
+
+import random
+import statistics
+import numpy as np
+import pytest
+from all_cis import bootstrap_ci, stored_intervals
+from replicatestore import ReplicateStore
+
+
+_rng = random.Random(8)
+DATA = [_rng.gauss(0, 1) for i in range(30)]
+RESULTS = ("se_boot", "mean_boot", "normal", "percentile", "bc", "bca", "failed")
+
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_stored_run_equals_fresh_run(tmp_path, backend):
+	store = ReplicateStore(str(tmp_path))
+	kwargs = dict(seed=5, backend=backend, threads=1, quiet=True)
+	fresh = bootstrap_ci(statistics.mean, DATA, reps1=200, **kwargs)
+	#Entries of other sizes must not be reused
+	bootstrap_ci(statistics.mean, DATA, reps1=300, store=store, **kwargs)
+	bootstrap_ci(statistics.mean, DATA, reps1=100, store=store, **kwargs)
+	first = bootstrap_ci(statistics.mean, DATA, reps1=200, store=store, **kwargs)
+	second = bootstrap_ci(statistics.mean, DATA, reps1=200, store=store, **kwargs)
+	assert first["store_key"] == second["store_key"] is not None
+	for name in RESULTS:
+		assert first[name] == fresh[name] == second[name]
+
+
+def test_adaptive_stored_run_equals_fresh_run(tmp_path):
+	store = ReplicateStore(str(tmp_path))
+	kwargs = dict(reps1=200, target_se=0.005, seed=2, backend="numpy", quiet=True)
+	fresh = bootstrap_ci(statistics.mean, DATA, **kwargs)
+	bootstrap_ci(statistics.mean, DATA, store=store, **kwargs)
+	stored = bootstrap_ci(statistics.mean, DATA, store=store, **kwargs)
+	assert stored["reps_used"] == fresh["reps_used"] > 200
+	for name in RESULTS + ("mc_error",):
+		assert stored[name] == fresh[name]
+
+
+def test_stored_intervals_round_trip(tmp_path):
+	store = ReplicateStore(str(tmp_path))
+	res = bootstrap_ci(statistics.median, DATA, reps1=500, seed=3, backend="numpy", store=store, quiet=True)
+	again = stored_intervals(store, res["store_key"], quiet=True)
+	for name in ("se_boot", "percentile", "bca"):
+		assert again[name] == pytest.approx(res[name], rel=1e-12)
+	levels = stored_intervals(store, res["store_key"], alpha=[0.1, 0.05], quiet=True)
+	assert levels["percentile"][0.05] == pytest.approx(res["percentile"], rel=1e-12)
+
+
+def test_save_load_round_trip_across_instances(tmp_path):
+	arrays = {"theta_stars": np.array([0.1, float("nan"), -2.5e300]), "tvalues": np.arange(3.0)}
+	ReplicateStore(str(tmp_path)).save("entry", arrays, {"failed": 1})
+	meta, loaded = ReplicateStore(str(tmp_path)).load("entry")		#e.g. a later session
+	assert meta["failed"] == 1 and meta["reps"] == 3 and sorted(meta["arrays"]) == sorted(arrays)
+	for name, values in arrays.items():
+		assert loaded[name].tobytes() == values.tobytes()
+	assert ReplicateStore(str(tmp_path)).load("missing") is None
+
+
+def test_reopened_store_reproduces_run(tmp_path):
+	kwargs = dict(reps1=300, reps2=20, seed=4, backend="numpy", inner_se="bootstrap", quiet=True)
+	first = bootstrap_ci(statistics.mean, DATA, store=ReplicateStore(str(tmp_path)), **kwargs)
+	again = bootstrap_ci(statistics.mean, DATA, store=ReplicateStore(str(tmp_path)), **kwargs)
+	assert again["store_key"] == first["store_key"]
+	assert len(ReplicateStore(str(tmp_path)).entries()) == 1		#loaded, not drawn and saved again
+	for name in RESULTS + ("double",):
+		assert again[name] == first[name]
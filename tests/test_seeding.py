@@ -0,0 +1,63 @@
+#Seeded runs give the same replications with any number of worker processes
+
+import random
+import statistics
+import pytest
+from all_cis import bootstrap_ci
+from permutationtests import permutationtest
+from engine import ResamplingEngine
+
+
+_rng = random.Random(1)
+DATA = [_rng.gauss(10, 3) for i in range(60)]
+
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_bootstrap_ci_same_with_any_thread_count(backend):
+	results = []
+	for threads in (1, 2, 3):
+		with ResamplingEngine(threads) as engine:
+			res = bootstrap_ci(statistics.median, DATA, reps1=2000, seed=42, backend=backend, engine=engine,
+				quiet=True)
+		results.append((res["se_boot"], res["percentile"], res["bca"]))
+	assert results[0] == results[1] == results[2]
+
+
+def test_bootstrap_ci_same_with_and_without_engine():
+	serial = bootstrap_ci(statistics.mean, DATA, reps1=2000, seed=7, backend="numpy", quiet=True)
+	with ResamplingEngine(2) as engine:
+		parallel = bootstrap_ci(statistics.mean, DATA, reps1=2000, seed=7, backend="numpy", engine=engine, quiet=True)
+	assert serial["se_boot"] == parallel["se_boot"]
+	assert serial["percentile"] == parallel["percentile"]
+
+
+def test_seed_changes_results():
+	first = bootstrap_ci(statistics.mean, DATA, reps1=2000, seed=1, threads=1, quiet=True)
+	second = bootstrap_ci(statistics.mean, DATA, reps1=2000, seed=2, threads=1, quiet=True)
+	assert first["se_boot"] != second["se_boot"]
+
+
+def test_permutationtest_same_with_any_thread_count():
+	group1, group2 = DATA[:30], [x + 1 for x in DATA[30:]]
+	p_values = [permutationtest(statistics.mean, group1, group2, reps=2000, threads=threads, seed=5,
+		quiet=True)["p_value"] for threads in (1, 2, 3)]
+	assert p_values[0] == p_values[1] == p_values[2]
+
+
+def test_double_bootstrap_same_with_and_without_engine():
+	kwargs = dict(reps1=400, reps2=25, seed=3, backend="numpy", inner_se="bootstrap", calibrate=True, quiet=True)
+	serial = bootstrap_ci(statistics.median, DATA, **kwargs)
+	with ResamplingEngine(2) as engine:
+		parallel = bootstrap_ci(statistics.median, DATA, engine=engine, **kwargs)
+	for name in ("se_boot", "percentile", "double", "calibrated", "failed_inner"):
+		assert serial[name] == parallel[name]
+
+
+@pytest.mark.parametrize("paired", [False, True])
+def test_numpy_permutationtest_same_with_and_without_engine(paired):
+	group1, group2 = DATA[:30], [x + 0.5 for x in DATA[30:]]
+	kwargs = dict(reps=3000, paired=paired, seed=9, backend="numpy", quiet=True)
+	serial = permutationtest(statistics.median, group1, group2, **kwargs)
+	with ResamplingEngine(2) as engine:
+		parallel = permutationtest(statistics.median, group1, group2, engine=engine, **kwargs)
+	assert serial["p_value"] == parallel["p_value"]